@@ -2,6 +2,9 @@
 ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Besides Django's HTTP handling it answers the lifespan protocol, which starts
+the push-event fan-out poller (see escrow.events) when LIVE_EVENTS_DB_FANOUT
+is on. Serve it with an ASGI server so /api/escrow/events/ can stream.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +16,12 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from escrow.events import lifespan  # noqa: E402  (needs the app registry loaded above)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    return await django_application(scope, receive, send)
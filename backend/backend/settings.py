@@ -82,15 +82,23 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware', # <-- ADD THIS for static files
+    'core.middleware.QueryBudgetMiddleware', # per-request SQL count/time; logs over-budget or slow requests
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware', # CORS Middleware
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ProfileResolverMiddleware', # request.profiles: caller's SME/lender profile, loaded once
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Query budgets (core.middleware.QueryBudgetMiddleware). Views may set their own
+# ``query_budget``; requests over it, or slower than SLOW_REQUEST_MS, are logged.
+QUERY_BUDGET_DEFAULT = int(os.getenv('QUERY_BUDGET_DEFAULT', 20))
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 500))
+QUERY_TIMING_HEADERS = os.getenv('QUERY_TIMING_HEADERS', str(DEBUG)) == 'True'
+
 # Granting frontend access
 CORS_ALLOW_ALL_ORIGINS = True # For hackathon, this is fine.
 
@@ -202,6 +210,56 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    # Sliding-window limits for views that set throttle_scope; <scope>_ip caps one address across accounts
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.ScopedUserThrottle',
+        'core.throttling.ScopedIPThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'auth': os.getenv('THROTTLE_AUTH', '10/min'),
+        'auth_ip': os.getenv('THROTTLE_AUTH_IP', '30/min'),
+        'upload': os.getenv('THROTTLE_UPLOAD', '20/hour'),
+        'upload_ip': os.getenv('THROTTLE_UPLOAD_IP', '60/hour'),
+        'ai': os.getenv('THROTTLE_AI', '5/hour'),
+        'ai_ip': os.getenv('THROTTLE_AI_IP', '20/hour'),
+    },
+    # Client IPs come from REMOTE_ADDR (0; DRF's None would trust the whole X-Forwarded-For, which
+    # clients can forge to dodge the _ip limits). Set NUM_PROXIES to the trusted proxy count when proxied.
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 0)),
+}
+
+# Throttle counters must be shared by every worker: Redis when THROTTLE_REDIS_URL is set
+# (needs the redis package), otherwise a file cache on local disk for single-host deployments.
+# Either keeps a throttle decision well under a millisecond. Tests use backend.test_settings,
+# which swaps both caches for in-memory ones.
+if os.getenv('THROTTLE_REDIS_URL'):
+    THROTTLE_CACHE = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.getenv('THROTTLE_REDIS_URL')}
+else:
+    THROTTLE_CACHE = {
+        'BACKEND': 'core.throttling.ThrottleFileCache',
+        'LOCATION': os.getenv('THROTTLE_CACHE_DIR', str(BASE_DIR / '.throttle_cache')),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+
+# Shared data cache (core.caching). Tag invalidations must reach every worker, so like the
+# throttle cache it defaults to Redis when CACHE_REDIS_URL is set and a file cache on local
+# disk otherwise. CACHE_BACKEND=locmem is per process and only safe with a single worker.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'redis' if os.getenv('CACHE_REDIS_URL') else 'file')
+CACHE_TIMEOUT = int(os.getenv('CACHE_TIMEOUT', '300'))
+if CACHE_BACKEND == 'redis':
+    DEFAULT_CACHE = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.getenv('CACHE_REDIS_URL')}
+elif CACHE_BACKEND == 'file':
+    DEFAULT_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_DIR', str(BASE_DIR / '.cache')),
+    }
+else:
+    DEFAULT_CACHE = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+DEFAULT_CACHE['TIMEOUT'] = CACHE_TIMEOUT
+
+CACHES = {
+    'default': DEFAULT_CACHE,
+    'throttle': THROTTLE_CACHE,
 }
 
 # Simple JWT Settings
@@ -215,11 +273,20 @@ SIMPLE_JWT = {
     'AUTH_HEADER_NAME': 'HTTP_AUTHORIZATION',
     'USER_ID_FIELD': 'id',
     'USER_ID_CLAIM': 'user_id',
+    # Request user for views on JWTStatelessUserAuthentication: built from the
+    # user_type / profile_id / is_staff claims without loading the User row
+    'TOKEN_USER_CLASS': 'users.tokens.ProfileTokenUser',
 
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY,
 }
 
+# Lender dashboard: marketplace-wide stats are shared by all lenders and refreshed on this interval (seconds)
+MARKETPLACE_SNAPSHOT_TTL = int(os.getenv('MARKETPLACE_SNAPSHOT_TTL', 300))
+
+# Admin analytics: the daily rollup reads only rows at least this old (seconds), so transactions still open when it runs are not skipped
+PLATFORM_STATS_ROLLUP_LAG = int(os.getenv('PLATFORM_STATS_ROLLUP_LAG', 300))
+
 # AI Configuration
 GOOGLE_AI_API_KEY = os.getenv('GOOGLE_AI_API_KEY')
 
@@ -231,6 +298,24 @@ MONO_BASE_URL = 'https://api.withmono.com'
 PAYSTACK_SECRET_KEY = os.getenv('PAYSTACK_SECRET_KEY', 'sk_test_...')
 PAYSTACK_PUBLIC_KEY = os.getenv('PAYSTACK_PUBLIC_KEY', 'pk_test_...')
 PAYSTACK_CALLBACK_URL = os.getenv('PAYSTACK_CALLBACK_URL', 'https://yourdomain.com/api/escrow/webhook/')
+PAYSTACK_BASE_URL = os.getenv('PAYSTACK_BASE_URL', 'https://api.paystack.co')
+PAYSTACK_TIMEOUT = float(os.getenv('PAYSTACK_TIMEOUT', 10))
+PAYSTACK_MAX_RETRIES = int(os.getenv('PAYSTACK_MAX_RETRIES', 2))
+PAYSTACK_RETRY_BACKOFF = float(os.getenv('PAYSTACK_RETRY_BACKOFF', 0.5))  # seconds, doubled per attempt with full jitter
+PAYSTACK_POOL_MAXSIZE = int(os.getenv('PAYSTACK_POOL_MAXSIZE', 10))
+BANK_DIRECTORY_TTL = int(os.getenv('BANK_DIRECTORY_TTL', 3600))  # seconds before a process reloads the bank index
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 86400))  # seconds a stored response is replayed for an Idempotency-Key
+IDEMPOTENCY_IN_PROGRESS_LEASE = int(os.getenv('IDEMPOTENCY_IN_PROGRESS_LEASE', 300))  # seconds an unfinished request holds its key before a retry may take it over
+LIVE_EVENTS_DB_FANOUT = os.getenv('LIVE_EVENTS_DB_FANOUT', 'False') == 'True'  # relay push events through the DB when running several workers
+LIVE_EVENTS_POLL_INTERVAL = float(os.getenv('LIVE_EVENTS_POLL_INTERVAL', 1.0))  # seconds between fan-out polls
+LIVE_EVENTS_COMMIT_GRACE = float(os.getenv('LIVE_EVENTS_COMMIT_GRACE', 10))  # seconds the poller keeps looking for fan-out rows that committed out of id order
+LIVE_EVENTS_HEARTBEAT = float(os.getenv('LIVE_EVENTS_HEARTBEAT', 15))  # seconds of silence before an event stream sends a keepalive
+LIVE_EVENTS_RETRY_MS = int(os.getenv('LIVE_EVENTS_RETRY_MS', 3000))  # EventSource reconnect delay
+BULK_ONBOARDING_HASH_WORKERS = int(os.getenv('BULK_ONBOARDING_HASH_WORKERS', os.cpu_count() or 1))  # password hashing processes per bulk onboarding upload
+
+# Outbox notifications are sent by `manage.py dispatch_outbox`; the console backend just logs them
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'PulseFI <no-reply@pulsefi.app>')
 
 
 # --- ADDED THIS SECTION ---
@@ -0,0 +1,14 @@
+"""
+Settings for test runs (``manage.py test`` selects them; other runners should set
+DJANGO_SETTINGS_MODULE=backend.test_settings).
+
+Both caches are in-memory, so throttle counters and cached responses never carry
+over between runs or leak into the file caches a local server uses.
+"""
+from .settings import *  # noqa: F401,F403
+
+CACHE_BACKEND = 'locmem'
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'TIMEOUT': CACHE_TIMEOUT},  # noqa: F405
+    'throttle': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'throttle'},
+}
@@ -4,6 +4,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 from lender.views import AdminAnalyticsView
+from core.views import CacheStatsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -12,7 +13,9 @@ urlpatterns = [
     path('api/auth/', include('users.urls')),
     path('api/sme/', include('sme.urls')),
     path('api/lender/', include('lender.urls')),
+    path('api/escrow/', include('escrow.urls')),
     path('api/admin/analytics/overview', AdminAnalyticsView.as_view(), name='admin-analytics'),
+    path('api/admin/cache-stats', CacheStatsView.as_view(), name='admin-cache-stats'),
     
     # Legacy endpoints (for backward compatibility)
     path('auth/', include('users.urls')),
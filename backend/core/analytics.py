@@ -0,0 +1,136 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import DailyPlatformStats, RollupWatermark
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PlatformStatsRollup:
+    """
+    Incremental daily rollup of platform activity into DailyPlatformStats.
+
+    Each source is read only past its watermark (last id for append-only
+    tables, last timestamp for event columns), so a run costs a few indexed
+    range scans plus one UPDATE per touched day.
+
+    Watermarks stop ``lag`` short of now: a row stamped just before a run may
+    still be in an open transaction, and reading up to now would move the
+    watermark past it before it commits.
+    """
+
+    def __init__(self, now=None, lag=None):
+        self.now = now or timezone.now()
+        self.lag = timedelta(seconds=settings.PLATFORM_STATS_ROLLUP_LAG) if lag is None else lag
+        self.cutoff = self.now - self.lag
+
+    def _sources(self):
+        from sme.models import BusinessProfile
+        from lender.models import LenderProfile
+        from escrow.models import LoanApplication, Transaction
+
+        # (watermark name, queryset, watermark column, day column, {metric: aggregate})
+        return [
+            ('new_smes', BusinessProfile.objects.all(), 'id', 'created_at',
+             {'new_smes': Count('id')}),
+            ('new_lenders', LenderProfile.objects.all(), 'id', 'created_at',
+             {'new_lenders': Count('id')}),
+            ('verifications', BusinessProfile.objects.filter(verification_status='verified'), 'verified_at', 'verified_at',
+             {'verifications': Count('id')}),
+            ('deals', LoanApplication.objects.all(), 'disbursement_date', 'disbursement_date',
+             {'deals_completed': Count('id'), 'funding_volume': Sum('loan_amount')}),
+            ('platform_fees', Transaction.objects.filter(transaction_type='fee', status='completed'), 'completed_at', 'completed_at',
+             {'platform_fees': Sum('amount')}),
+        ]
+
+    def run(self):
+        """Fold all rows past each watermark into the daily table. Returns {day: {metric: delta}}."""
+        deltas = defaultdict(lambda: defaultdict(int))
+
+        with transaction.atomic():
+            for name, queryset, cursor_field, day_field, aggregates in self._sources():
+                watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(source=name)
+
+                if cursor_field == 'id':
+                    new_rows = queryset.filter(id__gt=watermark.last_id)
+                    high_id = new_rows.filter(**{f'{day_field}__lte': self.cutoff}).order_by('-id').values_list('id', flat=True).first()
+                    if high_id is None:
+                        continue
+                    new_rows = new_rows.filter(id__lte=high_id)
+                    watermark.last_id = high_id
+                else:
+                    if watermark.last_timestamp and watermark.last_timestamp >= self.cutoff:
+                        continue
+                    new_rows = queryset.filter(**{f'{cursor_field}__lte': self.cutoff})
+                    if watermark.last_timestamp:
+                        new_rows = new_rows.filter(**{f'{cursor_field}__gt': watermark.last_timestamp})
+                    watermark.last_timestamp = self.cutoff
+
+                per_day = new_rows.annotate(day=TruncDate(day_field)).values('day').annotate(**aggregates).order_by()
+                for row in per_day:
+                    for metric in aggregates:
+                        deltas[row['day']][metric] += row[metric] or 0
+                watermark.save()
+
+            for day in sorted(deltas):
+                self._apply(day, deltas[day])
+
+        if deltas:
+            logger.info(f"Platform rollup touched {len(deltas)} day(s)")
+        return deltas
+
+    def _apply(self, day, metrics):
+        """Add one day's deltas to its row and to the running totals of that day and every later day."""
+        if not DailyPlatformStats.objects.filter(day=day).exists():
+            previous = DailyPlatformStats.objects.filter(day__lt=day).order_by('-day').first()
+            DailyPlatformStats.objects.create(day=day, **{
+                f'cum_{metric}': getattr(previous, f'cum_{metric}') if previous else 0
+                for metric in DailyPlatformStats.METRICS
+            })
+
+        DailyPlatformStats.objects.filter(day=day).update(**{
+            metric: F(metric) + delta for metric, delta in metrics.items()
+        })
+        DailyPlatformStats.objects.filter(day__gte=day).update(**{
+            f'cum_{metric}': F(f'cum_{metric}') + delta for metric, delta in metrics.items()
+        })
+
+
+def _totals_at(day):
+    """Running totals as of the end of ``day`` (zeros before the first rollup row)."""
+    row = DailyPlatformStats.objects.filter(day__lte=day).order_by('-day').first()
+    return {
+        metric: getattr(row, f'cum_{metric}') if row else (Decimal('0') if metric in ('funding_volume', 'platform_fees') else 0)
+        for metric in DailyPlatformStats.METRICS
+    }
+
+
+def stats_for_range(start, end):
+    """Activity between ``start`` and ``end`` inclusive, from two indexed lookups regardless of range length."""
+    upper = _totals_at(end)
+    lower = _totals_at(start - timedelta(days=1))
+    return {metric: upper[metric] - lower[metric] for metric in DailyPlatformStats.METRICS}
+
+
+def _live_totals():
+    """All-time totals aggregated straight from the source tables."""
+    totals = {}
+    for _, queryset, cursor_field, _, aggregates in PlatformStatsRollup(lag=timedelta(0))._sources():
+        if cursor_field != 'id':
+            queryset = queryset.filter(**{f'{cursor_field}__isnull': False})
+        for metric, value in queryset.aggregate(**aggregates).items():
+            totals[metric] = value or (Decimal('0') if metric in ('funding_volume', 'platform_fees') else 0)
+    return totals
+
+
+def platform_totals():
+    """All-time totals from the latest rollup row, or from the live tables before the first rollup."""
+    if not DailyPlatformStats.objects.exists():
+        return _live_totals()
+    return _totals_at(timezone.now().date())
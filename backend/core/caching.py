@@ -0,0 +1,168 @@
+import functools
+import hashlib
+import threading
+import uuid
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction as db_transaction
+from django.db.models import Model
+from django.db.models.signals import post_save, post_delete
+from rest_framework.response import Response
+
+_MISSING = object()
+
+
+class CacheStats:
+    """Thread-safe hit/miss counters per cached function or view, for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, hit):
+        with self._lock:
+            stats = self._stats.setdefault(name, {'hits': 0, 'misses': 0})
+            stats['hits' if hit else 'misses'] += 1
+
+    def snapshot(self):
+        """{name: {hits, misses, hit_ratio}}"""
+        with self._lock:
+            return {
+                name: {
+                    'hits': stats['hits'],
+                    'misses': stats['misses'],
+                    'hit_ratio': round(stats['hits'] / (stats['hits'] + stats['misses']), 3),
+                }
+                for name, stats in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+cache_stats = CacheStats()
+
+
+# --- Tags ---
+
+def _tag_key(tag):
+    return f"tag:{tag}"
+
+
+def tag_versions(tags):
+    """
+    Current version token of each tag. A tag with no token (never used,
+    invalidated or evicted) gets a fresh random one, so entries stored under
+    an older token can never be served again.
+    """
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex[:12] for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def invalidate(*tags):
+    """
+    Expire every entry cached under any of ``tags``. Runs once the current
+    transaction commits, so a concurrent reader cannot re-cache the old rows.
+    """
+    tags = [tag for tag in tags if tag]
+    if tags:
+        db_transaction.on_commit(lambda: cache.delete_many([_tag_key(tag) for tag in tags]))
+
+
+def invalidate_on_change(model, tagger, deletes=True):
+    """
+    Invalidate ``tagger(instance)`` whenever an instance of ``model`` is saved
+    or, with ``deletes``, deleted. A delete receiver stops queryset deletes of
+    the model from being a single fast DELETE, so models only deleted in bulk
+    should pass deletes=False and invalidate at the call site instead.
+    """
+    def receiver(sender, instance, raw=False, **kwargs):
+        if not raw:
+            invalidate(*tagger(instance))
+
+    uid = f"cache-tags:{model._meta.label_lower}"
+    post_save.connect(receiver, sender=model, weak=False, dispatch_uid=uid)
+    if deletes:
+        post_delete.connect(receiver, sender=model, weak=False, dispatch_uid=uid)
+
+
+# --- Decorators ---
+
+def _key_part(value):
+    if isinstance(value, Model):
+        return f"{value._meta.label_lower}:{value.pk}"
+    return repr(value)
+
+
+def entry_key(name, tags, args=(), kwargs=None):
+    """Cache key for one call: the callable, its arguments and the current version of each tag."""
+    parts = [_key_part(arg) for arg in args]
+    parts += [f"{key}={_key_part(value)}" for key, value in sorted((kwargs or {}).items())]
+    parts += tag_versions(tags)
+    return f"cached:{name}:{hashlib.md5(chr(31).join(parts).encode()).hexdigest()}"
+
+
+def cached(tags, timeout=DEFAULT_TIMEOUT):
+    """
+    Cache a function's return value until ``timeout`` (default: the cache's
+    TIMEOUT) or until one of its tags is invalidated. ``tags`` is a list of
+    tags or a callable taking the function's arguments, e.g.
+    ``lambda lender_profile: [f"lender:{lender_profile.pk}"]``.
+
+    Model arguments are keyed by primary key. Return values must be picklable:
+    evaluate querysets (``list(...)``) rather than returning them lazily.
+    Exceptions are not cached. ``func.uncached`` bypasses the cache.
+    """
+    def decorator(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            entry_tags = tags(*args, **kwargs) if callable(tags) else tags
+            key = entry_key(name, entry_tags, args, kwargs)
+            value = cache.get(key, _MISSING)
+            cache_stats.record(name, hit=value is not _MISSING)
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                cache.set(key, value, timeout)
+            return value
+
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def cache_response(tags, timeout=DEFAULT_TIMEOUT):
+    """
+    Cache the data of successful responses from a DRF view handler, per user
+    and full URL. ``tags(request, *args, **kwargs)`` returns the entry's tags,
+    or None to skip the cache for that request.
+    """
+    def decorator(view_method):
+        name = f"{view_method.__module__}.{view_method.__qualname__}"
+
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            entry_tags = tags(request, *args, **kwargs)
+            if entry_tags is None:
+                return view_method(self, request, *args, **kwargs)
+
+            key = entry_key(name, entry_tags, (request.user.pk, request.build_absolute_uri()))
+            data = cache.get(key, _MISSING)
+            cache_stats.record(name, hit=data is not _MISSING)
+            if data is not _MISSING:
+                return Response(data)
+
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data, timeout)
+            return response
+
+        return wrapper
+    return decorator
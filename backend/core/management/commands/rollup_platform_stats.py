@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from core.analytics import PlatformStatsRollup
+
+
+class Command(BaseCommand):
+    help = "Fold new platform activity into the daily stats table (run periodically, e.g. every 5 minutes from cron)."
+
+    def handle(self, *args, **options):
+        deltas = PlatformStatsRollup().run()
+        for day in sorted(deltas):
+            changes = ", ".join(f"{metric}+{value}" for metric, value in deltas[day].items() if value)
+            self.stdout.write(f"{day}: {changes or 'no change'}")
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {len(deltas)} day(s)"))
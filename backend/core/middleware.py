@@ -0,0 +1,149 @@
+import logging
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileResolver:
+    """
+    The caller's BusinessProfile or LenderProfile, loaded at most once per request.
+
+    Lookups are lazy: nothing is queried until a view asks, and by then DRF has
+    authenticated the request and set ``request.user``. The profile comes with
+    its user (select_related), so serializers that nest ``profile.user`` do not
+    query again.
+    """
+
+    def __init__(self, request):
+        self._request = request
+        self._cache = {}
+
+    def _load(self, model):
+        user = self._request.user
+        key = (model, user.pk)
+        if key not in self._cache:
+            profile = None
+            if user.is_authenticated:
+                profile = model.objects.select_related('user').filter(user_id=user.pk).first()
+            self._cache[key] = profile
+        return self._cache[key]
+
+    @property
+    def business(self):
+        """The caller's BusinessProfile, or None."""
+        from sme.models import BusinessProfile
+        return self._load(BusinessProfile)
+
+    @property
+    def lender(self):
+        """The caller's LenderProfile, or None."""
+        from lender.models import LenderProfile
+        return self._load(LenderProfile)
+
+    def get_business(self):
+        """Like ``business`` but raises BusinessProfile.DoesNotExist, for views that already handle it."""
+        from sme.models import BusinessProfile
+        profile = self.business
+        if profile is None:
+            raise BusinessProfile.DoesNotExist("Business profile not found")
+        return profile
+
+    def get_lender(self):
+        """Like ``lender`` but raises LenderProfile.DoesNotExist."""
+        from lender.models import LenderProfile
+        profile = self.lender
+        if profile is None:
+            raise LenderProfile.DoesNotExist("Lender profile not found")
+        return profile
+
+
+class ProfileResolverMiddleware:
+    """Attach a ProfileResolver to every request as ``request.profiles``."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.profiles = ProfileResolver(request)
+        return self.get_response(request)
+
+
+# Savepoints are transaction bookkeeping, not data access; they are not counted
+SAVEPOINT_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class QueryCounter:
+    """Database execute_wrapper counting statements and the time spent running them."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if not sql.lstrip().upper().startswith(SAVEPOINT_STATEMENTS):
+                self.count += 1
+                self.duration += time.perf_counter() - start
+
+
+def view_query_budget(view_func, method):
+    """
+    Query budget declared by a view: its ``query_budget`` attribute, either a
+    number or, on viewsets, a dict keyed by action. Undeclared budgets are
+    settings.QUERY_BUDGET_DEFAULT; None means the view is not budgeted (e.g.
+    imports whose query count grows with the upload).
+    """
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    budget = getattr(view_class, 'query_budget', settings.QUERY_BUDGET_DEFAULT)
+    if isinstance(budget, dict):
+        action = (getattr(view_func, 'actions', None) or {}).get(method.lower())
+        budget = budget.get(action, settings.QUERY_BUDGET_DEFAULT)
+    return budget
+
+
+class QueryBudgetMiddleware:
+    """
+    Count the SQL statements each request runs and the time they take.
+
+    Requests over their view's query budget, or slower than
+    settings.SLOW_REQUEST_MS, are logged as warnings. The numbers are kept on
+    the response as ``query_stats`` (for core.testing.QueryBudgetMixin) and,
+    with settings.QUERY_TIMING_HEADERS, sent as X-Query-Count and
+    Server-Timing headers. Queries run while a streaming response is consumed
+    are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(counter))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - start) * 1000
+        db_ms = counter.duration * 1000
+        budget = getattr(request, '_query_budget', settings.QUERY_BUDGET_DEFAULT)
+
+        response.query_stats = {'queries': counter.count, 'db_ms': db_ms, 'total_ms': total_ms, 'budget': budget}
+        if (budget is not None and counter.count > budget) or total_ms > settings.SLOW_REQUEST_MS:
+            match = request.resolver_match
+            logger.warning(
+                "%s %s (%s) ran %d queries (budget %s) taking %.1f ms of %.1f ms",
+                request.method, request.path, match.view_name if match else None, counter.count, budget, db_ms, total_ms,
+            )
+        if settings.QUERY_TIMING_HEADERS:
+            response['X-Query-Count'] = str(counter.count)
+            response['Server-Timing'] = f'db;dur={db_ms:.1f};desc="{counter.count} queries", total;dur={total_ms:.1f}'
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = view_query_budget(view_func, request.method)
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPlatformStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('new_smes', models.IntegerField(default=0)),
+                ('new_lenders', models.IntegerField(default=0)),
+                ('verifications', models.IntegerField(default=0)),
+                ('deals_completed', models.IntegerField(default=0)),
+                ('funding_volume', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('platform_fees', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('cum_new_smes', models.IntegerField(default=0)),
+                ('cum_new_lenders', models.IntegerField(default=0)),
+                ('cum_verifications', models.IntegerField(default=0)),
+                ('cum_deals_completed', models.IntegerField(default=0)),
+                ('cum_funding_volume', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('cum_platform_fees', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'core_daily_platform_stats',
+                'ordering': ['day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'core_rollup_watermarks',
+            },
+        ),
+    ]
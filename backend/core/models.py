@@ -1,3 +1,86 @@
 from django.db import models
 
-# Core models have been moved to their respective apps (sme, lender, escrow, etc.)
\ No newline at end of file
+# Core models have been moved to their respective apps (sme, lender, escrow, etc.)
+# What lives here is cross-app platform bookkeeping.
+
+class DailyPlatformStats(models.Model):
+    """
+    One row per day with that day's platform activity and running totals.
+    Running totals make any date range two indexed lookups: cum(end) - cum(start - 1).
+    """
+    METRICS = [
+        'new_smes', 'new_lenders', 'verifications',
+        'deals_completed', 'funding_volume', 'platform_fees',
+    ]
+
+    day = models.DateField(unique=True)
+
+    # Activity on this day
+    new_smes = models.IntegerField(default=0)
+    new_lenders = models.IntegerField(default=0)
+    verifications = models.IntegerField(default=0)
+    deals_completed = models.IntegerField(default=0)
+    funding_volume = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    platform_fees = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+
+    # Running totals up to and including this day
+    cum_new_smes = models.IntegerField(default=0)
+    cum_new_lenders = models.IntegerField(default=0)
+    cum_verifications = models.IntegerField(default=0)
+    cum_deals_completed = models.IntegerField(default=0)
+    cum_funding_volume = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    cum_platform_fees = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'core_daily_platform_stats'
+        ordering = ['day']
+
+    def __str__(self):
+        return f"Platform stats for {self.day}"
+
+class RollupWatermark(models.Model):
+    """How far the daily rollup has read each source table."""
+    source = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'core_rollup_watermarks'
+
+    def __str__(self):
+        return f"{self.source} @ {self.last_id or self.last_timestamp}"
+
+class OutboxMessage(models.Model):
+    """
+    A notification written in the same transaction as the state change that
+    caused it, and sent later by the outbox dispatcher (see core.outbox).
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    topic = models.CharField(max_length=50)
+    payload = models.JSONField()
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # Earliest time a dispatcher may pick the message up: pushed forward while
+    # it is claimed (a lease) and after each failure (backoff)
+    available_at = models.DateTimeField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'core_outbox_messages'
+        ordering = ['id']
+        indexes = [models.Index(fields=['status', 'available_at'], name='core_outbox_ready_idx')]
+
+    def __str__(self):
+        return f"{self.topic} ({self.status})"
@@ -0,0 +1,123 @@
+import logging
+from datetime import timedelta
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+# A claimed message is handed to another dispatcher if it is not settled within this time
+LEASE = timedelta(minutes=5)
+RETRY_BASE = timedelta(seconds=30)
+
+
+# --- Writing (inside the caller's transaction) ---
+
+def notification(topic, to, subject, body, **context):
+    """Unsaved outbox row for an email notification; ``to`` is a list of addresses."""
+    return OutboxMessage(
+        topic=topic,
+        payload={'to': [address for address in to if address], 'subject': subject, 'body': body, 'context': context},
+        available_at=timezone.now(),
+    )
+
+
+def enqueue(*messages):
+    """
+    Write outbox rows. Call this inside the transaction that makes the state
+    change, so the notification exists if and only if the change committed.
+    """
+    messages = [message for message in messages if message.payload.get('to')]
+    return OutboxMessage.objects.bulk_create(messages)
+
+
+def notify(topic, to, subject, body, **context):
+    return enqueue(notification(topic, to, subject, body, **context))
+
+
+# --- Dispatching ---
+
+def send_email(message, connection):
+    payload = message.payload
+    EmailMessage(payload['subject'], payload['body'], to=payload['to'], connection=connection).send()
+
+
+class OutboxDispatcher:
+    """
+    Drains the outbox in batches with at-least-once delivery.
+
+    A batch is claimed in one short transaction (skip-locked, lease pushed onto
+    available_at), sent with no transaction open over one mail connection, then
+    settled with bulk updates. A dispatcher that dies mid-batch leaves its rows
+    to be re-sent when the lease runs out, so handlers must tolerate duplicates.
+    """
+
+    def __init__(self, batch_size=100, handlers=None):
+        self.batch_size = batch_size
+        self.handlers = handlers or {}
+
+    def drain(self):
+        """Dispatch batches until nothing is ready. Returns {'sent': n, 'retry': n, 'failed': n}."""
+        totals = {'sent': 0, 'retry': 0, 'failed': 0}
+        while True:
+            counts = self.dispatch_batch()
+            if not counts:
+                return totals
+            for key, value in counts.items():
+                totals[key] += value
+
+    def dispatch_batch(self):
+        messages = self._claim()
+        if not messages:
+            return {}
+
+        sent, errors = [], {}
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+            for message in messages:
+                handler = self.handlers.get(message.topic, send_email)
+                try:
+                    handler(message, connection)
+                    sent.append(message)
+                except Exception as e:
+                    logger.warning(f"Outbox message #{message.id} ({message.topic}) failed: {e}")
+                    errors[message.id] = str(e)
+        finally:
+            connection.close()
+
+        return self._settle(sent, [message for message in messages if message.id in errors], errors)
+
+    def _claim(self):
+        now = timezone.now()
+        with db_transaction.atomic():
+            messages = list(
+                OutboxMessage.objects.select_for_update(skip_locked=True)
+                .filter(status='pending', available_at__lte=now).order_by('id')[:self.batch_size]
+            )
+            OutboxMessage.objects.filter(id__in=[message.id for message in messages]).update(
+                available_at=now + LEASE, attempts=F('attempts') + 1
+            )
+        for message in messages:
+            message.attempts += 1
+        return messages
+
+    def _settle(self, sent, failed, errors):
+        now = timezone.now()
+        OutboxMessage.objects.filter(id__in=[message.id for message in sent]).update(
+            status='sent', sent_at=now, last_error=''
+        )
+        counts = {'sent': len(sent), 'retry': 0, 'failed': 0}
+        for message in failed:
+            message.last_error = errors[message.id]
+            if message.attempts >= MAX_ATTEMPTS:
+                message.status = 'failed'
+                counts['failed'] += 1
+            else:
+                message.available_at = now + RETRY_BASE * 2 ** (message.attempts - 1)
+                counts['retry'] += 1
+        OutboxMessage.objects.bulk_update(failed, ['status', 'last_error', 'available_at'])
+        return counts
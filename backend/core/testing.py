@@ -0,0 +1,34 @@
+from contextlib import contextmanager
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+from .middleware import SAVEPOINT_STATEMENTS
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin for catching N+1 regressions.
+
+    ``assertWithinQueryBudget(response)`` checks a test-client response
+    against the budget its view declares (``query_budget``), the same budget
+    QueryBudgetMiddleware logs against. ``assertMaxQueries(n)`` is an upper
+    bound version of assertNumQueries that lists the statements on failure.
+    """
+
+    def assertWithinQueryBudget(self, response, budget=None):
+        stats = response.query_stats
+        budget = stats['budget'] if budget is None else budget
+        if budget is not None and stats['queries'] > budget:
+            self.fail(f"{stats['queries']} queries executed, budget is {budget}")
+        return response
+
+    @contextmanager
+    def assertMaxQueries(self, limit, using=DEFAULT_DB_ALIAS):
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+        queries = [
+            query['sql'] for query in context.captured_queries
+            if not query['sql'].lstrip().upper().startswith(SAVEPOINT_STATEMENTS)
+        ]
+        if len(queries) > limit:
+            listing = '\n'.join(f"{number}. {sql}" for number, sql in enumerate(queries, start=1))
+            self.fail(f"{len(queries)} queries executed, budget is {limit}:\n{listing}")
@@ -1,4 +1,5 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from sme.models import BusinessProfile, CACDocument, BusinessVideo
 from .services import PulseEngine
@@ -58,3 +59,442 @@ class PulseEngineTests(TestCase):
         self.assertEqual(engine.bank_account_name, 'Test Bank')
         self.assertEqual(engine.score, 0)
         self.assertEqual(engine.fail_reasons, [])
+
+
+class PlatformStatsRollupTests(TestCase):
+    """Daily rollup is incremental and answers any date range from running totals"""
+
+    def _sme(self, email, days_ago=0):
+        from datetime import timedelta
+        from django.utils import timezone
+        user = User.objects.create_user(username=email, email=email, password='testpass123', user_type='sme')
+        profile = BusinessProfile.objects.create(user=user, business_name=email)
+        BusinessProfile.objects.filter(pk=profile.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return profile
+
+    @override_settings(PLATFORM_STATS_ROLLUP_LAG=0)
+    def test_incremental_rollup_and_ranges(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from escrow.models import LoanApplication
+        from .analytics import PlatformStatsRollup, stats_for_range, platform_totals
+        from .models import DailyPlatformStats
+
+        today = timezone.now().date()
+        self._sme('old@example.com', days_ago=10)
+        recent = self._sme('recent@example.com', days_ago=2)
+        PlatformStatsRollup().run()
+
+        self.assertEqual(DailyPlatformStats.objects.count(), 2)
+        self.assertEqual(platform_totals()['new_smes'], 2)
+
+        # Second run only sees rows past the watermarks
+        self._sme('new@example.com')
+        LoanApplication.objects.create(
+            sme_business=recent, loan_amount=250000, interest_rate=12, tenure_months=6,
+            purpose='Stock', status='active', disbursement_date=timezone.now()
+        )
+        deltas = PlatformStatsRollup().run()
+        self.assertEqual(list(deltas), [today])
+        self.assertEqual(deltas[today]['new_smes'], 1)
+
+        last_week = stats_for_range(today - timedelta(days=6), today)
+        self.assertEqual(last_week['new_smes'], 2)
+        self.assertEqual(last_week['deals_completed'], 1)
+        self.assertEqual(last_week['funding_volume'], 250000)
+        self.assertEqual(stats_for_range(today - timedelta(days=30), today - timedelta(days=7))['new_smes'], 1)
+
+        # Re-running with nothing new changes nothing
+        self.assertEqual(PlatformStatsRollup().run(), {})
+        self.assertEqual(platform_totals()['new_smes'], 3)
+
+    def test_rows_committed_after_a_run_inside_the_lag_are_not_skipped(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from escrow.models import LoanApplication
+        from .analytics import PlatformStatsRollup, platform_totals
+
+        now = timezone.now()
+        profile = self._sme('early@example.com', days_ago=3)
+        self._sme('fresh@example.com')
+        PlatformStatsRollup(now=now, lag=timedelta(minutes=5)).run()
+        self.assertEqual(platform_totals()['new_smes'], 1)
+
+        # Stamped a minute before the first run, but its transaction only commits now
+        LoanApplication.objects.create(
+            sme_business=profile, loan_amount=100000, interest_rate=12, tenure_months=6,
+            purpose='Stock', status='active', disbursement_date=now - timedelta(minutes=1)
+        )
+        PlatformStatsRollup(now=now + timedelta(minutes=10), lag=timedelta(minutes=5)).run()
+        totals = platform_totals()
+        self.assertEqual(totals['new_smes'], 2)
+        self.assertEqual(totals['deals_completed'], 1)
+        self.assertEqual(totals['funding_volume'], 100000)
+
+    def test_totals_come_from_live_tables_before_the_first_rollup(self):
+        from django.utils import timezone
+        from escrow.models import LoanApplication
+        from .analytics import platform_totals
+
+        profile = self._sme('live@example.com')
+        LoanApplication.objects.create(
+            sme_business=profile, loan_amount=50000, interest_rate=12, tenure_months=6, purpose='Stock', status='active'
+        )
+        LoanApplication.objects.create(
+            sme_business=profile, loan_amount=75000, interest_rate=12, tenure_months=6,
+            purpose='Stock', status='active', disbursement_date=timezone.now()
+        )
+        totals = platform_totals()
+        self.assertEqual(totals['new_smes'], 1)
+        self.assertEqual(totals['deals_completed'], 1)
+        self.assertEqual(totals['funding_volume'], 75000)
+        self.assertEqual(totals['platform_fees'], 0)
+
+
+class OutboxDispatcherTests(TestCase):
+    """Outbox rows commit with their state change and are sent at least once"""
+
+    def _message(self, topic='test.topic', to='someone@example.com'):
+        from .outbox import notify
+        return notify(topic, [to], 'Subject', 'Body')[0]
+
+    def test_rows_roll_back_with_the_transaction(self):
+        from django.db import transaction
+        from .models import OutboxMessage
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self._message()
+                raise RuntimeError('state change failed')
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_lender_signup_queues_welcome_email(self):
+        from lender.models import LenderProfile
+        from .models import OutboxMessage
+
+        user = User.objects.create_user(username='welcome@example.com', email='welcome@example.com',
+                                        password='testpass123', user_type='lender')
+        LenderProfile.objects.create(
+            user=user, lender_type='bank', company_name='Welcome Capital', company_registration_number='RC1',
+            years_in_operation=3, total_assets=1000000, preferred_industries=['retail'], min_loan_amount=1000,
+            max_loan_amount=100000, risk_appetite=5, contact_person='Ada', contact_email='ada@welcome.ng',
+            contact_phone='+2348000000000', office_address='Lagos'
+        )
+        message = OutboxMessage.objects.get(topic='lender.registered')
+        self.assertEqual(message.payload['to'], ['ada@welcome.ng'])
+
+    def test_batch_is_sent_then_failures_back_off(self):
+        from datetime import timedelta
+        from django.core import mail
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.utils import timezone
+        from .models import OutboxMessage
+        from .outbox import OutboxDispatcher, send_email
+
+        ok = [self._message(to=f'user{i}@example.com') for i in range(3)]
+        flaky = self._message(topic='flaky')
+
+        def fail(message, connection):
+            raise ConnectionError('smtp down')
+
+        with CaptureQueriesContext(connection) as queries:
+            totals = OutboxDispatcher(handlers={'flaky': fail}).drain()
+        statements = [q['sql'].split()[0] for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']]
+        # One batch: claim (SELECT + UPDATE), then settle (sent UPDATE + failed bulk UPDATE); then an empty poll
+        self.assertEqual(statements, ['SELECT', 'UPDATE', 'UPDATE', 'UPDATE', 'SELECT'])
+        self.assertEqual(totals, {'sent': 3, 'retry': 1, 'failed': 0})
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(set(OutboxMessage.objects.filter(id__in=[m.id for m in ok]).values_list('status', flat=True)), {'sent'})
+
+        flaky.refresh_from_db()
+        self.assertEqual((flaky.status, flaky.attempts, flaky.last_error), ('pending', 1, 'smtp down'))
+        self.assertGreater(flaky.available_at, timezone.now())
+
+        OutboxMessage.objects.filter(pk=flaky.pk).update(available_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(OutboxDispatcher(handlers={'flaky': send_email}).drain()['sent'], 1)
+
+    def test_unsettled_claim_is_redelivered_after_lease(self):
+        from django.core import mail
+        from django.utils import timezone
+        from unittest.mock import patch
+        from .outbox import OutboxDispatcher, LEASE
+
+        self._message()
+        dispatcher = OutboxDispatcher()
+        self.assertEqual(len(dispatcher._claim()), 1)  # dispatcher dies before sending
+        self.assertEqual(dispatcher.drain()['sent'], 0)
+
+        with patch('core.outbox.timezone.now', return_value=timezone.now() + LEASE):
+            self.assertEqual(dispatcher.drain()['sent'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class ProfileResolverTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='resolver@example.com', email='resolver@example.com', password='testpass123', user_type='sme'
+        )
+        self.profile = BusinessProfile.objects.create(user=self.user, business_name='Resolver Ltd')
+
+    def resolver_for(self, user):
+        from django.test import RequestFactory
+        from .middleware import ProfileResolver
+        request = RequestFactory().get('/')
+        request.user = user
+        return ProfileResolver(request)
+
+    def test_profile_and_user_load_in_one_query_per_request(self):
+        profiles = self.resolver_for(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(profiles.business, self.profile)
+            self.assertEqual(profiles.get_business().user.email, 'resolver@example.com')
+
+    def test_missing_profile_is_remembered(self):
+        from lender.models import LenderProfile
+        profiles = self.resolver_for(self.user)
+        with self.assertNumQueries(1):
+            self.assertIsNone(profiles.lender)
+            with self.assertRaises(LenderProfile.DoesNotExist):
+                profiles.get_lender()
+
+    def test_anonymous_requests_do_not_query(self):
+        from django.contrib.auth.models import AnonymousUser
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.resolver_for(AnonymousUser()).business)
+
+    def test_middleware_resolves_after_drf_authentication(self):
+        from rest_framework.test import APIClient
+        from escrow.models import LoanApplication
+
+        for amount in (1000, 2000, 3000):
+            LoanApplication.objects.create(
+                sme_business=self.profile, loan_amount=amount, interest_rate=10, tenure_months=6, purpose='Stock'
+            )
+        client = APIClient()
+        client.force_authenticate(self.user)
+        # Nested business, lender and escrow data come from one joined query regardless of page size
+        with self.assertNumQueries(2):
+            response = client.get('/api/escrow/loan-applications/')
+        self.assertEqual(response.status_code, 200)
+
+        response = client.post('/api/sme/verify-cac', {'rcNumber': 'RC123'}, format='json')
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.rc_number, 'RC123')
+
+
+@override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'auth': '3/min', 'auth_ip': '5/min'}
+})
+class SlidingWindowThrottleTests(TestCase):
+    def setUp(self):
+        from django.core.cache import caches
+        caches['throttle'].clear()
+        self.now = 600.0  # start of a minute window
+
+    def decide(self, throttle_class, remote_addr='10.0.0.1', user=None, scope='auth', **headers):
+        from django.contrib.auth.models import AnonymousUser
+        from rest_framework.test import APIRequestFactory
+        from rest_framework.request import Request
+
+        request = Request(APIRequestFactory().post('/', REMOTE_ADDR=remote_addr, **headers))
+        request.user = user or AnonymousUser()
+        throttle = throttle_class()
+        throttle.timer = lambda: self.now
+        view = type('View', (), {'throttle_scope': scope})
+        return throttle.allow_request(request, view), throttle
+
+    def test_previous_window_is_weighted_by_its_overlap(self):
+        from .throttling import ScopedUserThrottle
+
+        self.assertEqual([self.decide(ScopedUserThrottle)[0] for _ in range(4)], [True, True, True, False])
+        self.assertEqual(self.decide(ScopedUserThrottle)[1].wait(), 60)
+
+        # Halfway through the next window the 3 earlier requests count as 1.5
+        self.now += 90
+        self.assertEqual([self.decide(ScopedUserThrottle)[0] for _ in range(3)], [True, True, False])
+        self.assertAlmostEqual(self.decide(ScopedUserThrottle)[1].wait(), 10)
+
+    def test_users_and_addresses_are_limited_separately(self):
+        from .throttling import ScopedUserThrottle, ScopedIPThrottle
+
+        first = User.objects.create_user(username='one@example.com', email='one@example.com', password='x', user_type='sme')
+        second = User.objects.create_user(username='two@example.com', email='two@example.com', password='x', user_type='sme')
+        for _ in range(3):
+            self.assertTrue(self.decide(ScopedUserThrottle, user=first)[0])
+        self.assertFalse(self.decide(ScopedUserThrottle, user=first)[0])
+        self.assertTrue(self.decide(ScopedUserThrottle, user=second)[0])
+        self.assertTrue(self.decide(ScopedUserThrottle, remote_addr='10.0.0.2')[0])
+
+        # One address across many accounts hits the _ip rate
+        self.assertEqual([self.decide(ScopedIPThrottle)[0] for _ in range(6)], [True] * 5 + [False])
+        self.assertTrue(self.decide(ScopedIPThrottle, remote_addr='10.0.0.2')[0])
+
+    def test_forged_forwarded_for_does_not_reset_the_ip_limit(self):
+        from .throttling import ScopedIPThrottle
+
+        # No trusted proxies by default: the header is ignored
+        results = [
+            self.decide(ScopedIPThrottle, HTTP_X_FORWARDED_FOR=f'203.0.113.{number}')[0] for number in range(6)
+        ]
+        self.assertEqual(results, [True] * 5 + [False])
+
+    def test_unscoped_views_are_not_throttled(self):
+        from .throttling import ScopedUserThrottle
+
+        self.assertTrue(all(self.decide(ScopedUserThrottle, scope=None)[0] for _ in range(10)))
+        self.assertTrue(all(self.decide(ScopedUserThrottle, scope='unknown')[0] for _ in range(10)))
+
+    def test_login_returns_429_over_the_limit(self):
+        from django.urls import reverse
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        codes = [
+            client.post(reverse('login'), {'email': 'nobody@example.com', 'password': 'wrong'}, format='json').status_code
+            for _ in range(4)
+        ]
+        self.assertEqual(codes, [401, 401, 401, 429])
+        self.assertIn('Retry-After', client.post(reverse('login'), {}, format='json'))
+
+    def test_file_store_decides_in_under_a_millisecond(self):
+        import shutil, tempfile, time
+        from .throttling import ScopedUserThrottle
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        caches = {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'throttle': {'BACKEND': 'core.throttling.ThrottleFileCache', 'LOCATION': directory},
+        }
+        with self.settings(CACHES=caches, REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': {'auth': '100000/min'}}):
+            timings = []
+            for _ in range(200):
+                started = time.perf_counter()
+                self.decide(ScopedUserThrottle)
+                timings.append(time.perf_counter() - started)
+        self.assertLess(sorted(timings)[100], 0.001)
+
+
+class CachingTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .caching import cache_stats
+        cache.clear()
+        cache_stats.reset()
+        self.user = User.objects.create_user(
+            username='cached@example.com', email='cached@example.com', password='testpass123', user_type='sme'
+        )
+        self.profile = BusinessProfile.objects.create(user=self.user, business_name='Cached Ltd')
+
+    def test_entries_are_served_until_a_tag_is_invalidated(self):
+        from .caching import cached, invalidate, cache_stats
+        calls = []
+
+        @cached(tags=lambda sme_id: [f"sme:{sme_id}"])
+        def lookup(sme_id):
+            calls.append(sme_id)
+            return len(calls)
+
+        self.assertEqual([lookup(1), lookup(1), lookup(2)], [1, 1, 2])
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate('sme:1')
+        self.assertEqual([lookup(1), lookup(2)], [3, 2])
+        self.assertEqual(lookup.uncached(1), 4)
+
+        stats = cache_stats.snapshot()[f"{lookup.__module__}.{lookup.__qualname__}"]
+        self.assertEqual(stats, {'hits': 2, 'misses': 3, 'hit_ratio': 0.4})
+
+    def test_invalidation_waits_for_commit(self):
+        from .caching import cached
+
+        @cached(tags=lambda profile: [f"sme:{profile.pk}"])
+        def name_of(profile):
+            return BusinessProfile.objects.get(pk=profile.pk).business_name
+
+        self.assertEqual(name_of(self.profile), 'Cached Ltd')
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.profile.business_name = 'Renamed Ltd'
+            self.profile.save()
+            # Not yet committed: still the old entry
+            self.assertEqual(name_of(self.profile), 'Cached Ltd')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(name_of(self.profile), 'Renamed Ltd')
+
+    def test_child_rows_invalidate_their_owner(self):
+        from lender.services import marketplace_sme_detail
+
+        self.profile.verification_status = 'verified'
+        self.profile.pulse_score = 90
+        self.profile.save()
+        self.assertFalse(marketplace_sme_detail(self.profile.pk)['verification']['cacVerified'])
+        with self.assertNumQueries(0):
+            marketplace_sme_detail(self.profile.pk)
+
+        # The document belongs to the user; its signal tags the user's business profile
+        with self.captureOnCommitCallbacks(execute=True):
+            CACDocument.objects.create(user=self.user, cac_file='cac_files/doc.pdf')
+        self.assertTrue(marketplace_sme_detail(self.profile.pk)['verification']['cacVerified'])
+
+    def test_cache_stats_endpoint_is_staff_only(self):
+        from rest_framework.test import APIClient
+        from .caching import cache_stats
+
+        cache_stats.record('lender.services.get_portfolio_stats', hit=True)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/admin/cache-stats').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = client.get('/api/admin/cache-stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['caches']['lender.services.get_portfolio_stats']['hits'], 1)
+
+
+class QueryBudgetMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='budget@example.com', email='budget@example.com', password='testpass123', user_type='sme'
+        )
+        BusinessProfile.objects.create(user=self.user, business_name='Budget Ltd')
+
+    def get(self, url):
+        from rest_framework.test import APIClient
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.get(url)
+
+    @override_settings(QUERY_TIMING_HEADERS=True)
+    def test_counts_queries_and_sets_timing_headers(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get('/api/escrow/loan-applications/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.query_stats['queries'], len(queries.captured_queries))
+        self.assertEqual(response.query_stats['budget'], 3)  # LoanApplicationViewSet's list budget
+        self.assertEqual(response['X-Query-Count'], str(len(queries.captured_queries)))
+        self.assertTrue(response['Server-Timing'].startswith('db;dur='))
+
+    @override_settings(QUERY_TIMING_HEADERS=False)
+    def test_over_budget_requests_are_logged(self):
+        from unittest.mock import patch
+
+        with patch('escrow.views.LoanApplicationViewSet.query_budget', {'list': 0}):
+            with self.assertLogs('core.middleware', 'WARNING') as logs:
+                response = self.get('/api/escrow/loan-applications/')
+        self.assertIn('GET /api/escrow/loan-applications/ (loan-application-list)', logs.output[0])
+        self.assertIn('(budget 0)', logs.output[0])
+        self.assertNotIn('X-Query-Count', response)
+
+    def test_budget_resolution(self):
+        from .middleware import view_query_budget
+        from escrow.views import LoanApplicationViewSet
+        from users.views import BulkOnboardingView
+
+        self.assertEqual(view_query_budget(LoanApplicationViewSet.as_view({'get': 'list'}), 'GET'), 3)
+        self.assertEqual(view_query_budget(LoanApplicationViewSet.as_view({'post': 'create'}), 'POST'), 20)
+        self.assertIsNone(view_query_budget(BulkOnboardingView.as_view(), 'POST'))
@@ -0,0 +1,111 @@
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+    Sliding-window rate limit for views that set ``throttle_scope``.
+
+    Uses the sliding-window counter: requests are counted in fixed windows of
+    the rate's duration, and the previous window's count is weighted by how
+    much of it still overlaps the sliding window. That needs two counters per
+    client instead of a timestamp log, so a decision is one get_many and one
+    incr on the shared 'throttle' cache. Only allowed requests are counted.
+
+    Rates come from REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] under the view's
+    scope (plus ``rate_suffix``); views without a configured rate are not
+    throttled.
+    """
+    rate_suffix = ''
+
+    def __init__(self):
+        # Rates depend on the view, so they are resolved in allow_request
+        pass
+
+    @property
+    def cache(self):
+        return caches['throttle']
+
+    def get_ident_for(self, request):
+        """Whom the limit applies to: the client IP by default."""
+        return f"ip:{self.get_ident(request)}"
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        self.scope = f"{scope}{self.rate_suffix}" if scope else None
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(rate)
+
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        key = f"throttle:{self.scope}:{self.get_ident_for(request)}"
+        current_key, previous_key = f"{key}:{window}", f"{key}:{window - 1}"
+        counts = self.cache.get_many([current_key, previous_key])
+        self.current = counts.get(current_key, 0)
+        self.previous = counts.get(previous_key, 0)
+        self.elapsed = (self.now % self.duration) / self.duration
+
+        if self.previous * (1 - self.elapsed) + self.current >= self.num_requests:
+            return False
+        try:
+            self.cache.incr(current_key)
+        except ValueError:
+            # First request of the window; the counter outlives it to serve as the next one's previous
+            if not self.cache.add(current_key, 1, timeout=2 * self.duration):
+                self.cache.incr(current_key)
+        return True
+
+    def wait(self):
+        """Seconds until the weighted count drops below the limit."""
+        limit = self.num_requests
+        if self.current < limit:
+            needed = 1 - (limit - self.current) / self.previous
+            return max(needed - self.elapsed, 0) * self.duration
+        # The current window is full; wait for it to become the previous one and decay
+        return (1 - self.elapsed + max(1 - limit / self.current, 0)) * self.duration
+
+
+class ScopedUserThrottle(SlidingWindowThrottle):
+    """Limits each signed-in user, or each client IP for anonymous requests."""
+
+    def get_ident_for(self, request):
+        if request.user and request.user.is_authenticated:
+            return f"user:{request.user.pk}"
+        return super().get_ident_for(request)
+
+
+class ScopedIPThrottle(SlidingWindowThrottle):
+    """Limits each client IP across all accounts, using the ``<scope>_ip`` rate."""
+    rate_suffix = '_ip'
+
+
+class ThrottleFileCache(FileBasedCache):
+    """
+    File cache for throttle counters when no Redis is configured.
+
+    FileBasedCache lists its whole directory on every set to decide whether to
+    cull, which costs milliseconds once a few thousand clients have counters.
+    This checks every CULL_EVERY sets instead, and removes expired counters
+    before falling back to FileBasedCache's random culling.
+    """
+    CULL_EVERY = 1000
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._sets = 0
+
+    def _cull(self):
+        self._sets += 1
+        if self._sets % self.CULL_EVERY:
+            return
+        for path in self._list_cache_files():
+            try:
+                with open(path, 'rb') as f:
+                    self._is_expired(f)
+            except FileNotFoundError:
+                pass
+        super()._cull()
@@ -1,3 +1,23 @@
-from django.shortcuts import render
+from rest_framework import serializers, status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .caching import cache_stats
 
-# Create your views here.
+
+class CacheStatsView(APIView):
+    """GET /admin/cache-stats - Hit/miss counts of cached services in this worker (Admin only)"""
+    permission_classes = [IsAuthenticated]
+    serializer_class = serializers.Serializer # Dummy
+
+    def get(self, request):
+        if not request.user.is_staff:
+            return Response({
+                "success": False,
+                "message": "Admin access required"
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        return Response({
+            "success": True,
+            "data": {"caches": cache_stats.snapshot()}
+        })
@@ -0,0 +1,147 @@
+import calendar
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from core.caching import invalidate
+from .models import RepaymentSchedule
+
+CENT = Decimal('0.01')
+
+FREQUENCY_MONTHS = {'monthly': 1, 'quarterly': 3}
+
+
+def _money(value):
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def add_months(start, months):
+    """Same day ``months`` later, clamped to the last day of shorter months (Jan 31 -> Feb 28)."""
+    month_index = start.month - 1 + months
+    year, month = start.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+
+def installment_offsets(tenure_months, frequency):
+    """Month offsets of each due date; a quarterly loan whose tenure is not a multiple of 3 ends on a short period."""
+    if frequency == 'bullet':
+        return [tenure_months]
+    step = FREQUENCY_MONTHS[frequency]
+    offsets = list(range(step, tenure_months + 1, step))
+    if not offsets or offsets[-1] != tenure_months:
+        offsets.append(tenure_months)
+    return offsets
+
+
+def build_schedule(principal, annual_rate, tenure_months, frequency='monthly', method='flat', start_date=None):
+    """
+    Installments as (number, due_date, principal, interest, total) tuples.
+
+    ``flat`` charges simple interest on the original principal, spread by period
+    length. ``reducing`` charges each period's interest on the outstanding balance
+    with a level (annuity) payment. Rounding is settled on the last installment so
+    principal always sums exactly to the loan amount.
+    """
+    principal = _money(Decimal(principal))
+    monthly_rate = Decimal(annual_rate) / 100 / 12
+    start_date = start_date or timezone.now().date()
+    offsets = installment_offsets(tenure_months, frequency)
+    period_months = [offset - previous for previous, offset in zip([0] + offsets, offsets)]
+
+    if method == 'reducing':
+        amounts = _reducing(principal, monthly_rate, period_months)
+    else:
+        amounts = _flat(principal, monthly_rate, tenure_months, period_months)
+
+    return [
+        (number, add_months(start_date, offset), principal_part, interest_part, principal_part + interest_part)
+        for number, (offset, (principal_part, interest_part)) in enumerate(zip(offsets, amounts), start=1)
+    ]
+
+
+def _flat(principal, monthly_rate, tenure_months, period_months):
+    total_interest = _money(principal * monthly_rate * tenure_months)
+    amounts = []
+    principal_left, interest_left = principal, total_interest
+    for index, months in enumerate(period_months):
+        if index == len(period_months) - 1:
+            amounts.append((principal_left, interest_left))
+            break
+        share = Decimal(months) / tenure_months
+        principal_part, interest_part = _money(principal * share), _money(total_interest * share)
+        principal_left -= principal_part
+        interest_left -= interest_part
+        amounts.append((principal_part, interest_part))
+    return amounts
+
+
+def _reducing(principal, monthly_rate, period_months):
+    # The level payment is sized on the regular period; a short final period just clears the balance
+    periods = len(period_months)
+    period_rate = monthly_rate * period_months[0]
+    if period_rate:
+        payment = _money(principal * period_rate / (1 - (1 + period_rate) ** -periods))
+    else:
+        payment = _money(principal / periods)
+
+    amounts = []
+    balance = principal
+    for index, months in enumerate(period_months):
+        interest_part = _money(balance * monthly_rate * months)
+        if index == periods - 1:
+            principal_part = balance
+        else:
+            principal_part = min(payment - interest_part, balance)
+        balance -= principal_part
+        amounts.append((principal_part, interest_part))
+    return amounts
+
+
+def loan_schedule_rows(loan_application):
+    """Unsaved RepaymentSchedule rows for a loan, priced at its negotiated rate when one was agreed."""
+    rate = loan_application.negotiated_rate if loan_application.negotiated_rate is not None else loan_application.interest_rate
+    start = loan_application.disbursement_date.date() if loan_application.disbursement_date else timezone.now().date()
+    return [
+        RepaymentSchedule(
+            loan_application=loan_application,
+            installment_number=number,
+            due_date=due_date,
+            principal_amount=principal_part,
+            interest_amount=interest_part,
+            total_amount=total
+        )
+        for number, due_date, principal_part, interest_part, total in build_schedule(
+            loan_application.loan_amount, rate, loan_application.tenure_months,
+            loan_application.repayment_frequency, loan_application.amortization_method, start
+        )
+    ]
+
+
+def regenerate_schedules(loans, chunk_size=500, batch_size=1000):
+    """
+    Replace the repayment schedules of ``loans`` (a queryset or list). Each chunk of
+    loans costs one DELETE and one bulk INSERT, so thousands of loans take a
+    handful of queries. Existing installments, paid or not, are discarded.
+    Returns the number of installments written.
+    """
+    if hasattr(loans, 'iterator'):
+        loans = loans.iterator(chunk_size=chunk_size)
+    written = 0
+    chunk = []
+    for loan in loans:
+        chunk.append(loan)
+        if len(chunk) >= chunk_size:
+            written += _write_chunk(chunk, batch_size)
+            chunk = []
+    if chunk:
+        written += _write_chunk(chunk, batch_size)
+    return written
+
+
+def _write_chunk(loans, batch_size):
+    rows = [row for loan in loans for row in loan_schedule_rows(loan)]
+    with db_transaction.atomic():
+        RepaymentSchedule.objects.filter(loan_application__in=[loan.pk for loan in loans]).delete()
+        RepaymentSchedule.objects.bulk_create(rows, batch_size=batch_size)
+        invalidate(*(tag for loan in loans for tag in loan.cache_tags()))
+    return len(rows)
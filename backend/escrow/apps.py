@@ -5,3 +5,6 @@ class EscrowConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'escrow'
     verbose_name = 'Escrow Management'
+    
+    def ready(self):
+        import escrow.signals
@@ -0,0 +1,139 @@
+import difflib
+import functools
+import json
+import logging
+import re
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+from django.db.models import Q
+from .models import Bank
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = Path(__file__).resolve().parent / 'data' / 'banks.json'
+
+# Words that never distinguish one Nigerian bank from another
+NOISE_WORDS = {'plc', 'ltd', 'limited', 'nigeria', 'of', 'the'}
+
+FUZZY_CUTOFF = 0.85
+# A fuzzy match is rejected when another bank scores within this margin of it
+FUZZY_MARGIN = 0.05
+# Distinct user-typed names whose fuzzy answer is kept per index load
+FUZZY_MEMO_SIZE = 1024
+
+
+def normalize_bank_name(name):
+    name = name.lower().replace('&', ' and ')
+    words = re.sub(r'[^a-z0-9 ]+', ' ', name).split()
+    return ' '.join(word for word in words if word not in NOISE_WORDS)
+
+
+def load_snapshot():
+    """Bundled bank list, used before the first sync and whenever Paystack is unreachable."""
+    with open(SNAPSHOT_PATH) as snapshot:
+        return json.load(snapshot)
+
+
+class BankDirectory:
+    """
+    In-memory name -> bank code index over the Bank table.
+
+    Exact lookups (normalised name or alias) are a dict hit. Anything else goes
+    through one difflib pass whose answer is memoised in a bounded LRU, so a
+    recently seen name is not fuzzy-matched again until the index reloads. The index is
+    rebuilt after BANK_DIRECTORY_TTL seconds to pick up `sync_banks` runs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._loaded_at = 0
+
+    def invalidate(self):
+        self._index = None
+
+    def _entries(self):
+        banks = list(Bank.objects.filter(active=True).values('name', 'code', 'aliases'))
+        return banks or load_snapshot()
+
+    def _build(self):
+        index = {}
+        entries = self._entries()
+        # Official names win over aliases, which win over names with "bank" dropped
+        for entry in entries:
+            index.setdefault(normalize_bank_name(entry['name']), entry['code'])
+        for entry in entries:
+            for alias in entry.get('aliases') or []:
+                index.setdefault(normalize_bank_name(alias), entry['code'])
+        for entry in entries:
+            short = ' '.join(word for word in normalize_bank_name(entry['name']).split() if word != 'bank')
+            if short:
+                index.setdefault(short, entry['code'])
+        return index
+
+    def _get_index(self):
+        ttl = getattr(settings, 'BANK_DIRECTORY_TTL', 3600)
+        if self._index is None or time.monotonic() - self._loaded_at > ttl:
+            with self._lock:
+                if self._index is None or time.monotonic() - self._loaded_at > ttl:
+                    exact = self._build()
+                    fuzzy = functools.lru_cache(maxsize=FUZZY_MEMO_SIZE)(lambda key: self._fuzzy(key, exact))
+                    self._index = {'exact': exact, 'fuzzy': fuzzy}
+                    self._loaded_at = time.monotonic()
+        return self._index
+
+    def resolve(self, bank_name):
+        """Paystack bank code for a free-text bank name, or None if it cannot be resolved unambiguously."""
+        key = normalize_bank_name(bank_name or '')
+        if not key:
+            return None
+        index = self._get_index()
+        code = index['exact'].get(key)
+        if code is not None:
+            return code
+        return index['fuzzy'](key)
+
+    def _fuzzy(self, key, exact):
+        matches = difflib.get_close_matches(key, exact.keys(), n=3, cutoff=FUZZY_CUTOFF)
+        if not matches:
+            return None
+        scores = [(difflib.SequenceMatcher(None, key, match).ratio(), exact[match]) for match in matches]
+        best_score, best_code = max(scores)
+        if any(code != best_code and best_score - score < FUZZY_MARGIN for score, code in scores):
+            logger.warning(f"Ambiguous bank name '{key}' not resolved")
+            return None
+        return best_code
+
+
+bank_directory = BankDirectory()
+
+
+def sync_banks(entries):
+    """
+    Upsert the bank table from a Paystack-style list of {name, code, slug?, active?}.
+    Aliases come from the bundled snapshot; banks missing from ``entries`` are deactivated.
+    Returns the number of banks written.
+    """
+    aliases = {entry['code']: entry.get('aliases', []) for entry in load_snapshot()}
+    banks = [
+        Bank(
+            code=entry['code'],
+            name=entry['name'],
+            slug=entry.get('slug', ''),
+            aliases=aliases.get(entry['code'], entry.get('aliases', [])),
+            active=entry.get('active', True),
+        )
+        for entry in entries
+        if entry.get('code')
+    ]
+    Bank.objects.bulk_create(
+        banks,
+        update_conflicts=True,
+        unique_fields=['code'],
+        update_fields=['name', 'slug', 'aliases', 'active', 'updated_at'],
+    )
+    Bank.objects.filter(~Q(code__in=[bank.code for bank in banks])).update(active=False)
+    bank_directory.invalidate()
+    return len(banks)
@@ -0,0 +1,335 @@
+import logging
+from datetime import timedelta
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import LoanApplication, EscrowAccount, Transaction, Disbursement
+from .services import EscrowService, generate_reference
+from .recipients import RecipientResolver, recipient_key
+from .amortization import regenerate_schedules
+from . import ledger
+from .events import publish_to_parties
+from . import notifications
+from core.outbox import enqueue
+
+logger = logging.getLogger(__name__)
+
+# Paystack accepts at most 100 transfers per bulk request
+MAX_BULK_TRANSFERS = 100
+
+# A 'processing' disbursement claimed longer ago than this was left unresolved by a
+# lost response or a crashed run, and is looked up on Paystack by its reference
+STALE_AFTER = timedelta(minutes=15)
+
+# Transfer statuses after which Paystack has not paid and will not pay
+FAILED_TRANSFER_STATUSES = ('failed', 'reversed')
+
+
+class DisbursementScheduler:
+    """
+    Disburses every approved, fully funded loan through Paystack's bulk transfer API.
+
+    A run has three phases and only the first and last touch the database:
+    claim (short transaction marking disbursements 'processing'), submit
+    (cached recipient lookup + bulk transfer calls, no transaction open), and settle (one
+    short transaction of bulk writes per batch).
+
+    A disbursement keeps its transfer reference while the transfer's outcome is
+    unknown, so Paystack rejects a resend of a transfer it already accepted.
+    When a bulk call's outcome is unknown (transport error, reference missing
+    from the reply) the disbursement stays 'processing' until a later run's
+    recovery pass asks Paystack's transfer verify endpoint what happened. Once
+    Paystack has failed or reversed a transfer, or it never got that far, the
+    reference is dropped and the retry goes out under a new one.
+    """
+
+    def __init__(self, batch_size=MAX_BULK_TRANSFERS, paystack=None, stale_after=STALE_AFTER):
+        self.batch_size = min(batch_size, MAX_BULK_TRANSFERS)
+        self.stale_after = stale_after
+        self.escrow_service = EscrowService()
+        self.paystack = paystack or self.escrow_service.paystack
+
+    def ready_loans(self):
+        return LoanApplication.objects.filter(
+            status='approved',
+            escrow_account__amount_held__gte=F('loan_amount'),
+        ).exclude(
+            disbursement__status__in=['processing', 'completed']
+        ).order_by('id')
+
+    def run(self, limit=None):
+        """
+        Recover stale disbursements, then disburse ready loans in batches.
+        Returns {'completed': n, 'failed': n, 'unresolved': n}.
+        """
+        totals = dict(zip(('completed', 'failed', 'unresolved'), self.recover()))
+        attempted = set()  # loans that failed this run are not retried until the next run
+        while limit is None or limit > 0:
+            size = self.batch_size if limit is None else min(self.batch_size, limit)
+            disbursements = self._claim(size, attempted)
+            if not disbursements:
+                break
+            attempted.update(disbursement.loan_application_id for disbursement in disbursements)
+            succeeded, failed, unresolved = self._submit(disbursements)
+            completed, failed = self._settle(succeeded, failed)
+            totals['completed'] += completed
+            totals['failed'] += failed
+            totals['unresolved'] += len(unresolved)
+            if limit is not None:
+                limit -= len(disbursements)
+        return totals
+
+    def disburse(self, loan_application):
+        """
+        Disburse one loan through the same claim, submit and settle phases as ``run``,
+        so it cannot race a scheduler run into paying the loan twice.
+        Returns {'success', 'disbursement'} or {'success': False, 'message'}.
+        """
+        disbursements = self._claim(1, loan_ids=[loan_application.pk])
+        if not disbursements:
+            if Disbursement.objects.filter(loan_application=loan_application, status__in=['processing', 'completed']).exists():
+                return {'success': False, 'message': 'This loan is already being disbursed or has been disbursed.'}
+            return {'success': False, 'message': 'Insufficient funds in escrow account to cover the loan amount.'}
+
+        succeeded, failed, unresolved = self._submit(disbursements)
+        self._settle(succeeded, failed)
+        disbursement = disbursements[0]
+        if failed:
+            return {'success': False, 'message': disbursement.failure_message}
+        # Completed, or still 'processing' until recovery confirms a transfer whose reply was lost
+        return {'success': True, 'disbursement': disbursement}
+
+    # --- Recovery ---
+
+    def recover(self):
+        """
+        Resolve 'processing' disbursements claimed more than ``stale_after`` ago
+        through Paystack's transfer verify endpoint. Returns (completed, failed, unresolved).
+        """
+        now = timezone.now()
+        with db_transaction.atomic():
+            stale = list(
+                Disbursement.objects.filter(status='processing', claimed_at__lt=now - self.stale_after)
+                .select_for_update(skip_locked=True, of=('self',))
+                .select_related('loan_application__sme_business', 'escrow_account')
+            )
+            # Renew the claim so a concurrent run leaves these alone while they are looked up
+            Disbursement.objects.filter(pk__in=[disbursement.pk for disbursement in stale]).update(claimed_at=now)
+        if not stale:
+            return 0, 0, 0
+
+        succeeded, failed, unresolved = [], [], []
+        for disbursement in stale:
+            result = self.paystack.verify_transfer(disbursement.transfer_reference)
+            if result['success'] and result['status'] not in FAILED_TRANSFER_STATUSES:
+                disbursement.transfer_code = result['transfer'].get('transfer_code', '')
+                disbursement.gateway_item = result['transfer']
+                succeeded.append(disbursement)
+            elif result['success']:
+                # Paystack has used this reference; the retry needs a new one
+                disbursement.transfer_reference = ''
+                failed.append(disbursement)
+            elif result['not_found']:
+                # Never received; the next claim resends the same reference in case it arrives late
+                failed.append(disbursement)
+            else:
+                logger.warning(f"Could not verify disbursement {disbursement.transfer_reference}: {result['message']}")
+                unresolved.append(disbursement)
+
+        completed, failed = self._settle(succeeded, failed)
+        return completed, failed, len(unresolved)
+
+    # --- Phase 1: claim ---
+
+    def _claim(self, size, exclude_ids=(), loan_ids=None):
+        """Mark up to ``size`` ready loans as processing; a retry keeps any reference left on its disbursement."""
+        candidates = self.ready_loans().exclude(id__in=exclude_ids)
+        if loan_ids is not None:
+            candidates = candidates.filter(id__in=loan_ids)
+        with db_transaction.atomic():
+            loans = list(
+                candidates.select_for_update(skip_locked=True, of=('self',))
+                .select_related('sme_business__user', 'lender__user', 'escrow_account')[:size]
+            )
+            # The amount_held projection can lag the ledger; only loans the ledger covers go out
+            available = ledger.balances([loan.escrow_account.pk for loan in loans])
+            loans = [loan for loan in loans if available[loan.escrow_account.pk] >= loan.loan_amount]
+            if not loans:
+                return []
+
+            existing = {d.loan_application_id: d for d in Disbursement.objects.filter(loan_application__in=loans)}
+            now = timezone.now()
+            new, retried = [], []
+            for loan in loans:
+                sme = loan.sme_business
+                disbursement = existing.get(loan.id) or Disbursement()
+                disbursement.loan_application = loan
+                disbursement.escrow_account = loan.escrow_account
+                disbursement.amount = loan.loan_amount
+                disbursement.beneficiary_account_number = sme.bank_account_number
+                disbursement.beneficiary_account_name = sme.bank_account_name
+                disbursement.beneficiary_bank = sme.bank_name
+                disbursement.status = 'processing'
+                disbursement.claimed_at = now
+                # A kept reference may belong to a transfer Paystack accepted; resending it is a no-op there
+                disbursement.transfer_reference = disbursement.transfer_reference or generate_reference('DISB')
+                disbursement.transfer_code = ''
+                (retried if disbursement.pk else new).append(disbursement)
+
+            Disbursement.objects.bulk_create(new)
+            Disbursement.objects.bulk_update(retried, [
+                'escrow_account', 'amount', 'beneficiary_account_number', 'beneficiary_account_name',
+                'beneficiary_bank', 'status', 'claimed_at', 'transfer_reference', 'transfer_code'
+            ])
+
+        return new + retried
+
+    # --- Phase 2: submit (no DB transaction) ---
+
+    def _submit(self, disbursements):
+        """
+        Send the batch. Returns (succeeded, failed, unresolved): failed ones never reached
+        Paystack or were failed by it (``failure_message`` says which); unresolved ones
+        may or may not have been accepted.
+        """
+        beneficiaries = {}
+        failed = []
+        for disbursement in disbursements:
+            bank_code = self.escrow_service._get_bank_code(disbursement.beneficiary_bank)
+            if bank_code is None:
+                logger.warning(f"Unrecognised bank '{disbursement.beneficiary_bank}' for loan #{disbursement.loan_application_id}")
+                disbursement.failure_message = (
+                    f"Unrecognised bank '{disbursement.beneficiary_bank}'. Please update the bank name on the business profile."
+                )
+                disbursement.transfer_reference = ''
+                failed.append(disbursement)
+                continue
+            beneficiaries[disbursement.pk] = (
+                disbursement.loan_application.sme_business,
+                disbursement.beneficiary_account_name,
+                disbursement.beneficiary_account_number,
+                bank_code,
+            )
+        # Cached recipients cost nothing here; only first-time beneficiaries hit Paystack
+        recipients = RecipientResolver(self.paystack).resolve_many(list(beneficiaries.values()))
+
+        transfers = []
+        for disbursement in disbursements:
+            if disbursement.pk not in beneficiaries:
+                continue
+            loan = disbursement.loan_application
+            _, name, number, code = beneficiaries[disbursement.pk]
+            recipient = recipients[recipient_key(number, code, name)]
+            if not recipient['success']:
+                logger.warning(f"Recipient creation failed for loan #{loan.id}: {recipient['message']}")
+                disbursement.failure_message = recipient['message']
+                disbursement.transfer_reference = ''
+                failed.append(disbursement)
+                continue
+            transfers.append({
+                'amount': disbursement.amount,
+                'recipient': recipient['recipient_code'],
+                'reason': f"Loan disbursement to {loan.sme_business.business_name} for loan #{loan.id}",
+                'reference': disbursement.transfer_reference,
+            })
+
+        results = {}
+        if transfers:
+            response = self.paystack.bulk_transfer(transfers)
+            if response['success']:
+                results = response['transfers']
+            else:
+                logger.error(f"Bulk transfer of {len(transfers)} disbursement(s) failed: {response['message']}")
+
+        succeeded, unresolved = [], []
+        for disbursement in disbursements:
+            if disbursement in failed:
+                continue
+            item = results.get(disbursement.transfer_reference)
+            if item is None:
+                # Paystack may have accepted it before the reply was lost; left 'processing' for recover()
+                unresolved.append(disbursement)
+            elif item.get('status') in FAILED_TRANSFER_STATUSES:
+                disbursement.failure_message = f"Transfer {item['status']} by Paystack"
+                disbursement.transfer_reference = ''
+                failed.append(disbursement)
+            else:
+                disbursement.transfer_code = item.get('transfer_code', '')
+                disbursement.gateway_item = item
+                succeeded.append(disbursement)
+        return succeeded, failed, unresolved
+
+    # --- Phase 3: settle ---
+
+    def _settle(self, succeeded, failed):
+        now = timezone.now()
+        with db_transaction.atomic():
+            # Only rows still 'processing' are settled, so no disbursement is posted twice
+            still_processing = set(
+                Disbursement.objects.select_for_update()
+                .filter(pk__in=[disbursement.pk for disbursement in succeeded + failed], status='processing')
+                .values_list('pk', flat=True)
+            )
+            succeeded = [disbursement for disbursement in succeeded if disbursement.pk in still_processing]
+            failed = [disbursement for disbursement in failed if disbursement.pk in still_processing]
+            for disbursement in failed:
+                disbursement.status = 'failed'
+            Disbursement.objects.bulk_update(failed, ['status', 'transfer_reference'])
+
+            if succeeded:
+                available = ledger.balances({disbursement.escrow_account_id for disbursement in succeeded})
+                accounts = {}
+                loans = []
+                for disbursement in succeeded:
+                    disbursement.status = 'completed'
+                    disbursement.completed_at = now
+
+                    remaining = available[disbursement.escrow_account_id] - disbursement.amount
+                    accounts[disbursement.escrow_account_id] = EscrowAccount(
+                        pk=disbursement.escrow_account_id,
+                        status='released' if remaining <= 0 else 'active',
+                        released_at=now if remaining <= 0 else None,
+                        updated_at=now
+                    )
+
+                    loan = disbursement.loan_application
+                    loan.status = 'active'
+                    loan.disbursement_date = now
+                    loan.updated_at = now
+                    loans.append(loan)
+                    publish_to_parties(loan, 'loan.disbursed', {
+                        'escrowStatus': accounts[disbursement.escrow_account_id].status, 'amount': disbursement.amount
+                    })
+
+                transactions = Transaction.objects.bulk_create([
+                    Transaction(
+                        loan_application=disbursement.loan_application,
+                        escrow_account_id=disbursement.escrow_account_id,
+                        transaction_id=disbursement.transfer_reference,
+                        transaction_type='disburse',
+                        amount=disbursement.amount,
+                        status='completed',
+                        description=f"Disbursement to {disbursement.loan_application.sme_business.business_name}",
+                        payment_reference=disbursement.transfer_reference,
+                        gateway_response=disbursement.gateway_item,
+                        completed_at=now
+                    )
+                    for disbursement in succeeded
+                ])
+                ledger.post([
+                    (disbursement.escrow_account_id, 'disbursement', -disbursement.amount, transaction)
+                    for disbursement, transaction in zip(succeeded, transactions)
+                ])
+                Disbursement.objects.bulk_update(succeeded, ['status', 'completed_at', 'transfer_code'])
+                EscrowAccount.objects.bulk_update(accounts.values(), ['status', 'released_at', 'updated_at'])
+                LoanApplication.objects.bulk_update(loans, ['status', 'disbursement_date', 'updated_at'])
+
+                regenerate_schedules(loans)
+                enqueue(*[
+                    notifications.loan_disbursed(disbursement.loan_application, disbursement.amount)
+                    for disbursement in succeeded
+                ])
+
+        if succeeded or failed:
+            logger.info(f"Disbursement batch settled: {len(succeeded)} completed, {len(failed)} failed")
+        return len(succeeded), len(failed)
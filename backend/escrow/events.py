@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import LiveEvent
+
+logger = logging.getLogger(__name__)
+
+# Events buffered per connection before the slowest clients start losing them
+QUEUE_SIZE = 100
+
+# Most skipped-over ids the fan-out poller keeps checking for late commits per jump
+MAX_GAP_IDS = 1000
+
+
+class EventBroker:
+    """
+    In-process fan-out of push events to the open event streams of each user.
+
+    Streams subscribe from the ASGI event loop; publishers may be on any thread
+    (sync views run in a thread pool), so delivery goes through
+    ``call_soon_threadsafe``. A stream that falls QUEUE_SIZE events behind drops
+    new ones; clients resync by refetching the loan.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}  # user id -> {queue: loop}
+        self._poller = None
+        self._gaps = {}  # fan-out ids skipped over by the poller -> when they were first missed
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._streams.setdefault(user_id, {})[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            streams = self._streams.get(user_id, {})
+            streams.pop(queue, None)
+            if not streams:
+                self._streams.pop(user_id, None)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(streams) for streams in self._streams.values())
+
+    def dispatch(self, user_id, event):
+        with self._lock:
+            targets = list(self._streams.get(user_id, {}).items())
+        for queue, loop in targets:
+            loop.call_soon_threadsafe(self._offer, queue, event)
+
+    @staticmethod
+    def _offer(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning(f"Dropped {event['type']} event for a slow event stream")
+
+    # --- Multi-worker fan-out ---
+
+    def start_polling(self):
+        """Relay LiveEvent rows written by any worker to this process's streams (call from the event loop)."""
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.get_running_loop().create_task(self._poll_forever())
+
+    async def stop_polling(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+    async def _poll_forever(self):
+        last_id = await sync_to_async(latest_event_id)()
+        while True:
+            try:
+                last_id = await sync_to_async(self.poll_once)(last_id)
+            except Exception:
+                logger.exception("Live event poll failed")
+            await asyncio.sleep(settings.LIVE_EVENTS_POLL_INTERVAL)
+
+    def poll_once(self, last_id):
+        """
+        Dispatch rows newer than ``last_id`` to local streams. Returns the new high-water mark.
+
+        Ids are allocated before commit, so two workers' inserts can become visible
+        out of order. Ids the mark jumps over are re-queried on later polls for
+        LIVE_EVENTS_COMMIT_GRACE seconds, then given up as rolled back.
+        """
+        now = time.monotonic()
+        self._gaps = {
+            gap_id: missed_at for gap_id, missed_at in self._gaps.items()
+            if now - missed_at < settings.LIVE_EVENTS_COMMIT_GRACE
+        }
+        rows = LiveEvent.objects.filter(Q(id__gt=last_id) | Q(id__in=list(self._gaps))).order_by('id')
+        for row in rows.values('id', 'user_id', 'payload')[:1000]:
+            if row['id'] > last_id:
+                if last_id:
+                    self._gaps.update(dict.fromkeys(range(max(last_id + 1, row['id'] - MAX_GAP_IDS), row['id']), now))
+                last_id = row['id']
+            else:
+                del self._gaps[row['id']]
+            self.dispatch(row['user_id'], {**row['payload'], 'id': row['id']})
+        return last_id
+
+
+broker = EventBroker()
+
+
+def latest_event_id():
+    return LiveEvent.objects.aggregate(last=Max('id'))['last'] or 0
+
+
+# --- Publishing ---
+
+def publish(user_ids, event_type, loan_application_id, data=None):
+    """
+    Push an event to each user once the current transaction commits (immediately
+    outside one). With LIVE_EVENTS_DB_FANOUT the event is written to the
+    LiveEvent table and every worker's poller delivers it instead.
+    """
+    event = json.loads(json.dumps({
+        'type': event_type,
+        'loanApplicationId': loan_application_id,
+        'data': data or {},
+        'at': timezone.now(),
+    }, cls=DjangoJSONEncoder))
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+
+    def deliver():
+        if settings.LIVE_EVENTS_DB_FANOUT:
+            LiveEvent.objects.bulk_create([
+                LiveEvent(user_id=user_id, event_type=event_type, payload=event) for user_id in user_ids
+            ])
+        else:
+            for user_id in user_ids:
+                broker.dispatch(user_id, event)
+
+    db_transaction.on_commit(deliver)
+
+
+def loan_parties(loan_application):
+    """User ids of the SME and, once assigned, the lender of a loan."""
+    lender_user_id = loan_application.lender.user_id if loan_application.lender_id else None
+    return {loan_application.sme_business.user_id, lender_user_id}
+
+
+def publish_to_parties(loan_application, event_type, data=None):
+    publish(loan_parties(loan_application), event_type, loan_application.pk, data)
+
+
+def purge_events(older_than=None):
+    """Delete fan-out rows older than ``older_than`` (default one hour). Returns the number removed."""
+    cutoff = timezone.now() - (older_than or timedelta(hours=1))
+    return LiveEvent.objects.filter(created_at__lt=cutoff).delete()[0]
+
+
+# --- Streaming ---
+
+def format_event(event):
+    lines = []
+    if 'id' in event:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+async def stream_events(user_id, last_event_id=None):
+    """
+    Server-sent event frames for one user: missed fan-out rows after
+    ``last_event_id`` first, then live events, with a comment heartbeat so
+    proxies keep the connection open.
+    """
+    if settings.LIVE_EVENTS_DB_FANOUT:
+        broker.start_polling()  # for servers that skip the lifespan protocol
+    queue = broker.subscribe(user_id)
+    # The poller relays each row once, but may relay one the replay below already sent
+    replayed = set()
+    try:
+        yield f"retry: {settings.LIVE_EVENTS_RETRY_MS}\n\n"
+        if last_event_id is not None and settings.LIVE_EVENTS_DB_FANOUT:
+            missed = await sync_to_async(list)(
+                LiveEvent.objects.filter(user_id=user_id, id__gt=last_event_id).values('id', 'payload')[:QUEUE_SIZE]
+            )
+            for row in missed:
+                replayed.add(row['id'])
+                yield format_event({**row['payload'], 'id': row['id']})
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=settings.LIVE_EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            event_id = event.get('id')
+            # Not compared with the newest id sent: a late commit can arrive below it
+            if event_id is not None and (event_id in replayed or event_id <= (last_event_id or 0)):
+                continue
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(user_id, queue)
+
+
+async def lifespan(receive, send):
+    """ASGI lifespan protocol: run the fan-out poller for the life of the worker."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if settings.LIVE_EVENTS_DB_FANOUT:
+                broker.start_polling()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await broker.stop_polling()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -0,0 +1,109 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction as db_transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+def request_fingerprint(request):
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _claim(user, key, fingerprint):
+    """
+    Insert an in-progress row for the key, or return the existing unexpired one.
+    The new row is leased for IDEMPOTENCY_IN_PROGRESS_LEASE seconds, so a worker that
+    dies mid-request blocks retries only until the lease runs out.
+    """
+    while True:
+        now = timezone.now()
+        try:
+            with db_transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=user, key=key, fingerprint=fingerprint,
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_IN_PROGRESS_LEASE)
+                )
+            return record, True
+        except IntegrityError:
+            pass
+
+        existing = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if existing is None:
+            continue  # the owning request failed and released the key in between
+        if existing.expires_at > now:
+            return existing, False
+        # An expired key is free for reuse; the conditional delete lets only one retry take it over
+        IdempotencyKey.objects.filter(pk=existing.pk, expires_at__lte=now).delete()
+
+
+def idempotent(view_method):
+    """
+    Make a payment-mutating viewset action safe to retry.
+
+    When the request carries an Idempotency-Key header, the first request runs
+    the action and stores its response; retries with the same key and request
+    get that response back without running the action again. Server errors are
+    not stored, so the client may retry them. While the first request is running,
+    retries get 409 until it finishes or its in-progress lease expires. Requests
+    without the header are unaffected.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({"error": f"{HEADER} must be at most 255 characters"}, status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request)
+        record, created = _claim(request.user, key, fingerprint)
+        if not created:
+            if record.fingerprint != fingerprint:
+                return Response(
+                    {"error": f"{HEADER} was already used for a different request"},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if record.status == 'in_progress':
+                return Response(
+                    {"error": f"A request with this {HEADER} is still being processed"},
+                    status=status.HTTP_409_CONFLICT
+                )
+            response = Response(record.response_body, status=record.response_status)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        if response.status_code >= 500:
+            record.delete()
+            return response
+
+        # Conditional on the row still being ours: a retry may have taken over an expired lease
+        IdempotencyKey.objects.filter(pk=record.pk, status='in_progress').update(
+            status='completed',
+            response_status=response.status_code,
+            response_body=json.loads(json.dumps(response.data, cls=JSONEncoder)),
+            expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+        )
+        return response
+
+    return wrapper
+
+
+def purge_expired_keys(now=None):
+    """Delete expired keys. Returns the number removed."""
+    return IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()[0]
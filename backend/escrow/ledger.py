@@ -0,0 +1,153 @@
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.db import transaction as db_transaction
+from django.db.models import F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import EscrowAccount, LedgerEntry, LedgerSnapshot
+
+ZERO = Decimal('0.00')
+
+# Counter account credited/debited against the escrow side for each movement type
+COUNTER_ACCOUNTS = {
+    'funding': 'gateway_clearing',
+    'disbursement': 'sme_payout',
+}
+
+# Entries younger than this are left to the next snapshot, so a writer whose
+# transaction commits after a higher id has been snapshotted is never skipped
+SNAPSHOT_LAG = timedelta(minutes=1)
+
+
+# --- Writing ---
+
+def post(movements):
+    """
+    Append balanced entry pairs. ``movements`` is a list of
+    (escrow_account_id, entry_type, amount, transaction) where a positive amount
+    increases the escrow balance. One INSERT, no row locks on the escrow account;
+    the cached ``amount_held`` projections are refreshed once the caller commits.
+    """
+    entries = []
+    for escrow_account_id, entry_type, amount, transaction in movements:
+        group = uuid.uuid4()
+        counter = COUNTER_ACCOUNTS[entry_type]
+        entries.append(LedgerEntry(
+            escrow_account_id=escrow_account_id, transaction=transaction, entry_group=group,
+            entry_type=entry_type, ledger_account='escrow', amount=amount
+        ))
+        entries.append(LedgerEntry(
+            escrow_account_id=escrow_account_id, transaction=transaction, entry_group=group,
+            entry_type=entry_type, ledger_account=counter, amount=-amount
+        ))
+    LedgerEntry.objects.bulk_create(entries)
+
+    account_ids = {movement[0] for movement in movements}
+    db_transaction.on_commit(lambda: refresh_projections(account_ids))
+    return entries
+
+
+def record_funding(escrow_account, amount, transaction=None):
+    return post([(escrow_account.pk, 'funding', amount, transaction)])
+
+
+def record_disbursement(escrow_account, amount, transaction=None):
+    return post([(escrow_account.pk, 'disbursement', -amount, transaction)])
+
+
+# --- Reading ---
+
+def _latest_snapshot(field):
+    return Subquery(
+        LedgerSnapshot.objects.filter(escrow_account=OuterRef('escrow_account'))
+        .order_by('-last_entry_id').values(field)[:1]
+    )
+
+
+def balances(account_ids):
+    """{escrow_account_id: balance} as latest snapshot + sum of newer entries; two indexed queries for any number of accounts."""
+    account_ids = list(account_ids)
+    snapshots = _snapshot_balances(account_ids)
+
+    tails = LedgerEntry.objects.filter(
+        escrow_account__in=account_ids, ledger_account='escrow',
+        id__gt=Coalesce(_latest_snapshot('last_entry_id'), 0)
+    ).values('escrow_account').annotate(total=Sum('amount')).order_by()
+
+    result = {account_id: snapshots.get(account_id, ZERO) for account_id in account_ids}
+    for row in tails:
+        result[row['escrow_account']] += row['total']
+    return result
+
+
+def _snapshot_balances(account_ids):
+    latest = LedgerSnapshot.objects.filter(escrow_account__in=account_ids).annotate(
+        latest_id=Subquery(
+            LedgerSnapshot.objects.filter(escrow_account=OuterRef('escrow_account'))
+            .order_by('-last_entry_id').values('pk')[:1]
+        )
+    ).filter(pk=F('latest_id'))
+    return dict(latest.values_list('escrow_account', 'balance'))
+
+
+def balance(escrow_account):
+    return balances([escrow_account.pk])[escrow_account.pk]
+
+
+def refresh_projections(account_ids):
+    """
+    Recompute the cached EscrowAccount.amount_held from the ledger in one UPDATE
+    whose subqueries read the latest snapshot and the entries after it. Reading and
+    writing in the same statement means a refresh never writes a balance it read
+    before an earlier refresh's write, and the refresh queued by the last post to
+    commit always reads that post.
+    """
+    snapshot_balance = Subquery(
+        LedgerSnapshot.objects.filter(escrow_account=OuterRef('pk'))
+        .order_by('-last_entry_id').values('balance')[:1]
+    )
+    tail = Subquery(
+        LedgerEntry.objects.filter(
+            escrow_account=OuterRef('pk'), ledger_account='escrow',
+            id__gt=Coalesce(_latest_snapshot('last_entry_id'), 0)
+        ).values('escrow_account').annotate(total=Sum('amount')).values('total').order_by()
+    )
+    EscrowAccount.objects.filter(pk__in=list(account_ids)).update(
+        amount_held=Coalesce(snapshot_balance, ZERO) + Coalesce(tail, ZERO)
+    )
+
+
+# --- Snapshotting ---
+
+def take_snapshots(now=None):
+    """
+    Snapshot every account with entries newer than its last snapshot (older than
+    SNAPSHOT_LAG). Returns the number of snapshots written.
+    """
+    cutoff = (now or timezone.now()) - SNAPSHOT_LAG
+    pending = LedgerEntry.objects.filter(
+        ledger_account='escrow', created_at__lte=cutoff,
+        id__gt=Coalesce(_latest_snapshot('last_entry_id'), 0)
+    ).values('escrow_account').annotate(last_id=Max('id')).order_by()
+    last_ids = {row['escrow_account']: row['last_id'] for row in pending}
+    if not last_ids:
+        return 0
+
+    with db_transaction.atomic():
+        previous = _snapshot_balances(list(last_ids))
+        tails = LedgerEntry.objects.filter(
+            escrow_account__in=list(last_ids), ledger_account='escrow',
+            id__gt=Coalesce(_latest_snapshot('last_entry_id'), 0)
+        ).values('escrow_account', 'id', 'amount')
+
+        totals = {account_id: previous.get(account_id, ZERO) for account_id in last_ids}
+        for row in tails.iterator():
+            if row['id'] <= last_ids[row['escrow_account']]:
+                totals[row['escrow_account']] += row['amount']
+
+        LedgerSnapshot.objects.bulk_create([
+            LedgerSnapshot(escrow_account_id=account_id, last_entry_id=last_ids[account_id], balance=total)
+            for account_id, total in totals.items()
+        ])
+    return len(last_ids)
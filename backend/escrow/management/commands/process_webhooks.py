@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from escrow.webhooks import WebhookInboxProcessor
+
+
+class Command(BaseCommand):
+    help = "Settle pending payment gateway webhooks from the inbox (run from cron, or with --loop as a worker)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help="Keep polling the inbox instead of exiting when it is empty")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to sleep between polls with --loop")
+
+    def handle(self, *args, **options):
+        processor = WebhookInboxProcessor(batch_size=options['batch_size'])
+        while True:
+            totals = processor.drain()
+            if totals:
+                summary = ", ".join(f"{status}={count}" for status, count in sorted(totals.items()))
+                self.stdout.write(self.style.SUCCESS(f"Webhook inbox drained: {summary}"))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
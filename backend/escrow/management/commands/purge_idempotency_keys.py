@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from escrow.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = "Delete expired Idempotency-Key records (run daily from cron)."
+
+    def handle(self, *args, **options):
+        count = purge_expired_keys()
+        self.stdout.write(self.style.SUCCESS(f"Purged {count} expired idempotency key(s)"))
@@ -0,0 +1,14 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from escrow.events import purge_events
+
+
+class Command(BaseCommand):
+    help = "Delete relayed push events older than --hours (only used with LIVE_EVENTS_DB_FANOUT)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=1)
+
+    def handle(self, *args, **options):
+        count = purge_events(timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f"Purged {count} live event(s)"))
@@ -0,0 +1,48 @@
+import json
+import sys
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from escrow.reconciliation import SettlementReconciler, iter_report_rows
+
+
+class Command(BaseCommand):
+    help = "Reconcile a Paystack settlement report (CSV or JSON lines) against escrow transactions; discrepancies are written as JSON lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('report', help="Path to the report, or - for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension")
+        parser.add_argument('--amount-unit', choices=['naira', 'kobo'], default='naira')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat,
+                            help="First day the report covers (YYYY-MM-DD); defaults to the earliest row date")
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat,
+                            help="Last day the report covers (YYYY-MM-DD); defaults to the latest row date")
+        parser.add_argument('--output', help="Write discrepancies here instead of stdout")
+
+    def handle(self, *args, **options):
+        path = options['report']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        if bool(options['date_from']) != bool(options['date_to']):
+            raise CommandError("--from and --to must be given together")
+        period = (options['date_from'], options['date_to']) if options['date_from'] else None
+        reconciler = SettlementReconciler(
+            batch_size=options['batch_size'], amount_unit=options['amount_unit'], period=period
+        )
+
+        try:
+            report = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f"Cannot open report: {e}")
+        output = open(options['output'], 'w') if options['output'] else self.stdout
+
+        try:
+            for discrepancy in reconciler.reconcile(iter_report_rows(report, file_format)):
+                output.write(json.dumps(discrepancy) + '\n')
+        finally:
+            if report is not sys.stdin:
+                report.close()
+            if options['output']:
+                output.close()
+
+        summary = ', '.join(f"{key.replace('_', ' ')}: {value}" for key, value in reconciler.counts.items())
+        self.stderr.write(self.style.SUCCESS(f"Reconciliation complete ({summary})"))
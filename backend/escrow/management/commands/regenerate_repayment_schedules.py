@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from escrow.amortization import regenerate_schedules
+from escrow.models import LoanApplication
+
+
+class Command(BaseCommand):
+    help = "Rebuild repayment schedules for disbursed loans that have no paid installments yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loan-ids', type=int, nargs='*', help="Only these loans (default: every active loan)")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Loans per DELETE + bulk INSERT round")
+
+    def handle(self, *args, **options):
+        loans = LoanApplication.objects.filter(status='active').exclude(repayment_schedule__status='paid')
+        if options['loan_ids']:
+            loans = loans.filter(id__in=options['loan_ids'])
+        written = regenerate_schedules(loans.order_by('id'), chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} installments"))
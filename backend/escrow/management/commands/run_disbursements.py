@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from escrow.disbursements import DisbursementScheduler, MAX_BULK_TRANSFERS
+
+
+class Command(BaseCommand):
+    help = "Disburse all approved, fully funded loans through Paystack bulk transfers (run periodically from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=MAX_BULK_TRANSFERS, help="Transfers per bulk request (max 100)")
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many loans")
+
+    def handle(self, *args, **options):
+        totals = DisbursementScheduler(batch_size=options['batch_size']).run(limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Disbursements: {totals['completed']} completed, {totals['failed']} failed, "
+            f"{totals['unresolved']} awaiting verification"
+        ))
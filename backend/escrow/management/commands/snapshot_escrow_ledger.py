@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from escrow.ledger import take_snapshots
+
+
+class Command(BaseCommand):
+    help = "Snapshot escrow ledger balances so balance reads only sum recent entries (run every few minutes from cron)."
+
+    def handle(self, *args, **options):
+        count = take_snapshots()
+        self.stdout.write(self.style.SUCCESS(f"Snapshotted {count} escrow account(s)"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from escrow.overdue import OverdueSweeper
+
+
+class Command(BaseCommand):
+    help = "Mark past-due repayment installments as overdue and record aging buckets (run daily from cron)."
+
+    def handle(self, *args, **options):
+        sweep = OverdueSweeper().run()
+        self.stdout.write(f"Newly overdue: {sweep.newly_overdue}")
+        for bucket, stats in sweep.aging().items():
+            self.stdout.write(f"  {bucket.replace('_', '-')} days: {stats['count']} (₦{stats['amount']})")
+        self.stdout.write(self.style.SUCCESS("Overdue sweep complete"))
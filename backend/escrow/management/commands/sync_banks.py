@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from escrow.banks import sync_banks, load_snapshot
+from escrow.services import PaystackService
+
+
+class Command(BaseCommand):
+    help = "Refresh the bank directory from Paystack's bank list, falling back to the bundled snapshot (run daily from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--snapshot', action='store_true', help="Load the bundled snapshot without calling Paystack")
+
+    def handle(self, *args, **options):
+        source = 'snapshot'
+        entries = load_snapshot()
+        if not options['snapshot']:
+            result = PaystackService().list_banks()
+            if result['success']:
+                entries, source = result['banks'], 'Paystack'
+            else:
+                self.stderr.write(self.style.WARNING(f"Paystack bank list unavailable ({result['message']}), using snapshot"))
+
+        count = sync_banks(entries)
+        self.stdout.write(self.style.SUCCESS(f"Synced {count} banks from {source}"))
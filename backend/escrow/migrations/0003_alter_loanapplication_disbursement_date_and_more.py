@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('escrow', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='loanapplication',
+            name='disbursement_date',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('escrow', '0003_alter_loanapplication_disbursement_date_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(default='paystack', max_length=20)),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('event_type', models.CharField(max_length=100)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processed', 'Processed'), ('ignored', 'Ignored'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'escrow_webhook_events',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'id'], name='escrow_webhook_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('escrow', '0004_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='disbursement',
+            name='transfer_code',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='disbursement',
+            name='transfer_reference',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+    ]
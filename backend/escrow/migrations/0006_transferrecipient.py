@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('escrow', '0005_disbursement_transfer_reference'),
+        ('sme', '0002_businessprofile_verified_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_number', models.CharField(max_length=20)),
+                ('bank_code', models.CharField(max_length=10)),
+                ('name_hash', models.CharField(max_length=64)),
+                ('recipient_code', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('business', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='transfer_recipients', to='sme.businessprofile')),
+            ],
+            options={
+                'db_table': 'escrow_transfer_recipients',
+                'unique_together': {('account_number', 'bank_code', 'name_hash')},
+            },
+        ),
+    ]
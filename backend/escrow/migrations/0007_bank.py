@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('escrow', '0006_transferrecipient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Bank',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=10, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('slug', models.CharField(blank=True, max_length=255)),
+                ('aliases', models.JSONField(blank=True, default=list)),
+                ('active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'escrow_banks',
+                'ordering': ['name'],
+            },
+        ),
+    ]
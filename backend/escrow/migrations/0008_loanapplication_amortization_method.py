@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('escrow', '0007_bank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loanapplication',
+            name='amortization_method',
+            field=models.CharField(choices=[('flat', 'Flat'), ('reducing', 'Reducing Balance')], default='flat', max_length=20),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('escrow', '0008_loanapplication_amortization_method'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OverdueSweepRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_at', models.DateTimeField(auto_now_add=True)),
+                ('as_of', models.DateField(db_index=True)),
+                ('newly_overdue', models.IntegerField(default=0)),
+                ('count_1_30', models.IntegerField(default=0)),
+                ('count_31_60', models.IntegerField(default=0)),
+                ('count_61_90', models.IntegerField(default=0)),
+                ('count_90_plus', models.IntegerField(default=0)),
+                ('amount_1_30', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('amount_31_60', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('amount_61_90', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('amount_90_plus', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'db_table': 'escrow_overdue_sweep_runs',
+                'ordering': ['-run_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='repaymentschedule',
+            index=models.Index(fields=['status', 'due_date'], name='escrow_repay_status_due_idx'),
+        ),
+    ]
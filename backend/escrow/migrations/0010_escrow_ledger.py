@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:09
+
+import uuid
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_existing_balances(apps, schema_editor):
+    # Balances held before the ledger existed become one opening entry pair per account
+    EscrowAccount = apps.get_model('escrow', 'EscrowAccount')
+    LedgerEntry = apps.get_model('escrow', 'LedgerEntry')
+    entries = []
+    for account_id, amount in EscrowAccount.objects.filter(amount_held__gt=0).values_list('id', 'amount_held').iterator():
+        group = uuid.uuid4()
+        entries.append(LedgerEntry(escrow_account_id=account_id, entry_group=group, entry_type='opening', ledger_account='escrow', amount=amount))
+        entries.append(LedgerEntry(escrow_account_id=account_id, entry_group=group, entry_type='opening', ledger_account='opening_balance', amount=-amount))
+    LedgerEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('escrow', '0009_overdue_sweep'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_group', models.UUIDField(db_index=True)),
+                ('entry_type', models.CharField(choices=[('funding', 'Funding'), ('disbursement', 'Disbursement'), ('opening', 'Opening Balance')], max_length=20)),
+                ('ledger_account', models.CharField(choices=[('escrow', 'Escrow'), ('gateway_clearing', 'Gateway Clearing'), ('sme_payout', 'SME Payout'), ('opening_balance', 'Opening Balance')], max_length=30)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('escrow_account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='escrow.escrowaccount')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='escrow.transaction')),
+            ],
+            options={
+                'db_table': 'escrow_ledger_entries',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['escrow_account', 'ledger_account', 'id'], name='escrow_ledger_tail_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_entry_id', models.BigIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('escrow_account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ledger_snapshots', to='escrow.escrowaccount')),
+            ],
+            options={
+                'db_table': 'escrow_ledger_snapshots',
+                'indexes': [models.Index(fields=['escrow_account', 'last_entry_id'], name='escrow_snapshot_latest_idx')],
+            },
+        ),
+        migrations.RunPython(open_existing_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('escrow', '0010_escrow_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='payment_reference',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('escrow', '0012_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loanapplication',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='loannegotiation',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('escrow', '0013_negotiation_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LiveEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField(db_index=True)),
+                ('event_type', models.CharField(max_length=50)),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'db_table': 'escrow_live_events',
+                'ordering': ['id'],
+            },
+        ),
+    ]
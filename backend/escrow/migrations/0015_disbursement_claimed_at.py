@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 19:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('escrow', '0014_live_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='disbursement',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.core.validators import MinValueValidator
 from django.conf import settings
+from django.utils import timezone
 import uuid
 
 class LoanApplication(models.Model):
@@ -55,18 +56,26 @@ class LoanApplication(models.Model):
         choices=[('monthly', 'Monthly'), ('quarterly', 'Quarterly'), ('bullet', 'Bullet')],
         default='monthly'
     )
+    amortization_method = models.CharField(
+        max_length=20,
+        choices=[('flat', 'Flat'), ('reducing', 'Reducing Balance')],
+        default='flat'
+    )
     
     # Status and tracking
     status = models.CharField(max_length=20, choices=LOAN_STATUS, default='draft')
     application_date = models.DateTimeField(auto_now_add=True)
     approval_date = models.DateTimeField(null=True, blank=True)
-    disbursement_date = models.DateTimeField(null=True, blank=True)
+    disbursement_date = models.DateTimeField(null=True, blank=True, db_index=True)
     completion_date = models.DateTimeField(null=True, blank=True)
     
     # Risk assessment
     risk_score = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     loan_to_value_ratio = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     
+    # Optimistic-concurrency token, bumped by every guarded transition (see escrow.negotiations)
+    version = models.PositiveIntegerField(default=0)
+    
     # Metadata
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -78,6 +87,18 @@ class LoanApplication(models.Model):
     def __str__(self):
         return f"Loan #{self.id} - {self.sme_business.business_name}"
 
+    @property
+    def lender_user_id(self):
+        """The assigned lender's user id (None if unassigned), without loading the user row."""
+        return self.lender.user_id if self.lender_id else None
+
+    def cache_tags(self):
+        """Cache tags (see core.caching) of data derived from this loan."""
+        tags = [f"loan:{self.pk}", f"sme:{self.sme_business_id}"]
+        if self.lender_id:
+            tags.append(f"lender:{self.lender_id}")
+        return tags
+
 class EscrowAccount(models.Model):
     ESCROW_STATUS = [
         ('pending', 'Pending'),
@@ -135,12 +156,12 @@ class Transaction(models.Model):
     description = models.TextField(blank=True)
     
     # Payment gateway references
-    payment_reference = models.CharField(max_length=255, blank=True)
+    payment_reference = models.CharField(max_length=255, blank=True, db_index=True)
     gateway_response = models.JSONField(null=True, blank=True)
     
     # Timestamps
     initiated_at = models.DateTimeField(auto_now_add=True)
-    completed_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True, db_index=True)
     
     class Meta:
         db_table = 'escrow_transactions'
@@ -148,6 +169,20 @@ class Transaction(models.Model):
     
     def __str__(self):
         return f"TXN {self.transaction_id} - {self.transaction_type} - ₦{self.amount}"
+    
+    def complete_once(self, gateway_response, now=None):
+        """
+        Mark this transaction completed unless another path already has. The check is
+        part of the UPDATE, so when the webhook and the verify callback settle the same
+        payment at once exactly one gets True and credits the escrow.
+        """
+        now = now or timezone.now()
+        claimed = Transaction.objects.filter(pk=self.pk).exclude(status='completed').update(
+            status='completed', completed_at=now, gateway_response=gateway_response
+        )
+        if claimed:
+            self.status, self.completed_at, self.gateway_response = 'completed', now, gateway_response
+        return bool(claimed)
 
 class RepaymentSchedule(models.Model):
     loan_application = models.ForeignKey(LoanApplication, on_delete=models.CASCADE, related_name='repayment_schedule')
@@ -169,6 +204,7 @@ class RepaymentSchedule(models.Model):
         db_table = 'escrow_repayment_schedules'
         ordering = ['installment_number']
         unique_together = ['loan_application', 'installment_number']
+        indexes = [models.Index(fields=['status', 'due_date'], name='escrow_repay_status_due_idx')]
     
     def __str__(self):
         return f"Installment {self.installment_number} - {self.loan_application}"
@@ -190,8 +226,13 @@ class Disbursement(models.Model):
         default='pending'
     )
     
+    # Gateway transfer identifiers (reference is ours and makes bulk submissions safe to resend)
+    transfer_reference = models.CharField(max_length=100, blank=True, db_index=True)
+    transfer_code = models.CharField(max_length=100, blank=True)
+    
     # Timestamps
     initiated_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)  # last time a scheduler run took it up
     completed_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
@@ -233,6 +274,7 @@ class LoanNegotiation(models.Model):
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     message = models.TextField(blank=True, help_text="A short message for the offer")
+    version = models.PositiveIntegerField(default=0)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -243,4 +285,212 @@ class LoanNegotiation(models.Model):
     
     def __str__(self):
         return f"Offer from {self.user.email} on {self.loan_application.id} for {self.proposed_rate}%"
-# -----------------
\ No newline at end of file
+# -----------------
+
+class WebhookEvent(models.Model):
+    """Raw payment gateway webhook, stored on receipt and settled later by the inbox processor."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('ignored', 'Ignored'),
+        ('failed', 'Failed'),
+    ]
+    
+    provider = models.CharField(max_length=20, default='paystack')
+    # Dedupe key: the gateway's event type plus its object id (Paystack retries deliveries)
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'escrow_webhook_events'
+        ordering = ['id']
+        indexes = [models.Index(fields=['status', 'id'], name='escrow_webhook_status_idx')]
+    
+    def __str__(self):
+        return f"{self.provider} {self.event_type} ({self.status})"
+
+
+class TransferRecipient(models.Model):
+    """Paystack recipient code cached per beneficiary bank account, so repeat payouts skip creating it again."""
+    business = models.ForeignKey('sme.BusinessProfile', on_delete=models.CASCADE, related_name='transfer_recipients', null=True, blank=True)
+    account_number = models.CharField(max_length=20)
+    bank_code = models.CharField(max_length=10)
+    # SHA-256 of the normalised account name: a renamed account must not reuse an old recipient
+    name_hash = models.CharField(max_length=64)
+    recipient_code = models.CharField(max_length=100)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'escrow_transfer_recipients'
+        unique_together = ['account_number', 'bank_code', 'name_hash']
+    
+    def __str__(self):
+        return f"{self.recipient_code} ({self.bank_code}/{self.account_number})"
+
+
+class Bank(models.Model):
+    """Paystack bank directory entry, synced from the bank list API (or the bundled snapshot)."""
+    code = models.CharField(max_length=10, unique=True)
+    name = models.CharField(max_length=255)
+    slug = models.CharField(max_length=255, blank=True)
+    aliases = models.JSONField(default=list, blank=True)
+    active = models.BooleanField(default=True)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'escrow_banks'
+        ordering = ['name']
+    
+    def __str__(self):
+        return f"{self.name} ({self.code})"
+
+
+class OverdueSweepRun(models.Model):
+    """One pass of the overdue sweeper: rows it flipped and the aging of everything overdue afterwards."""
+    run_at = models.DateTimeField(auto_now_add=True)
+    as_of = models.DateField(db_index=True)
+    newly_overdue = models.IntegerField(default=0)
+    
+    # Aging buckets by days past due
+    count_1_30 = models.IntegerField(default=0)
+    count_31_60 = models.IntegerField(default=0)
+    count_61_90 = models.IntegerField(default=0)
+    count_90_plus = models.IntegerField(default=0)
+    amount_1_30 = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    amount_31_60 = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    amount_61_90 = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    amount_90_plus = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    BUCKETS = ('1_30', '31_60', '61_90', '90_plus')
+    
+    class Meta:
+        db_table = 'escrow_overdue_sweep_runs'
+        ordering = ['-run_at']
+    
+    def __str__(self):
+        return f"Overdue sweep {self.as_of}: {self.newly_overdue} newly overdue"
+    
+    def aging(self):
+        return {
+            bucket: {'count': getattr(self, f'count_{bucket}'), 'amount': getattr(self, f'amount_{bucket}')}
+            for bucket in self.BUCKETS
+        }
+
+
+class LedgerEntryQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise TypeError("Ledger entries are append-only")
+    
+    def delete(self):
+        raise TypeError("Ledger entries are append-only")
+
+
+class LedgerEntry(models.Model):
+    """
+    Immutable double-entry posting. Every movement writes one balanced group:
+    the escrow side and its counter account sum to zero.
+    """
+    LEDGER_ACCOUNTS = [
+        ('escrow', 'Escrow'),
+        ('gateway_clearing', 'Gateway Clearing'),
+        ('sme_payout', 'SME Payout'),
+        ('opening_balance', 'Opening Balance'),
+    ]
+    ENTRY_TYPES = [
+        ('funding', 'Funding'),
+        ('disbursement', 'Disbursement'),
+        ('opening', 'Opening Balance'),
+    ]
+    
+    escrow_account = models.ForeignKey(EscrowAccount, on_delete=models.PROTECT, related_name='ledger_entries')
+    transaction = models.ForeignKey(Transaction, on_delete=models.PROTECT, related_name='ledger_entries', null=True, blank=True)
+    entry_group = models.UUIDField(db_index=True)
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPES)
+    ledger_account = models.CharField(max_length=30, choices=LEDGER_ACCOUNTS)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)  # signed: + debit, - credit
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = LedgerEntryQuerySet.as_manager()
+    
+    class Meta:
+        db_table = 'escrow_ledger_entries'
+        ordering = ['id']
+        indexes = [models.Index(fields=['escrow_account', 'ledger_account', 'id'], name='escrow_ledger_tail_idx')]
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError("Ledger entries are append-only")
+        super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        raise TypeError("Ledger entries are append-only")
+    
+    def __str__(self):
+        return f"{self.ledger_account} {self.amount} ({self.entry_type})"
+
+
+class LedgerSnapshot(models.Model):
+    """Escrow-side balance of an account up to and including ``last_entry_id``."""
+    escrow_account = models.ForeignKey(EscrowAccount, on_delete=models.PROTECT, related_name='ledger_snapshots')
+    last_entry_id = models.BigIntegerField()
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'escrow_ledger_snapshots'
+        indexes = [models.Index(fields=['escrow_account', 'last_entry_id'], name='escrow_snapshot_latest_idx')]
+    
+    def __str__(self):
+        return f"Snapshot {self.escrow_account_id} @ {self.last_entry_id}: ₦{self.balance}"
+
+
+class IdempotencyKey(models.Model):
+    """Client-supplied Idempotency-Key and the response it produced, replayed on retries until it expires."""
+    STATUS_CHOICES = [
+        ('in_progress', 'In Progress'),
+        ('completed', 'Completed'),
+    ]
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    # SHA-256 of method, path and body: a reused key with a different request is rejected
+    fingerprint = models.CharField(max_length=64)
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    response_status = models.IntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        db_table = 'escrow_idempotency_keys'
+        unique_together = ['user', 'key']
+    
+    def __str__(self):
+        return f"{self.key} ({self.status})"
+
+
+class LiveEvent(models.Model):
+    """Push event for one user, written only when LIVE_EVENTS_DB_FANOUT relays events between worker processes."""
+    user_id = models.BigIntegerField(db_index=True)
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        db_table = 'escrow_live_events'
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.event_type} for user {self.user_id}"
@@ -0,0 +1,76 @@
+from django.db import transaction as db_transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from core.caching import invalidate
+from core.outbox import enqueue
+from .models import LoanApplication, LoanNegotiation
+from . import notifications
+
+# Loan statuses an offer can still be accepted in; later statuses are owned by other writers
+OPEN_LOAN_STATUSES = ('draft', 'submitted', 'under_review')
+
+
+class StaleVersionError(Exception):
+    """The offer or loan changed since it was read; the caller should reload and retry."""
+
+
+def transition_offer(offer, from_status, to_status, expected_version=None):
+    """
+    Move an offer between statuses with one conditional UPDATE on (id, version, status).
+    Raises StaleVersionError if another request got there first.
+    """
+    version = offer.version if expected_version is None else expected_version
+    updated = LoanNegotiation.objects.filter(pk=offer.pk, version=version, status=from_status).update(
+        status=to_status, version=F('version') + 1, updated_at=timezone.now()
+    )
+    if not updated:
+        raise StaleVersionError("This offer was changed by another request.")
+    offer.status = to_status
+    offer.version = version + 1
+    # Conditional UPDATEs skip post_save, so cached offer stats are expired here
+    invalidate(*offer.loan_application.cache_tags())
+
+
+def accept_offer(offer, lender_profile, expected_version=None):
+    """
+    Accept a pending offer: approve its loan for ``lender_profile`` at the offered
+    rate and reject the loan's other pending offers.
+
+    Both rows are guarded by version, so two concurrent accepts on the same loan
+    cannot both win: the loser's UPDATE matches no row and the whole transition
+    rolls back with StaleVersionError. The loan UPDATE also requires an open
+    status and no other lender, because writers outside this module (reject,
+    disbursement, plain saves) do not bump the version. Nothing is locked
+    beyond the rows written.
+    """
+    loan_application = offer.loan_application
+    now = timezone.now()
+    with db_transaction.atomic():
+        transition_offer(offer, 'pending', 'accepted', expected_version)
+
+        updated = LoanApplication.objects.filter(
+            Q(lender__isnull=True) | Q(lender=lender_profile),
+            pk=loan_application.pk, version=loan_application.version, status__in=OPEN_LOAN_STATUSES,
+        ).update(
+            lender=lender_profile,
+            negotiated_rate=offer.proposed_rate,
+            status='approved',
+            approval_date=now,
+            updated_at=now,
+            version=F('version') + 1,
+        )
+        if not updated:
+            raise StaleVersionError("This loan application was changed by another request or is no longer open for offers.")
+
+        loan_application.negotiations.filter(status='pending').exclude(pk=offer.pk).update(
+            status='rejected', version=F('version') + 1, updated_at=now
+        )
+
+        loan_application.lender = lender_profile
+        loan_application.negotiated_rate = offer.proposed_rate
+        loan_application.status = 'approved'
+        loan_application.approval_date = now
+        loan_application.version += 1
+        invalidate(*loan_application.cache_tags())
+        enqueue(notifications.offer_accepted(offer, loan_application))
+    return loan_application
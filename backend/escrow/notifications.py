@@ -0,0 +1,72 @@
+from core.outbox import notification
+
+
+def _party_emails(loan_application):
+    lender = loan_application.lender
+    return [loan_application.sme_business.user.email, lender.user.email if lender else None]
+
+
+def pitched(loan_application):
+    sme = loan_application.sme_business
+    return notification(
+        'loan.pitched', [loan_application.lender.contact_email],
+        f"New loan application from {sme.business_name}",
+        f"{sme.business_name} has pitched a ₦{loan_application.loan_amount} loan application "
+        f"(#{loan_application.id}) to you for review.",
+        loan_application_id=loan_application.id,
+    )
+
+
+def offer_made(offer, loan_application):
+    return notification(
+        'offer.created', [loan_application.sme_business.user.email],
+        f"New offer on loan application #{loan_application.id}",
+        f"A lender has offered {offer.proposed_rate}% on your ₦{loan_application.loan_amount} loan application.",
+        loan_application_id=loan_application.id, offer_id=str(offer.id),
+    )
+
+
+def offer_countered(counter_offer, original_offer, loan_application):
+    return notification(
+        'offer.countered', [original_offer.user.email],
+        f"Counter-offer on loan application #{loan_application.id}",
+        f"{loan_application.sme_business.business_name} countered your offer with {counter_offer.proposed_rate}%.",
+        loan_application_id=loan_application.id, offer_id=str(counter_offer.id),
+    )
+
+
+def offer_rejected(offer, loan_application):
+    return notification(
+        'offer.rejected', [offer.user.email],
+        f"Offer declined on loan application #{loan_application.id}",
+        f"{loan_application.sme_business.business_name} declined your offer of {offer.proposed_rate}%.",
+        loan_application_id=loan_application.id, offer_id=str(offer.id),
+    )
+
+
+def offer_accepted(offer, loan_application):
+    return notification(
+        'offer.accepted', _party_emails(loan_application),
+        f"Loan application #{loan_application.id} approved",
+        f"The offer of {offer.proposed_rate}% was accepted. The lender can now fund escrow.",
+        loan_application_id=loan_application.id, offer_id=str(offer.id),
+    )
+
+
+def escrow_funded(loan_application, amount):
+    return notification(
+        'escrow.funded', _party_emails(loan_application),
+        f"Escrow funded for loan application #{loan_application.id}",
+        f"₦{amount} has been received into escrow for loan application #{loan_application.id}.",
+        loan_application_id=loan_application.id,
+    )
+
+
+def loan_disbursed(loan_application, amount):
+    return notification(
+        'loan.disbursed', _party_emails(loan_application),
+        f"Loan #{loan_application.id} disbursed",
+        f"₦{amount} has been paid out to {loan_application.sme_business.business_name}. "
+        f"Repayments now follow the schedule.",
+        loan_application_id=loan_application.id,
+    )
@@ -0,0 +1,54 @@
+import logging
+from datetime import timedelta
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from core.caching import invalidate
+from .models import RepaymentSchedule, OverdueSweepRun
+
+logger = logging.getLogger(__name__)
+
+
+class OverdueSweeper:
+    """
+    Flags past-due installments as overdue with one set-based UPDATE on the
+    (status, due_date) index, then records the aging of the overdue book.
+    """
+
+    def __init__(self, today=None):
+        self.today = today or timezone.now().date()
+
+    def _bucket_filters(self):
+        days_ago = lambda days: self.today - timedelta(days=days)
+        return {
+            '1_30': Q(due_date__gte=days_ago(30)),
+            '31_60': Q(due_date__lt=days_ago(30), due_date__gte=days_ago(60)),
+            '61_90': Q(due_date__lt=days_ago(60), due_date__gte=days_ago(90)),
+            '90_plus': Q(due_date__lt=days_ago(90)),
+        }
+
+    def aging(self):
+        """{bucket: (count, amount)} over overdue installments, in one aggregate."""
+        aggregates = {}
+        for bucket, condition in self._bucket_filters().items():
+            aggregates[f'count_{bucket}'] = Count('id', filter=condition)
+            aggregates[f'amount_{bucket}'] = Sum('total_amount', filter=condition)
+        stats = RepaymentSchedule.objects.filter(status='overdue').aggregate(**aggregates)
+        return {key: value or 0 for key, value in stats.items()}
+
+    def run(self):
+        due = RepaymentSchedule.objects.filter(status='pending', due_date__lt=self.today)
+        # The set-based UPDATE skips post_save; expire the cached portfolios of the lenders affected
+        lender_ids = set(due.exclude(loan_application__lender=None).values_list('loan_application__lender_id', flat=True))
+        newly_overdue = due.update(status='overdue')
+        invalidate(*(f"lender:{lender_id}" for lender_id in lender_ids))
+
+        sweep = OverdueSweepRun.objects.create(as_of=self.today, newly_overdue=newly_overdue, **self.aging())
+        if newly_overdue:
+            logger.info(f"Overdue sweep flagged {newly_overdue} installment(s)")
+        return sweep
+
+
+def latest_aging():
+    """Aging buckets from the most recent sweep, or None if the sweeper has never run."""
+    sweep = OverdueSweepRun.objects.first()
+    return sweep.aging() if sweep else None
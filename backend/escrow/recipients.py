@@ -0,0 +1,61 @@
+import hashlib
+import logging
+from .models import TransferRecipient
+
+logger = logging.getLogger(__name__)
+
+
+def name_hash(account_name):
+    return hashlib.sha256(' '.join(account_name.lower().split()).encode()).hexdigest()
+
+
+def recipient_key(account_number, bank_code, account_name):
+    return (account_number, bank_code, name_hash(account_name))
+
+
+class RecipientResolver:
+    """
+    Resolves beneficiaries to Paystack recipient codes through the TransferRecipient
+    cache: one query for the whole batch, a Paystack call only for misses.
+    """
+
+    def __init__(self, paystack):
+        self.paystack = paystack
+
+    def resolve_many(self, beneficiaries):
+        """
+        ``beneficiaries`` is a list of (business, account_name, account_number, bank_code).
+        Returns {recipient_key: {'success', 'recipient_code' | 'message'}}.
+        """
+        keys = {recipient_key(number, code, name): (business, name, number, code)
+                for business, name, number, code in beneficiaries}
+
+        cached = TransferRecipient.objects.filter(
+            account_number__in={key[0] for key in keys}
+        ).values_list('account_number', 'bank_code', 'name_hash', 'recipient_code')
+        results = {
+            (number, code, hashed): {'success': True, 'recipient_code': recipient_code}
+            for number, code, hashed, recipient_code in cached
+            if (number, code, hashed) in keys
+        }
+
+        created = []
+        for key, (business, name, number, code) in keys.items():
+            if key in results:
+                continue
+            result = self.paystack.create_transfer_recipient(name=name, account_number=number, bank_code=code)
+            results[key] = result
+            if result['success']:
+                created.append(TransferRecipient(
+                    business=business, account_number=number, bank_code=code,
+                    name_hash=key[2], recipient_code=result['recipient_code']
+                ))
+
+        if created:
+            TransferRecipient.objects.bulk_create(created, ignore_conflicts=True)
+            logger.info(f"Cached {len(created)} new transfer recipient(s)")
+        return results
+
+    def resolve(self, business, account_name, account_number, bank_code):
+        key = recipient_key(account_number, bank_code, account_name)
+        return self.resolve_many([(business, account_name, account_number, bank_code)])[key]
@@ -0,0 +1,178 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Transaction
+
+# Column names accepted for each field, compared lower-cased
+REFERENCE_FIELDS = ('reference', 'payment_reference', 'transaction_reference', 'transfer_reference')
+AMOUNT_FIELDS = ('amount', 'settled_amount')
+STATUS_FIELDS = ('status', 'transaction_status')
+DATE_FIELDS = ('paid_at', 'transaction_date', 'settled_at', 'date', 'created_at')
+
+# Transaction types a settlement report covers (collections; transfers out settle separately)
+SETTLED_TYPES = ('fund_escrow', 'repayment')
+
+# Paystack report statuses mapped onto Transaction.status
+GATEWAY_STATUSES = {
+    'success': 'completed',
+    'successful': 'completed',
+    'completed': 'completed',
+    'failed': 'failed',
+    'reversed': 'failed',
+    'abandoned': 'cancelled',
+    'cancelled': 'cancelled',
+    'pending': 'pending',
+    'processing': 'pending',
+    'ongoing': 'pending',
+}
+
+
+def _pick(row, fields):
+    for field in fields:
+        value = row.get(field)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def _parse_day(value):
+    text = str(value).strip()
+    try:
+        parsed = parse_datetime(text)
+        return parsed.date() if parsed else parse_date(text[:10])
+    except ValueError:
+        return None
+
+
+def iter_report_rows(stream, file_format='csv'):
+    """
+    Yield (line, row) for each record of a CSV or JSON-lines settlement report,
+    with keys lower-cased. Reads one line at a time, so memory stays flat.
+    JSON lines that are malformed or not objects yield (line, None).
+    """
+    if file_format == 'jsonl':
+        for line, text in enumerate(stream, start=1):
+            text = text.strip()
+            if not text:
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError:
+                row = None
+            yield line, {key.lower(): value for key, value in row.items()} if isinstance(row, dict) else None
+        return
+
+    reader = csv.DictReader(stream)
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+    for row in reader:
+        yield reader.line_num, row
+
+
+class SettlementReconciler:
+    """
+    Matches settlement report rows to Transactions by payment_reference.
+
+    Rows are consumed in batches; each batch costs one indexed IN query that
+    fetches only the columns being compared. Discrepancies are yielded as they
+    are found so the caller can stream them out.
+
+    After the last row, completed collections in the report's period that the
+    report never mentioned are yielded as ``missing_from_report``: one query
+    over the period, checked against the set of references seen. The period is
+    ``period`` (first day, last day) or else the span of the rows' date column;
+    with neither, that check is skipped.
+    """
+
+    def __init__(self, batch_size=2000, amount_unit='naira', period=None):
+        self.batch_size = batch_size
+        self.divisor = Decimal(100) if amount_unit == 'kobo' else Decimal(1)
+        self.period = period
+        self.counts = {
+            'rows': 0, 'matched': 0, 'missing': 0, 'amount_mismatch': 0, 'status_mismatch': 0, 'invalid': 0,
+            'missing_from_report': 0,
+        }
+        self._seen = set()
+        self._days = None
+
+    def reconcile(self, rows):
+        batch = []
+        for line, row in rows:
+            self.counts['rows'] += 1
+            parsed = self._parse(line, row)
+            if 'reference' in parsed:
+                self._seen.add(str(parsed['reference']).strip())
+            if 'issue' in parsed:
+                self.counts['invalid'] += 1
+                yield parsed
+                continue
+            batch.append(parsed)
+            if len(batch) >= self.batch_size:
+                yield from self._check(batch)
+                batch = []
+        if batch:
+            yield from self._check(batch)
+        yield from self._check_unreported()
+
+    def _parse(self, line, row):
+        if row is None:
+            return {'issue': 'invalid', 'line': line, 'message': 'Malformed JSON line'}
+        reference = _pick(row, REFERENCE_FIELDS)
+        if reference is None:
+            return {'issue': 'invalid', 'line': line, 'message': 'No reference column'}
+        try:
+            amount = Decimal(str(_pick(row, AMOUNT_FIELDS)).replace(',', '')) / self.divisor
+        except InvalidOperation:
+            return {'issue': 'invalid', 'line': line, 'reference': reference, 'message': 'Unreadable amount'}
+        status = str(_pick(row, STATUS_FIELDS) or '').strip().lower()
+        day = _pick(row, DATE_FIELDS)
+        day = _parse_day(day) if day is not None else None
+        if day is not None:
+            self._days = (min(self._days[0], day), max(self._days[1], day)) if self._days else (day, day)
+        return {'line': line, 'reference': str(reference).strip(), 'amount': amount, 'status': GATEWAY_STATUSES.get(status, status)}
+
+    def _check(self, batch):
+        found = {
+            reference: (transaction_id, amount, status)
+            for reference, transaction_id, amount, status in Transaction.objects.filter(
+                payment_reference__in={item['reference'] for item in batch}
+            ).values_list('payment_reference', 'transaction_id', 'amount', 'status')
+        }
+
+        for item in batch:
+            match = found.get(item['reference'])
+            if match is None:
+                self.counts['missing'] += 1
+                yield {'issue': 'missing', 'line': item['line'], 'reference': item['reference'],
+                       'report_amount': str(item['amount'])}
+                continue
+
+            transaction_id, amount, status = match
+            clean = True
+            if amount != item['amount']:
+                clean = False
+                self.counts['amount_mismatch'] += 1
+                yield {'issue': 'amount_mismatch', 'line': item['line'], 'reference': item['reference'],
+                       'transaction_id': transaction_id, 'report_amount': str(item['amount']), 'amount': str(amount)}
+            if item['status'] and status != item['status']:
+                clean = False
+                self.counts['status_mismatch'] += 1
+                yield {'issue': 'status_mismatch', 'line': item['line'], 'reference': item['reference'],
+                       'transaction_id': transaction_id, 'report_status': item['status'], 'status': status}
+            if clean:
+                self.counts['matched'] += 1
+
+    def _check_unreported(self):
+        period = self.period or self._days
+        if period is None:
+            return
+        unreported = Transaction.objects.filter(
+            status='completed', transaction_type__in=SETTLED_TYPES,
+            completed_at__date__gte=period[0], completed_at__date__lte=period[1],
+        ).exclude(payment_reference='').order_by('completed_at').values_list('payment_reference', 'transaction_id', 'amount')
+        for reference, transaction_id, amount in unreported.iterator():
+            if reference in self._seen:
+                continue
+            self.counts['missing_from_report'] += 1
+            yield {'issue': 'missing_from_report', 'reference': reference, 'transaction_id': transaction_id,
+                   'amount': str(amount)}
@@ -22,7 +22,7 @@ class LoanApplicationSerializer(serializers.ModelSerializer):
             'id', 'sme_business', 'lender', 'loan_amount', 'interest_rate',
             'negotiated_rate', # <-- ADD NEGOTIATED RATE
             'tenure_months', 'purpose', 'repayment_frequency', 'repayment_frequency_display',
-            'status', 'status_display', 'application_date', 'approval_date',
+            'amortization_method', 'status', 'status_display', 'application_date', 'approval_date',
             'disbursement_date', 'completion_date', 'risk_score', 'loan_to_value_ratio',
             'escrow_account', 'created_at', 'updated_at'
         ]
@@ -52,7 +52,7 @@ class LoanApplicationCreateSerializer(serializers.ModelSerializer):
         fields = [
             # 'sme_business', # SME business is set from the request user, not the payload
             'loan_amount', 'interest_rate', 'tenure_months',
-            'purpose', 'repayment_frequency'
+            'purpose', 'repayment_frequency', 'amortization_method'
         ]
     
     def validate(self, data):
@@ -110,9 +110,9 @@ class RepaymentScheduleSerializer(serializers.ModelSerializer):
         ]
     
     def get_is_overdue(self, obj):
-        """Check if repayment is overdue"""
+        """Check if repayment is overdue (the sweeper may not have flagged it yet)"""
         from django.utils import timezone
-        return obj.status == 'pending' and obj.due_date < timezone.now().date()
+        return obj.status == 'overdue' or (obj.status == 'pending' and obj.due_date < timezone.now().date())
 
 class DisbursementSerializer(serializers.ModelSerializer):
     loan_application = LoanApplicationSerializer(read_only=True)
@@ -198,9 +198,9 @@ class LoanNegotiationSerializer(serializers.ModelSerializer):
         model = LoanNegotiation
         fields = [
             'id', 'loan_application', 'user', 'proposed_rate', 
-            'message', 'status', 'created_at'
+            'message', 'status', 'version', 'created_at'
         ]
-        read_only_fields = ['id', 'loan_application', 'user', 'status', 'created_at']
+        read_only_fields = ['id', 'loan_application', 'user', 'status', 'version', 'created_at']
 
     def create(self, validated_data):
         request = self.context['request']
@@ -210,6 +210,9 @@ class LoanNegotiationSerializer(serializers.ModelSerializer):
         if request.user.user_type != 'lender':
             raise serializers.ValidationError("Only lenders can make offers.")
         
+        # perform_create also passes these through save(); the context values win
+        validated_data.pop('loan_application', None)
+        validated_data.pop('user', None)
         offer = LoanNegotiation.objects.create(
             loan_application=loan_application,
             user=request.user,
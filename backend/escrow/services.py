@@ -2,11 +2,21 @@ import uuid
 from decimal import Decimal
 from django.utils import timezone
 from django.db import transaction as db_transaction
-from .models import EscrowAccount, Transaction, Disbursement, RepaymentSchedule
+from .models import EscrowAccount, Transaction, RepaymentSchedule
+from .banks import bank_directory, load_snapshot
+from .amortization import regenerate_schedules
+from . import ledger
+from .events import publish_to_parties
+from . import notifications
+from core.outbox import enqueue
 from django.conf import settings
+from requests.adapters import HTTPAdapter
 import requests
 import json
 import logging
+import random
+import threading
+import time
 
 # Set up logging for service errors
 logger = logging.getLogger(__name__)
@@ -41,39 +51,145 @@ class PaymentGatewayService:
             'gateway_response': {'status': 'success', 'message': 'Disbursement processed successfully'}
         }
 
-# --- Paystack Service (Using Direct Requests) ---
+# --- Paystack HTTP plumbing ---
+
+_session = None
+_session_lock = threading.Lock()
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def get_paystack_session():
+    """Process-wide requests.Session so Paystack calls reuse pooled keep-alive connections."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                pool_size = getattr(settings, 'PAYSTACK_POOL_MAXSIZE', 10)
+                # Retries are handled in PaystackService so they can be limited to idempotent calls
+                session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0))
+                session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0))
+                _session = session
+    return _session
+
+
+class GatewayMetrics:
+    """Thread-safe per-operation call counters and latency totals for the Paystack client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, operation, elapsed_ms, ok, retries):
+        with self._lock:
+            stats = self._stats.setdefault(operation, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0
+            })
+            stats['calls'] += 1
+            stats['errors'] += 0 if ok else 1
+            stats['retries'] += retries
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+    def snapshot(self):
+        """{operation: {calls, errors, retries, avg_ms, max_ms}}"""
+        with self._lock:
+            return {
+                operation: {
+                    'calls': stats['calls'],
+                    'errors': stats['errors'],
+                    'retries': stats['retries'],
+                    'avg_ms': round(stats['total_ms'] / stats['calls'], 2),
+                    'max_ms': round(stats['max_ms'], 2),
+                }
+                for operation, stats in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+paystack_metrics = GatewayMetrics()
+
+# --- Paystack Service ---
 
 class PaystackService:
-    """Service for handling Paystack API integration via requests, avoiding wrapper issues."""
+    """Service for handling Paystack API integration over a shared pooled session."""
 
     def __init__(self):
         self.secret_key = getattr(settings, 'PAYSTACK_SECRET_KEY', 'sk_test_...')
-        self.base_url = "https://api.paystack.co"
+        self.base_url = getattr(settings, 'PAYSTACK_BASE_URL', 'https://api.paystack.co').rstrip('/')
+        self.timeout = getattr(settings, 'PAYSTACK_TIMEOUT', 10)
+        self.max_retries = getattr(settings, 'PAYSTACK_MAX_RETRIES', 2)
+        self.retry_backoff = getattr(settings, 'PAYSTACK_RETRY_BACKOFF', 0.5)
+        self.session = get_paystack_session()
         self.headers = {
             "Authorization": f"Bearer {self.secret_key}",
             "Content-Type": "application/json"
         }
-        
-    def _make_api_call(self, method, endpoint, data=None):
+
+    def _is_retryable(self, method, data):
+        """Only GETs and calls carrying a Paystack reference (which Paystack dedupes) are safe to resend."""
+        if method == 'GET':
+            return True
+        if not data:
+            return False
+        if 'transfers' in data:
+            return all(transfer.get('reference') for transfer in data['transfers'])
+        return bool(data.get('reference'))
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff."""
+        time.sleep(random.uniform(0, self.retry_backoff * (2 ** attempt)))
+
+    def _make_api_call(self, method, endpoint, data=None, operation=None):
         """Internal method to handle Paystack API calls."""
+        if method not in ('GET', 'POST'):
+            return {'status': False, 'message': 'Unsupported HTTP method'}
+
         url = f"{self.base_url}/{endpoint}"
-        try:
-            if method == 'POST':
-                response = requests.post(url, headers=self.headers, json=data, timeout=10)
-            elif method == 'GET':
-                response = requests.get(url, headers=self.headers, timeout=10)
-            else:
-                return {'status': False, 'message': 'Unsupported HTTP method'}
-
-            response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-            return response.json()
-        
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Paystack API call failed ({method} {endpoint}): {e}")
-            return {"status": False, "message": f"API request error: {e}"}
-        except json.JSONDecodeError:
-            logger.error(f"Paystack API returned invalid JSON: {response.text}")
-            return {"status": False, "message": "API returned invalid response"}
+        operation = operation or endpoint
+        attempts = 1 + (self.max_retries if self._is_retryable(method, data) else 0)
+        started = time.perf_counter()
+        result = None
+
+        for attempt in range(attempts):
+            if attempt:
+                self._backoff(attempt - 1)
+            try:
+                response = self.session.request(method, url, headers=self.headers, json=data, timeout=self.timeout)
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt + 1 < attempts:
+                    logger.warning(f"Paystack {method} {operation} returned {response.status_code}, retrying")
+                    continue
+                response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
+                result = response.json()
+                break
+
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt + 1 < attempts:
+                    logger.warning(f"Paystack {method} {operation} failed ({e}), retrying")
+                    continue
+                logger.error(f"Paystack API call failed ({method} {endpoint}): {e}")
+                result = {"status": False, "message": f"API request error: {e}"}
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Paystack API call failed ({method} {endpoint}): {e}")
+                result = {
+                    "status": False, "message": f"API request error: {e}",
+                    "http_status": getattr(e.response, 'status_code', None)
+                }
+                break
+            except json.JSONDecodeError:
+                logger.error(f"Paystack API returned invalid JSON: {response.text}")
+                result = {"status": False, "message": "API returned invalid response"}
+                break
+
+        paystack_metrics.record(
+            f"{method} {operation}", (time.perf_counter() - started) * 1000,
+            ok=bool(result.get('status')), retries=attempt
+        )
+        return result
 
     # --- Paystack API Methods ---
     
@@ -128,6 +244,20 @@ class PaystackService:
         else:
             return {'success': False, 'message': response.get('message', 'Initialization failed')}
 
+    def list_banks(self):
+        """Nigerian bank list (name, code, slug, active) from Paystack."""
+        
+        # Mock success for testing environment
+        if self._is_mock_mode():
+            return {'success': True, 'banks': load_snapshot()}
+        
+        response = self._make_api_call('GET', "bank?country=nigeria&perPage=500", operation='bank')
+        
+        if response.get('status'):
+            return {'success': True, 'banks': response['data']}
+        else:
+            return {'success': False, 'message': response.get('message', 'Bank list unavailable')}
+
     def verify_transaction(self, reference):
         """Verify a transaction."""
         
@@ -141,7 +271,7 @@ class PaystackService:
             }
 
         endpoint = f"transaction/verify/{reference}"
-        response = self._make_api_call('GET', endpoint)
+        response = self._make_api_call('GET', endpoint, operation='transaction/verify')
         
         if response.get('status') and response['data']['status'] == 'success':
             return {
@@ -153,15 +283,16 @@ class PaystackService:
         else:
             return {'success': False, 'message': response.get('message', 'Transaction failed or pending')}
 
-    def transfer_to_subaccount(self, amount, recipient, reason):
-        """Initiate a transfer (disbursement)."""
+    def transfer_to_subaccount(self, amount, recipient, reason, reference=None):
+        """Initiate a transfer (disbursement). The reference makes retries safe to resend."""
+        reference = reference or generate_reference('TRF')
         
         # Mock success for testing environment
         if self._is_mock_mode():
             return {
                 'success': True,
                 'transfer_code': 'TRF_mock_123',
-                'reference': generate_reference('TRF')
+                'reference': reference
             }
             
         endpoint = "transfer"
@@ -169,7 +300,8 @@ class PaystackService:
             'source': 'balance',
             'amount': int(amount * 100),
             'recipient': recipient,
-            'reason': reason
+            'reason': reason,
+            'reference': reference
         }
 
         response = self._make_api_call('POST', endpoint, payload)
@@ -183,6 +315,76 @@ class PaystackService:
         else:
             return {'success': False, 'message': response.get('message', 'Transfer failed')}
     
+    def verify_transfer(self, reference):
+        """
+        Look up a transfer by our reference. Returns {'success', 'status', 'transfer'};
+        on failure 'not_found' tells a transfer Paystack never received from an unreachable API.
+        """
+        
+        # Mock success for testing environment
+        if self._is_mock_mode():
+            return {
+                'success': True,
+                'status': 'success',
+                'transfer': {'reference': reference, 'transfer_code': f"TRF_mock_{reference}", 'status': 'success'}
+            }
+        
+        response = self._make_api_call('GET', f"transfer/verify/{reference}", operation='transfer/verify')
+        
+        if response.get('status'):
+            return {'success': True, 'status': response['data']['status'], 'transfer': response['data']}
+        else:
+            return {
+                'success': False,
+                'not_found': response.get('http_status') == 404,
+                'message': response.get('message', 'Transfer lookup failed')
+            }
+    
+    def bulk_transfer(self, transfers):
+        """
+        Submit several transfers in one call. Each item needs amount (Naira), recipient,
+        reason and reference. Returns {'success', 'transfers': {reference: gateway item}}.
+        """
+        
+        # Mock success for testing environment
+        if self._is_mock_mode():
+            return {
+                'success': True,
+                'transfers': {
+                    transfer['reference']: {
+                        'reference': transfer['reference'],
+                        'transfer_code': f"TRF_mock_{transfer['reference']}",
+                        'status': 'success'
+                    }
+                    for transfer in transfers
+                }
+            }
+        
+        endpoint = "transfer/bulk"
+        payload = {
+            'currency': 'NGN',
+            'source': 'balance',
+            'transfers': [
+                {
+                    'amount': int(transfer['amount'] * 100),
+                    'recipient': transfer['recipient'],
+                    'reason': transfer['reason'],
+                    'reference': transfer['reference']
+                }
+                for transfer in transfers
+            ]
+        }
+        
+        response = self._make_api_call('POST', endpoint, payload)
+        
+        if response.get('status'):
+            return {
+                'success': True,
+                'transfers': {item['reference']: item for item in response.get('data') or []}
+            }
+        else:
+            return {'success': False, 'message': response.get('message', 'Bulk transfer failed')}
+    
     def create_transfer_recipient(self, name, account_number, bank_code):
         """Create a transfer recipient for disbursement."""
 
@@ -284,23 +486,21 @@ class EscrowService:
                 with db_transaction.atomic():
                     transaction = Transaction.objects.select_for_update().get(transaction_id=reference)
                     
-                    # Check if already completed to avoid duplicate processing
-                    if transaction.status == 'completed':
+                    # Only the settler that completes the transaction credits the escrow (see complete_once)
+                    if not transaction.complete_once(verification['gateway_response']):
                         return {'success': True, 'transaction': transaction}
                     
                     loan_application = transaction.loan_application
                     escrow_account = loan_application.escrow_account
                     
-                    # Update transaction
-                    transaction.status = 'completed'
-                    transaction.completed_at = timezone.now()
-                    transaction.gateway_response = verification['gateway_response']
-                    transaction.save()
-                    
-                    # Update escrow account
-                    escrow_account.amount_held = verification['amount']
+                    # Credit the escrow ledger; amount_held is refreshed from it on commit
+                    ledger.record_funding(escrow_account, verification['amount'], transaction)
                     escrow_account.status = 'active'
-                    escrow_account.save()
+                    escrow_account.save(update_fields=['status', 'updated_at'])
+                    enqueue(notifications.escrow_funded(loan_application, verification['amount']))
+                    publish_to_parties(loan_application, 'escrow.funded', {
+                        'escrowStatus': escrow_account.status, 'amount': verification['amount']
+                    })
                     
                 return {'success': True, 'transaction': transaction}
                 
@@ -310,127 +510,18 @@ class EscrowService:
             return {'success': False, 'message': verification['message']}
     
     def initiate_disbursement(self, loan_application):
-        """Initiate disbursement to SME using Paystack transfer"""
-        with db_transaction.atomic():
-            escrow_account = loan_application.escrow_account
-            
-            # Check for sufficient funds
-            if escrow_account.amount_held < loan_application.loan_amount:
-                # In a real system, you might only disburse the amount held.
-                # Here, we prevent disbursement if the full amount isn't ready.
-                return {'success': False, 'message': 'Insufficient funds in escrow account to cover the loan amount.'}
-            
-            # Get SME bank details
-            sme_business = loan_application.sme_business
-            
-            # Create transfer recipient
-            recipient_result = self.paystack.create_transfer_recipient(
-                name=sme_business.bank_account_name,
-                account_number=sme_business.bank_account_number,
-                bank_code=self._get_bank_code(sme_business.bank_name)
-            )
-            
-            if not recipient_result['success']:
-                return {'success': False, 'message': recipient_result['message']}
-            
-            disbursement_amount = loan_application.loan_amount # Disburse the original loan amount
-
-            # Create disbursement record
-            disbursement = Disbursement.objects.create(
-                loan_application=loan_application,
-                escrow_account=escrow_account,
-                amount=disbursement_amount,
-                beneficiary_account_number=sme_business.bank_account_number,
-                beneficiary_account_name=sme_business.bank_account_name,
-                beneficiary_bank=sme_business.bank_name,
-                status='processing'
-            )
-            
-            # Initiate transfer
-            transfer_result = self.paystack.transfer_to_subaccount(
-                amount=disbursement_amount,
-                recipient=recipient_result['recipient_code'],
-                reason=f"Loan disbursement to {sme_business.business_name} for loan #{loan_application.id}"
-            )
-            
-            if transfer_result['success']:
-                # Create disbursement transaction
-                Transaction.objects.create(
-                    loan_application=loan_application,
-                    escrow_account=escrow_account,
-                    transaction_id=transfer_result['reference'],
-                    transaction_type='disburse',
-                    amount=disbursement_amount,
-                    status='completed',
-                    description=f"Disbursement to {sme_business.business_name}",
-                    payment_reference=transfer_result['reference'],
-                    completed_at=timezone.now()
-                )
-                
-                # Update disbursement
-                disbursement.status = 'completed'
-                disbursement.completed_at = timezone.now()
-                disbursement.save()
-                
-                # Update escrow account (subtract disbursed amount)
-                escrow_account.amount_held -= disbursement_amount
-                escrow_account.status = 'released' if escrow_account.amount_held <= 0 else 'active'
-                escrow_account.released_at = timezone.now() if escrow_account.amount_held <= 0 else None
-                escrow_account.save()
-                
-                # Update loan application
-                loan_application.status = 'active'
-                loan_application.disbursement_date = timezone.now()
-                loan_application.save()
-                
-                # Generate repayment schedule
-                self.generate_repayment_schedule(loan_application)
-                
-                return {'success': True, 'disbursement': disbursement}
-            else:
-                disbursement.status = 'failed'
-                disbursement.save()
-                return {'success': False, 'message': transfer_result['message']}
+        """
+        Disburse one loan to the SME. Goes through DisbursementScheduler, which locks
+        the loan and claims its Disbursement row before calling Paystack, so this
+        cannot pay out a loan a scheduler run is already disbursing.
+        """
+        from .disbursements import DisbursementScheduler
+        return DisbursementScheduler(paystack=self.paystack).disburse(loan_application)
     
     def _get_bank_code(self, bank_name):
-        """Map bank name to Paystack bank code (requires Paystack Banks API lookup for robust solution)"""
-        # Common Nigerian banks - placeholder/mock list
-        bank_codes = {
-            'access bank': '044', 'citibank': '023', 'ecobank': '050', 'fidelity bank': '070', 
-            'first bank': '011', 'guaranty trust bank': '058', 'united bank for africa': '033', 
-            'zenith bank': '057', 'test bank': '057' # Added 'Test Bank' for testing
-        }
-        
-        return bank_codes.get(bank_name.lower(), '057') 
+        """Map a bank name to its Paystack bank code via the bank directory (None if unknown)"""
+        return bank_directory.resolve(bank_name)
     
     def generate_repayment_schedule(self, loan_application):
-        """Generate repayment schedule for the loan"""
-        # Delete existing schedule to prevent duplicates during retry/re-run
-        RepaymentSchedule.objects.filter(loan_application=loan_application).delete()
-
-        loan_amount = loan_application.loan_amount
-        interest_rate = loan_application.interest_rate / 100
-        tenure_months = loan_application.tenure_months
-        
-        # Simple interest calculation
-        total_interest = loan_amount * interest_rate * (tenure_months / 12)
-        total_repayment = loan_amount + total_interest
-        
-        if loan_application.repayment_frequency == 'monthly':
-            # Use Decimal division and rounding for financial accuracy
-            monthly_payment = (total_repayment / Decimal(tenure_months)).quantize(Decimal('0.01'))
-            principal_per_month = (loan_amount / Decimal(tenure_months)).quantize(Decimal('0.01'))
-            interest_per_month = (total_interest / Decimal(tenure_months)).quantize(Decimal('0.01'))
-
-            for i in range(tenure_months):
-                # Calculate due date: assumes 30 days per month approximation
-                due_date = loan_application.disbursement_date.date() + timezone.timedelta(days=30 * (i + 1))
-                
-                RepaymentSchedule.objects.create(
-                    loan_application=loan_application,
-                    installment_number=i + 1,
-                    due_date=due_date,
-                    principal_amount=principal_per_month,
-                    interest_amount=interest_per_month,
-                    total_amount=monthly_payment
-                )
\ No newline at end of file
+        """Generate (or replace) the repayment schedule for the loan"""
+        regenerate_schedules([loan_application])
@@ -0,0 +1,31 @@
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+from core.caching import invalidate_on_change
+from sme.models import BusinessProfile
+from .models import (
+    TransferRecipient, LoanApplication, LoanNegotiation, RepaymentSchedule, EscrowAccount, Transaction, Disbursement
+)
+
+BANK_FIELDS = ('bank_account_number', 'bank_account_name', 'bank_name')
+
+
+@receiver(pre_save, sender=BusinessProfile)
+def invalidate_transfer_recipients(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Drop cached Paystack recipients when an SME changes its payout bank details."""
+    if raw or not instance.pk:
+        return
+    if update_fields is not None and not set(update_fields) & set(BANK_FIELDS):
+        return
+
+    previous = BusinessProfile.objects.filter(pk=instance.pk).values(*BANK_FIELDS).first()
+    if previous and any(previous[field] != getattr(instance, field) for field in BANK_FIELDS):
+        TransferRecipient.objects.filter(business_id=instance.pk).delete()
+
+
+# Cached SME and lender data (core.caching) built from loans and their offers
+invalidate_on_change(LoanApplication, lambda loan: loan.cache_tags())
+invalidate_on_change(LoanNegotiation, lambda offer: offer.loan_application.cache_tags())
+# Schedules are only deleted by amortization._write_chunk, which invalidates its loans itself
+invalidate_on_change(RepaymentSchedule, lambda installment: installment.loan_application.cache_tags(), deletes=False)
+for model in (EscrowAccount, Transaction, Disbursement):
+    invalidate_on_change(model, lambda instance: [f"loan:{instance.loan_application_id}"])
@@ -2,17 +2,52 @@ from django.test import TestCase, TransactionTestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.utils import timezone
-from rest_framework.test import APITestCase, APIClient
+from rest_framework.test import APITestCase, APIClient, APIRequestFactory
 from rest_framework import status
 from decimal import Decimal
 from unittest.mock import patch, MagicMock
 import uuid
 import json
 
-from .models import LoanApplication, EscrowAccount, Transaction, RepaymentSchedule, Disbursement
-from .services import EscrowService, PaystackService
+from .models import LoanApplication, EscrowAccount, Transaction, RepaymentSchedule, Disbursement, WebhookEvent
+from .webhooks import WebhookInboxProcessor
+from .disbursements import DisbursementScheduler
+from .recipients import RecipientResolver
+from .models import TransferRecipient, Bank
+from .banks import bank_directory, sync_banks
+from .amortization import build_schedule, regenerate_schedules, add_months
+from .overdue import OverdueSweeper
+from .models import OverdueSweepRun, LedgerEntry, LedgerSnapshot
+from . import ledger
+from .reconciliation import SettlementReconciler, iter_report_rows
+from .idempotency import purge_expired_keys, request_fingerprint, _claim
+from .models import IdempotencyKey, LoanNegotiation
+from . import negotiations
+from .negotiations import StaleVersionError
+from django.db import IntegrityError, OperationalError
+from . import events
+from .models import LiveEvent
+from core.models import OutboxMessage
+from rest_framework_simplejwt.tokens import AccessToken
+import asyncio
+from django.core.management import call_command
+import io
+import os
+import tempfile
+from datetime import timedelta
+from datetime import date, datetime
+from django.db import connection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import hashlib
+import hmac
+from .services import EscrowService, PaystackService, get_paystack_session, paystack_metrics
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+import requests
 from sme.models import BusinessProfile
 from lender.models import LenderProfile
+from core.testing import QueryBudgetMixin
 
 User = get_user_model()
 
@@ -683,6 +718,1220 @@ class EscrowIntegrationTestCase(TransactionTestCase):
         self.assertTrue(hasattr(loan_app, 'escrow_account'))
 
 # Test runner
+class LenderEscrowDashboardQueryTestCase(APITestCase):
+    """The lender escrow dashboard must not scale queries with portfolio size"""
+    
+    def setUp(self):
+        self.lender_user = User.objects.create_user(
+            username='dash-lender@test.com', email='dash-lender@test.com',
+            password='testpass123', user_type='lender'
+        )
+        self.lender_profile = create_test_lender_profile(self.lender_user)
+        self.client.force_authenticate(user=self.lender_user)
+        self.url = reverse('lender-escrow-dashboard')
+    
+    def _create_loan(self, status_value, amount):
+        sme_user = User.objects.create_user(
+            username=f'{uuid.uuid4().hex[:8]}@test.com', email=f'{uuid.uuid4().hex[:8]}@test.com',
+            password='testpass123', user_type='sme'
+        )
+        loan = LoanApplication.objects.create(
+            sme_business=create_test_business_profile(sme_user), lender=self.lender_profile,
+            loan_amount=Decimal(amount), interest_rate=Decimal('15.00'), tenure_months=12,
+            purpose='Working capital', status=status_value
+        )
+        escrow = EscrowAccount.objects.create(loan_application=loan, amount_held=Decimal(amount), status='funded')
+        Transaction.objects.create(
+            loan_application=loan, escrow_account=escrow, transaction_type='funding',
+            amount=Decimal(amount), status='completed'
+        )
+        return loan
+    
+    def test_dashboard_uses_two_queries(self):
+        self._create_loan('active', '100000.00')
+        self._create_loan('completed', '50000.00')
+        self._create_loan('submitted', '75000.00')
+        
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_loans'], 3)
+        self.assertEqual(response.data['active_loans'], 1)
+        self.assertEqual(response.data['pending_loans'], 1)
+        self.assertEqual(response.data['total_amount_lent'], 150000.0)
+        self.assertEqual(len(response.data['recent_transactions']), 3)
+        self.assertIn('escrow_account', response.data['recent_transactions'][0]['loan_application'])
+    
+    def test_dashboard_rejects_non_lenders(self):
+        sme_user = User.objects.create_user(
+            username='dash-sme@test.com', email='dash-sme@test.com',
+            password='testpass123', user_type='sme'
+        )
+        self.client.force_authenticate(user=sme_user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(PAYSTACK_SECRET_KEY='sk_test_live_calls', PAYSTACK_RETRY_BACKOFF=0, PAYSTACK_MAX_RETRIES=2)
+class PaystackRetryTestCase(TestCase):
+    """Retry policy and metrics of PaystackService._make_api_call"""
+    
+    def setUp(self):
+        paystack_metrics.reset()
+        self.service = PaystackService()
+    
+    def _response(self, status_code, payload):
+        response = MagicMock(status_code=status_code)
+        response.json.return_value = payload
+        if status_code >= 400:
+            response.raise_for_status.side_effect = requests.exceptions.HTTPError(f"{status_code} error")
+        return response
+    
+    def test_session_is_shared(self):
+        self.assertIs(PaystackService().session, get_paystack_session())
+        self.assertIs(self.service.session, PaystackService().session)
+    
+    def test_get_is_retried_on_connection_error(self):
+        ok = self._response(200, {'status': True, 'data': {'status': 'success', 'amount': 500000, 'currency': 'NGN'}})
+        with patch.object(self.service.session, 'request', side_effect=[requests.exceptions.ConnectionError('reset'), ok]) as mock_request:
+            result = self.service.verify_transaction('REF_123')
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(mock_request.call_count, 2)
+        stats = paystack_metrics.snapshot()['GET transaction/verify']
+        self.assertEqual(stats['calls'], 1)
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(stats['errors'], 0)
+    
+    def test_retries_are_bounded(self):
+        with patch.object(self.service.session, 'request', return_value=self._response(503, {})) as mock_request:
+            result = self.service.verify_transaction('REF_123')
+        
+        self.assertFalse(result['success'])
+        self.assertEqual(mock_request.call_count, 3)
+        self.assertEqual(paystack_metrics.snapshot()['GET transaction/verify']['errors'], 1)
+    
+    def test_post_without_reference_is_not_retried(self):
+        with patch.object(self.service.session, 'request', side_effect=requests.exceptions.Timeout('slow')) as mock_request:
+            result = self.service.create_transfer_recipient('Test Business', '1234567890', '044')
+        
+        self.assertFalse(result['success'])
+        self.assertEqual(mock_request.call_count, 1)
+    
+    def test_transfer_with_reference_is_retried(self):
+        ok = self._response(200, {'status': True, 'data': {'transfer_code': 'TRF_1', 'reference': 'DISB_1'}})
+        with patch.object(self.service.session, 'request', side_effect=[requests.exceptions.Timeout('slow'), ok]) as mock_request:
+            result = self.service.transfer_to_subaccount(Decimal('1000.00'), 'RCP_1', 'Test', reference='DISB_1')
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(mock_request.call_args.kwargs['json']['reference'], 'DISB_1')
+
+
+@override_settings(PAYSTACK_SECRET_KEY='sk_test_webhook_secret')
+class PaystackWebhookInboxTestCase(APITestCase):
+    """Webhook ingestion only records events; the inbox processor settles them"""
+    
+    def setUp(self):
+        sme_user = User.objects.create_user(
+            username='hook-sme@test.com', email='hook-sme@test.com', password='testpass123', user_type='sme'
+        )
+        self.loan = LoanApplication.objects.create(
+            sme_business=create_test_business_profile(sme_user), loan_amount=Decimal('200000.00'),
+            interest_rate=Decimal('15.00'), tenure_months=12, purpose='Inventory', status='approved'
+        )
+        self.escrow = EscrowAccount.objects.create(loan_application=self.loan)
+        self.txn = Transaction.objects.create(
+            loan_application=self.loan, escrow_account=self.escrow, transaction_id='ESCROW_HOOK1',
+            transaction_type='fund_escrow', amount=Decimal('200000.00'), status='pending',
+            payment_reference='ESCROW_HOOK1'
+        )
+        self.url = reverse('paystack-webhook')
+    
+    def _post(self, payload, secret='sk_test_webhook_secret'):
+        body = json.dumps(payload).encode()
+        signature = hmac.new(secret.encode(), body, hashlib.sha512).hexdigest()
+        return self.client.post(self.url, body, content_type='application/json', HTTP_X_PAYSTACK_SIGNATURE=signature)
+    
+    def _charge(self, reference, event_id=1001):
+        return {'event': 'charge.success', 'data': {'id': event_id, 'reference': reference, 'amount': 20000000, 'status': 'success'}}
+    
+    def test_invalid_signature_is_rejected(self):
+        response = self._post(self._charge('ESCROW_HOOK1'), secret='wrong')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(WebhookEvent.objects.exists())
+    
+    def test_redelivery_is_deduplicated_and_not_settled_inline(self):
+        for _ in range(2):
+            response = self._post(self._charge('ESCROW_HOOK1'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.txn.refresh_from_db()
+        self.assertEqual(self.txn.status, 'pending')
+    
+    def test_processor_settles_transaction_and_escrow(self):
+        self._post(self._charge('ESCROW_HOOK1'))
+        self._post(self._charge('ESCROW_UNKNOWN', event_id=1002))
+        self._post({'event': 'transfer.success', 'data': {'id': 7, 'reference': 'TRF_1'}})
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            totals = WebhookInboxProcessor(batch_size=2).drain()
+        
+        self.assertEqual(totals, {'processed': 1, 'ignored': 2})
+        self.txn.refresh_from_db()
+        self.escrow.refresh_from_db()
+        self.assertEqual(self.txn.status, 'completed')
+        self.assertIsNotNone(self.txn.completed_at)
+        self.assertEqual(self.escrow.amount_held, Decimal('200000.00'))
+        self.assertEqual(self.escrow.status, 'active')
+        self.assertFalse(WebhookEvent.objects.filter(status='pending').exists())
+    
+    def test_webhook_racing_the_verify_callback_credits_once(self):
+        self._post(self._charge('ESCROW_HOOK1'))
+        processor = WebhookInboxProcessor()
+        load_transactions = processor._load_transactions
+        verified = {'success': True, 'amount': Decimal('200000.00'), 'currency': 'NGN', 'gateway_response': {'status': 'success'}}
+        
+        def load_then_callback_settles(references):
+            # The processor has read the transaction as pending when the callback completes it
+            found = load_transactions(references)
+            self.assertTrue(EscrowService().verify_escrow_funding('ESCROW_HOOK1')['success'])
+            return found
+        
+        with patch.object(PaystackService, 'verify_transaction', return_value=verified):
+            with patch.object(processor, '_load_transactions', side_effect=load_then_callback_settles):
+                with self.captureOnCommitCallbacks(execute=True):
+                    totals = processor.drain()
+        
+        self.assertEqual(totals, {'processed': 1})
+        self.assertEqual(WebhookEvent.objects.get().last_error, 'Already settled')
+        self.assertEqual(LedgerEntry.objects.filter(ledger_account='escrow', entry_type='funding').count(), 1)
+        self.assertEqual(ledger.balance(self.escrow), Decimal('200000.00'))
+        
+        # And the other way round: the callback finds the webhook's settlement and credits nothing
+        with patch.object(PaystackService, 'verify_transaction', return_value=verified):
+            self.assertTrue(EscrowService().verify_escrow_funding('ESCROW_HOOK1')['success'])
+        self.assertEqual(LedgerEntry.objects.filter(ledger_account='escrow', entry_type='funding').count(), 1)
+
+
+class PaystackStandIn:
+    """
+    Minimal local Paystack API on a random port; records every request it receives.
+    Transfers are paid once per reference (``paid``). With ``drop_bulk_responses``
+    bulk transfers are accepted but the connection closes before the reply; the
+    first ``failed_transfers`` new references are recorded as failed.
+    """
+    
+    def __init__(self, failing_accounts=(), drop_bulk_responses=False, failed_transfers=0):
+        self.requests = []
+        self.paid = {}
+        self.drop_bulk_responses = drop_bulk_responses
+        self.failed_transfers = failed_transfers
+        stand_in = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.requests.append((self.path, None))
+                reference = self.path.rpartition('/transfer/verify/')[2]
+                if reference in stand_in.paid:
+                    return self._reply(200, {'status': True, 'data': stand_in.paid[reference]})
+                self._reply(404, {'status': False, 'message': 'Transfer not found'})
+            
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stand_in.requests.append((self.path, body))
+                if self.path == '/transferrecipient':
+                    if body['account_number'] in failing_accounts:
+                        return self._reply(400, {'status': False, 'message': 'Account not found'})
+                    return self._reply(201, {'status': True, 'data': {'recipient_code': f"RCP_{body['account_number']}"}})
+                if self.path == '/transfer/bulk':
+                    for item in body['transfers']:
+                        if item['reference'] in stand_in.paid:
+                            continue  # a reused reference gets the original transfer back
+                        failed = len(stand_in.paid) < stand_in.failed_transfers
+                        stand_in.paid[item['reference']] = {
+                            'reference': item['reference'], 'recipient': item['recipient'], 'amount': item['amount'],
+                            'transfer_code': f"TRF_{item['reference']}", 'status': 'failed' if failed else 'success'
+                        }
+                    if stand_in.drop_bulk_responses:
+                        self.close_connection = True
+                        return
+                    return self._reply(200, {'status': True, 'data': [
+                        stand_in.paid[item['reference']] for item in body['transfers']
+                    ]})
+                self._reply(404, {'status': False, 'message': 'Unknown endpoint'})
+            
+            def _reply(self, code, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+    
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def paths(self):
+        return [path for path, _ in self.requests]
+
+
+class DisbursementSchedulerTestCase(TransactionTestCase):
+    """Bulk disbursement against a local Paystack stand-in"""
+    
+    def setUp(self):
+        lender_user = User.objects.create_user(
+            username='bulk-lender@test.com', email='bulk-lender@test.com', password='testpass123', user_type='lender'
+        )
+        self.lender = create_test_lender_profile(lender_user)
+    
+    def _funded_loan(self, account_number, funded=True):
+        sme_user = User.objects.create_user(
+            username=f'{account_number}@test.com', email=f'{account_number}@test.com', password='testpass123', user_type='sme'
+        )
+        loan = LoanApplication.objects.create(
+            sme_business=create_test_business_profile(sme_user, bank_account_number=account_number, bank_name='GTBank'),
+            lender=self.lender, loan_amount=Decimal('100000.00'), interest_rate=Decimal('12.00'),
+            tenure_months=6, purpose='Expansion', status='approved'
+        )
+        escrow = EscrowAccount.objects.create(loan_application=loan, status='active')
+        if funded:
+            ledger.record_funding(escrow, Decimal('100000.00'))
+        return loan
+    
+    def test_ready_loans_are_disbursed_in_bulk(self):
+        loans = [self._funded_loan(f'00000000{i:02d}') for i in range(3)]
+        unfunded = self._funded_loan('0000000099', funded=False)
+        failing = self._funded_loan('0000000098')
+        open_transaction_during_calls = []
+        
+        with PaystackStandIn(failing_accounts={'0000000098'}) as stand_in:
+            with override_settings(PAYSTACK_SECRET_KEY='sk_test_standin', PAYSTACK_BASE_URL=stand_in.base_url):
+                scheduler = DisbursementScheduler(batch_size=2)
+                original_call = scheduler.paystack._make_api_call
+                
+                def tracking_call(*args, **kwargs):
+                    open_transaction_during_calls.append(connection.in_atomic_block)
+                    return original_call(*args, **kwargs)
+                
+                with patch.object(scheduler.paystack, '_make_api_call', side_effect=tracking_call):
+                    totals = scheduler.run()
+        
+        self.assertEqual(totals, {'completed': 3, 'failed': 1, 'unresolved': 0})
+        self.assertEqual(stand_in.paths().count('/transfer/bulk'), 2)
+        self.assertNotIn(True, open_transaction_during_calls)
+        
+        for loan in loans:
+            loan.refresh_from_db()
+            self.assertEqual(loan.status, 'active')
+            self.assertIsNotNone(loan.disbursement_date)
+            self.assertEqual(loan.escrow_account.amount_held, Decimal('0.00'))
+            self.assertEqual(loan.escrow_account.status, 'released')
+            self.assertEqual(loan.disbursement.status, 'completed')
+            self.assertTrue(loan.disbursement.transfer_code.startswith('TRF_DISB_'))
+            self.assertTrue(Transaction.objects.filter(loan_application=loan, transaction_type='disburse', status='completed').exists())
+            self.assertTrue(RepaymentSchedule.objects.filter(loan_application=loan).exists())
+        
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, 'approved')
+        self.assertEqual(failing.disbursement.status, 'failed')
+        self.assertFalse(Disbursement.objects.filter(loan_application=unfunded).exists())
+    
+    def test_lost_bulk_response_is_verified_not_resent(self):
+        loan = self._funded_loan('0000000001')
+        
+        with PaystackStandIn(drop_bulk_responses=True) as stand_in:
+            with override_settings(PAYSTACK_SECRET_KEY='sk_test_standin', PAYSTACK_BASE_URL=stand_in.base_url,
+                                   PAYSTACK_RETRY_BACKOFF=0):
+                # Paystack accepts the batch but the reply never arrives
+                totals = DisbursementScheduler().run()
+                self.assertEqual(totals, {'completed': 0, 'failed': 0, 'unresolved': 1})
+                disbursement = Disbursement.objects.get(loan_application=loan)
+                self.assertEqual(disbursement.status, 'processing')
+                
+                # Not stale yet: left alone
+                self.assertEqual(DisbursementScheduler().run(), {'completed': 0, 'failed': 0, 'unresolved': 0})
+                
+                bulk_calls = stand_in.paths().count('/transfer/bulk')
+                totals = DisbursementScheduler(stale_after=timedelta(0)).run()
+        
+        self.assertEqual(totals, {'completed': 1, 'failed': 0, 'unresolved': 0})
+        self.assertEqual(stand_in.paths().count('/transfer/bulk'), bulk_calls)
+        self.assertIn(f'/transfer/verify/{disbursement.transfer_reference}', stand_in.paths())
+        self.assertEqual(list(stand_in.paid), [disbursement.transfer_reference])
+        
+        loan.refresh_from_db()
+        self.assertEqual(loan.status, 'active')
+        self.assertEqual(loan.disbursement.status, 'completed')
+        self.assertEqual(loan.escrow_account.amount_held, Decimal('0.00'))
+        self.assertEqual(Transaction.objects.filter(loan_application=loan, transaction_type='disburse').count(), 1)
+    
+    def test_transfers_paystack_never_received_are_resent_under_the_same_reference(self):
+        loan = self._funded_loan('0000000001')
+        with PaystackStandIn() as stand_in:
+            with override_settings(PAYSTACK_SECRET_KEY='sk_test_standin', PAYSTACK_BASE_URL=stand_in.base_url):
+                scheduler = DisbursementScheduler(stale_after=timedelta(0))
+                with patch.object(scheduler.paystack, 'bulk_transfer', return_value={'success': False, 'message': 'timeout'}):
+                    self.assertEqual(scheduler.run()['unresolved'], 1)
+                reference = Disbursement.objects.get(loan_application=loan).transfer_reference
+                
+                totals = scheduler.run()
+        
+        # Recovery finds no such transfer, so the claim resends it with its original reference
+        self.assertEqual(totals, {'completed': 1, 'failed': 1, 'unresolved': 0})
+        self.assertEqual(list(stand_in.paid), [reference])
+        loan.refresh_from_db()
+        self.assertEqual(loan.disbursement.status, 'completed')
+        self.assertEqual(loan.disbursement.transfer_reference, reference)
+    
+    def test_single_loan_disbursement_is_claimed_like_a_scheduler_run(self):
+        loan = self._funded_loan('0000000001')
+        with PaystackStandIn() as stand_in:
+            with override_settings(PAYSTACK_SECRET_KEY='sk_test_standin', PAYSTACK_BASE_URL=stand_in.base_url):
+                # A scheduler run has claimed the loan but not settled it yet
+                self.assertEqual(len(DisbursementScheduler()._claim(1)), 1)
+                result = EscrowService().initiate_disbursement(loan)
+                self.assertFalse(result['success'])
+                self.assertEqual(stand_in.requests, [])
+                
+                Disbursement.objects.filter(loan_application=loan).update(status='failed')
+                result = EscrowService().initiate_disbursement(loan)
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['disbursement'].status, 'completed')
+        self.assertEqual(stand_in.paths().count('/transfer/bulk'), 1)
+        loan.refresh_from_db()
+        self.assertEqual(loan.status, 'active')
+        self.assertEqual(loan.escrow_account.status, 'released')
+    
+    def test_failed_transfer_is_retried_under_a_new_reference(self):
+        loan = self._funded_loan('0000000001')
+        with PaystackStandIn(failed_transfers=1) as stand_in:
+            with override_settings(PAYSTACK_SECRET_KEY='sk_test_standin', PAYSTACK_BASE_URL=stand_in.base_url):
+                self.assertEqual(DisbursementScheduler().run(), {'completed': 0, 'failed': 1, 'unresolved': 0})
+                failed_reference = list(stand_in.paid)[0]
+                self.assertEqual(Disbursement.objects.get(loan_application=loan).transfer_reference, '')
+                
+                totals = DisbursementScheduler().run()
+        
+        self.assertEqual(totals, {'completed': 1, 'failed': 0, 'unresolved': 0})
+        self.assertEqual(len(stand_in.paid), 2)
+        loan.refresh_from_db()
+        self.assertEqual(loan.status, 'active')
+        self.assertEqual(loan.disbursement.status, 'completed')
+        self.assertNotEqual(loan.disbursement.transfer_reference, failed_reference)
+        self.assertEqual(stand_in.paid[loan.disbursement.transfer_reference]['status'], 'success')
+
+
+class TransferRecipientCacheTestCase(TestCase):
+    """Recipient codes are reused until the SME's bank details change"""
+    
+    def setUp(self):
+        sme_user = User.objects.create_user(
+            username='rcp-sme@test.com', email='rcp-sme@test.com', password='testpass123', user_type='sme'
+        )
+        self.business = create_test_business_profile(sme_user, bank_account_name='Ada Stores Ltd')
+        self.paystack = MagicMock()
+        self.paystack.create_transfer_recipient.return_value = {'success': True, 'recipient_code': 'RCP_ada'}
+        self.resolver = RecipientResolver(self.paystack)
+    
+    def _resolve(self):
+        return self.resolver.resolve(self.business, self.business.bank_account_name, self.business.bank_account_number, '058')
+    
+    def test_repeat_resolution_skips_paystack(self):
+        self.assertEqual(self._resolve()['recipient_code'], 'RCP_ada')
+        with self.assertNumQueries(1):
+            self.assertEqual(self._resolve()['recipient_code'], 'RCP_ada')
+        self.assertEqual(self.paystack.create_transfer_recipient.call_count, 1)
+    
+    def test_account_name_is_part_of_the_key(self):
+        self._resolve()
+        self.resolver.resolve(self.business, 'Someone Else', self.business.bank_account_number, '058')
+        self.assertEqual(self.paystack.create_transfer_recipient.call_count, 2)
+    
+    def test_bank_detail_change_invalidates_cache(self):
+        self._resolve()
+        
+        self.business.pulse_score = 90
+        self.business.save()
+        self.assertEqual(TransferRecipient.objects.filter(business=self.business).count(), 1)
+        
+        self.business.bank_account_number = '0987654321'
+        self.business.save()
+        self.assertFalse(TransferRecipient.objects.filter(business=self.business).exists())
+
+
+class BankDirectoryTestCase(TestCase):
+    """Bank name resolution through the synced directory"""
+    
+    def setUp(self):
+        bank_directory.invalidate()
+        self.addCleanup(bank_directory.invalidate)
+    
+    def test_snapshot_resolves_names_aliases_and_typos(self):
+        self.assertEqual(bank_directory.resolve('Guaranty Trust Bank PLC'), '058')
+        self.assertEqual(bank_directory.resolve('GTBank'), '058')
+        self.assertEqual(bank_directory.resolve('zenith'), '057')
+        self.assertEqual(bank_directory.resolve('Unoin Bank'), '032')
+        self.assertEqual(bank_directory.resolve('Unity Bank'), '215')
+    
+    def test_unknown_bank_is_not_defaulted(self):
+        self.assertIsNone(bank_directory.resolve('Bank of Atlantis'))
+        self.assertIsNone(bank_directory.resolve(''))
+        self.assertIsNone(EscrowService()._get_bank_code('Test Bank'))
+    
+    def test_exact_lookups_do_not_query_once_loaded(self):
+        bank_directory.resolve('Access Bank')
+        with self.assertNumQueries(0):
+            self.assertEqual(bank_directory.resolve('Access Bank Plc'), '044')
+            self.assertEqual(bank_directory.resolve('Acess Bank'), '044')
+    
+    def test_sync_upserts_and_deactivates(self):
+        sync_banks([{'name': 'Zenith Bank', 'code': '057'}, {'name': 'Retired Bank', 'code': '999'}])
+        sync_banks([{'name': 'Zenith Bank PLC', 'code': '057', 'slug': 'zenith-bank'}, {'name': 'New Bank', 'code': '123'}])
+        
+        self.assertEqual(Bank.objects.get(code='057').name, 'Zenith Bank PLC')
+        self.assertEqual(Bank.objects.get(code='057').aliases, ['zenith'])
+        self.assertFalse(Bank.objects.get(code='999').active)
+        self.assertEqual(bank_directory.resolve('New Bank'), '123')
+        self.assertIsNone(bank_directory.resolve('Retired Bank'))
+
+    def test_fuzzy_memo_is_bounded(self):
+        with patch('escrow.banks.FUZZY_MEMO_SIZE', 2):
+            bank_directory.resolve('Acess Bank')
+            for name in ('Unknown One', 'Unknown Two', 'Unknown Three'):
+                bank_directory.resolve(name)
+            fuzzy = bank_directory._get_index()['fuzzy']
+            self.assertEqual(fuzzy.cache_info().currsize, 2)
+            self.assertEqual(bank_directory.resolve('Acess Bank'), '044')
+            self.assertEqual(fuzzy.cache_info().misses, 5)
+
+
+class AmortizationEngineTestCase(TestCase):
+    """Schedule maths and batch regeneration"""
+    
+    def test_calendar_months_clamp_to_month_end(self):
+        self.assertEqual(add_months(date(2026, 1, 31), 1), date(2026, 2, 28))
+        self.assertEqual(add_months(date(2026, 1, 31), 2), date(2026, 3, 31))
+        self.assertEqual(add_months(date(2026, 11, 15), 3), date(2027, 2, 15))
+    
+    def test_flat_monthly(self):
+        rows = build_schedule(Decimal('100000.00'), Decimal('12.00'), 6, 'monthly', 'flat', date(2026, 1, 31))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual([row[1] for row in rows][:2], [date(2026, 2, 28), date(2026, 3, 31)])
+        self.assertEqual(sum(row[2] for row in rows), Decimal('100000.00'))
+        self.assertEqual(sum(row[3] for row in rows), Decimal('6000.00'))
+    
+    def test_reducing_balance_has_level_payments(self):
+        rows = build_schedule(Decimal('100000.00'), Decimal('12.00'), 6, 'monthly', 'reducing', date(2026, 1, 1))
+        self.assertEqual(len({row[4] for row in rows[:-1]}), 1)
+        self.assertEqual(sum(row[2] for row in rows), Decimal('100000.00'))
+        self.assertEqual(rows[0][3], Decimal('1000.00'))
+        self.assertLess(rows[-1][3], rows[0][3])
+    
+    def test_quarterly_and_bullet(self):
+        quarterly = build_schedule(Decimal('90000.00'), Decimal('10.00'), 7, 'quarterly', 'flat', date(2026, 1, 1))
+        self.assertEqual([row[1] for row in quarterly], [date(2026, 4, 1), date(2026, 7, 1), date(2026, 8, 1)])
+        self.assertEqual(sum(row[2] for row in quarterly), Decimal('90000.00'))
+        
+        bullet = build_schedule(Decimal('50000.00'), Decimal('24.00'), 6, 'bullet', 'reducing', date(2026, 1, 1))
+        self.assertEqual(len(bullet), 1)
+        self.assertEqual(bullet[0][1:], (date(2026, 7, 1), Decimal('50000.00'), Decimal('6000.00'), Decimal('56000.00')))
+    
+    def test_batch_regeneration_uses_negotiated_rate_and_bulk_writes(self):
+        sme_user = User.objects.create_user(
+            username='amort-sme@test.com', email='amort-sme@test.com', password='testpass123', user_type='sme'
+        )
+        business = create_test_business_profile(sme_user)
+        loans = [
+            LoanApplication.objects.create(
+                sme_business=business, loan_amount=Decimal('120000.00'), interest_rate=Decimal('20.00'),
+                negotiated_rate=Decimal('12.00'), tenure_months=12, purpose='Equipment', status='active',
+                disbursement_date=timezone.make_aware(datetime(2026, 1, 15))
+            )
+            for _ in range(30)
+        ]
+        
+        with CaptureQueriesContext(connection) as queries:
+            written = regenerate_schedules(loans)
+        
+        # One DELETE plus bulk INSERTs (split only by the backend's parameter limit), never per loan
+        statements = [query['sql'].split()[0] for query in queries.captured_queries]
+        self.assertEqual(statements.count('DELETE'), 1)
+        self.assertLess(statements.count('INSERT'), len(loans) // 2)
+        
+        self.assertEqual(written, 360)
+        first = RepaymentSchedule.objects.filter(loan_application=loans[0]).first()
+        self.assertEqual(first.due_date, date(2026, 2, 15))
+        self.assertEqual(first.interest_amount, Decimal('1200.00'))
+        
+        regenerate_schedules(LoanApplication.objects.filter(id__in=[loan.id for loan in loans]), chunk_size=7)
+        self.assertEqual(RepaymentSchedule.objects.filter(loan_application__in=loans).count(), 360)
+
+
+class OverdueSweeperTestCase(TestCase):
+    """Set-based overdue flagging and aging buckets"""
+    
+    def setUp(self):
+        sme_user = User.objects.create_user(
+            username='sweep-sme@test.com', email='sweep-sme@test.com', password='testpass123', user_type='sme'
+        )
+        self.loan = LoanApplication.objects.create(
+            sme_business=create_test_business_profile(sme_user), loan_amount=Decimal('60000.00'),
+            interest_rate=Decimal('12.00'), tenure_months=6, purpose='Stock', status='active'
+        )
+        self.today = date(2026, 6, 30)
+        for number, days_late, status_value in [
+            (1, 120, 'pending'), (2, 75, 'overdue'), (3, 45, 'pending'),
+            (4, 10, 'pending'), (5, 5, 'paid'), (6, -20, 'pending'),
+        ]:
+            RepaymentSchedule.objects.create(
+                loan_application=self.loan, installment_number=number,
+                due_date=self.today - timedelta(days=days_late), principal_amount=Decimal('10000.00'),
+                interest_amount=Decimal('600.00'), total_amount=Decimal('10600.00'), status=status_value
+            )
+    
+    def test_sweep_flags_due_rows_in_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            sweep = OverdueSweeper(today=self.today).run()
+        
+        self.assertEqual([query['sql'].split()[0] for query in queries.captured_queries].count('UPDATE'), 1)
+        self.assertEqual(sweep.newly_overdue, 3)
+        self.assertEqual(
+            list(RepaymentSchedule.objects.filter(loan_application=self.loan).values_list('status', flat=True)),
+            ['overdue', 'overdue', 'overdue', 'overdue', 'paid', 'pending']
+        )
+        self.assertEqual(sweep.aging(), {
+            '1_30': {'count': 1, 'amount': Decimal('10600.00')},
+            '31_60': {'count': 1, 'amount': Decimal('10600.00')},
+            '61_90': {'count': 1, 'amount': Decimal('10600.00')},
+            '90_plus': {'count': 1, 'amount': Decimal('10600.00')},
+        })
+    
+    def test_rerun_is_idempotent(self):
+        OverdueSweeper(today=self.today).run()
+        sweep = OverdueSweeper(today=self.today).run()
+        self.assertEqual(sweep.newly_overdue, 0)
+        self.assertEqual(OverdueSweepRun.objects.count(), 2)
+
+
+class EscrowLedgerTestCase(TestCase):
+    """Append-only double-entry ledger and snapshotted balances"""
+    
+    def setUp(self):
+        sme_user = User.objects.create_user(
+            username='ledger-sme@test.com', email='ledger-sme@test.com', password='testpass123', user_type='sme'
+        )
+        loan = LoanApplication.objects.create(
+            sme_business=create_test_business_profile(sme_user), loan_amount=Decimal('80000.00'),
+            interest_rate=Decimal('12.00'), tenure_months=6, purpose='Stock', status='approved'
+        )
+        self.escrow = EscrowAccount.objects.create(loan_application=loan)
+    
+    def test_movements_are_balanced_and_projected(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.record_funding(self.escrow, Decimal('100000.00'))
+            ledger.record_disbursement(self.escrow, Decimal('80000.00'))
+        
+        self.assertEqual(ledger.balance(self.escrow), Decimal('20000.00'))
+        self.escrow.refresh_from_db()
+        self.assertEqual(self.escrow.amount_held, Decimal('20000.00'))
+        for group in LedgerEntry.objects.values_list('entry_group', flat=True).distinct():
+            self.assertEqual(sum(LedgerEntry.objects.filter(entry_group=group).values_list('amount', flat=True)), 0)
+    
+    def test_entries_are_immutable(self):
+        entry = ledger.record_funding(self.escrow, Decimal('5000.00'))[0]
+        with self.assertRaises(TypeError):
+            entry.save()
+        with self.assertRaises(TypeError):
+            entry.delete()
+        with self.assertRaises(TypeError):
+            LedgerEntry.objects.filter(escrow_account=self.escrow).update(amount=0)
+    
+    def test_snapshot_plus_tail_matches_full_sum(self):
+        for _ in range(5):
+            ledger.record_funding(self.escrow, Decimal('1000.00'))
+        
+        self.assertEqual(ledger.take_snapshots(now=timezone.now() + timedelta(minutes=5)), 1)
+        snapshot = LedgerSnapshot.objects.get(escrow_account=self.escrow)
+        self.assertEqual(snapshot.balance, Decimal('5000.00'))
+        
+        ledger.record_disbursement(self.escrow, Decimal('1500.00'))
+        with self.assertNumQueries(2):
+            self.assertEqual(ledger.balances([self.escrow.pk]), {self.escrow.pk: Decimal('3500.00')})
+        
+        self.assertEqual(ledger.take_snapshots(now=timezone.now() + timedelta(minutes=5)), 1)
+        self.assertEqual(ledger.take_snapshots(now=timezone.now() + timedelta(minutes=5)), 0)
+        self.assertEqual(ledger.balance(self.escrow), Decimal('3500.00'))
+    
+    def test_projection_refresh_is_one_update_over_snapshot_and_tail(self):
+        for _ in range(3):
+            ledger.record_funding(self.escrow, Decimal('1000.00'))
+        ledger.take_snapshots(now=timezone.now() + timedelta(minutes=5))
+        ledger.record_disbursement(self.escrow, Decimal('500.00'))
+        untouched = EscrowAccount.objects.create(loan_application=LoanApplication.objects.create(
+            sme_business=self.escrow.loan_application.sme_business, loan_amount=Decimal('1000.00'),
+            interest_rate=Decimal('12.00'), tenure_months=6, purpose='Stock'
+        ))
+        
+        with self.assertNumQueries(1):
+            ledger.refresh_projections([self.escrow.pk, untouched.pk])
+        self.escrow.refresh_from_db()
+        untouched.refresh_from_db()
+        self.assertEqual(self.escrow.amount_held, Decimal('2500.00'))
+        self.assertEqual(untouched.amount_held, Decimal('0.00'))
+
+
+class SettlementReconciliationTestCase(TestCase):
+    """Streaming reconciliation of settlement reports against transactions"""
+    
+    def setUp(self):
+        sme_user = User.objects.create_user(
+            username='recon-sme@test.com', email='recon-sme@test.com', password='testpass123', user_type='sme'
+        )
+        loan = LoanApplication.objects.create(
+            sme_business=create_test_business_profile(sme_user), loan_amount=Decimal('50000.00'),
+            interest_rate=Decimal('12.00'), tenure_months=6, purpose='Stock', status='approved'
+        )
+        escrow = EscrowAccount.objects.create(loan_application=loan)
+        for reference, amount, status_value in [
+            ('REF-OK', '50000.00', 'completed'), ('REF-AMOUNT', '20000.00', 'completed'), ('REF-STATUS', '1000.00', 'pending'),
+        ]:
+            Transaction.objects.create(
+                loan_application=loan, escrow_account=escrow, transaction_type='fund_escrow',
+                amount=Decimal(amount), status=status_value, payment_reference=reference
+            )
+    
+    def test_csv_report_discrepancies(self):
+        report = io.StringIO(
+            "Reference,Amount,Status\n"
+            "REF-OK,\"50,000.00\",success\n"
+            "REF-AMOUNT,19000.00,success\n"
+            "REF-STATUS,1000.00,success\n"
+            "REF-UNKNOWN,700.00,success\n"
+            ",10.00,success\n"
+        )
+        reconciler = SettlementReconciler(batch_size=2)
+        with CaptureQueriesContext(connection) as queries:
+            issues = list(reconciler.reconcile(iter_report_rows(report)))
+        
+        self.assertEqual(len(queries.captured_queries), 2)
+        self.assertEqual(
+            [(issue['issue'], issue.get('reference')) for issue in issues],
+            [('amount_mismatch', 'REF-AMOUNT'), ('status_mismatch', 'REF-STATUS'), ('missing', 'REF-UNKNOWN'), ('invalid', None)]
+        )
+        self.assertEqual(reconciler.counts['matched'], 1)
+        self.assertEqual(reconciler.counts['rows'], 5)
+    
+    def test_jsonl_report_in_kobo(self):
+        report = io.StringIO(
+            '{"reference": "REF-OK", "amount": 5000000, "status": "success"}\n\n'
+            '{"reference": "REF-AMOUNT", "amount": 2000000, "status": "success"}\n'
+        )
+        reconciler = SettlementReconciler(amount_unit='kobo')
+        self.assertEqual(list(reconciler.reconcile(iter_report_rows(report, 'jsonl'))), [])
+        self.assertEqual(reconciler.counts['matched'], 2)
+    
+    def test_malformed_jsonl_lines_are_reported_not_fatal(self):
+        report = io.StringIO(
+            '{"reference": "REF-OK", "amount": 5000000, "status": "success"}\n'
+            '{"reference": "REF-AMOUNT", "amount": \n'
+            '["REF-STATUS", 100000]\n'
+            '{"reference": "REF-AMOUNT", "amount": 2000000, "status": "success"}\n'
+        )
+        reconciler = SettlementReconciler(amount_unit='kobo')
+        issues = list(reconciler.reconcile(iter_report_rows(report, 'jsonl')))
+        
+        self.assertEqual([(issue['issue'], issue['line']) for issue in issues], [('invalid', 2), ('invalid', 3)])
+        self.assertEqual(reconciler.counts['matched'], 2)
+        self.assertEqual(reconciler.counts['invalid'], 2)
+    
+    def test_completed_transactions_absent_from_the_report_are_flagged(self):
+        escrow = EscrowAccount.objects.get()
+        for reference, day in [('REF-PAID', 10), ('REF-UNREPORTED', 11), ('REF-LATER', 20)]:
+            Transaction.objects.create(
+                loan_application=escrow.loan_application, escrow_account=escrow, transaction_type='repayment',
+                amount=Decimal('500.00'), status='completed', payment_reference=reference,
+                completed_at=timezone.make_aware(datetime(2026, 3, day, 12))
+            )
+        report = (
+            "reference,amount,status,paid_at\n"
+            "REF-PAID,500.00,success,2026-03-10T12:00:00Z\n"
+            "REF-OK,50000.00,success,2026-03-12T09:30:00Z\n"
+        )
+        
+        reconciler = SettlementReconciler()
+        issues = list(reconciler.reconcile(iter_report_rows(io.StringIO(report))))
+        self.assertEqual([(issue['issue'], issue['reference']) for issue in issues], [('missing_from_report', 'REF-UNREPORTED')])
+        self.assertEqual(reconciler.counts['missing_from_report'], 1)
+        
+        # An explicit period overrides the span of the rows' dates
+        reconciler = SettlementReconciler(period=(date(2026, 3, 1), date(2026, 3, 31)))
+        issues = list(reconciler.reconcile(iter_report_rows(io.StringIO(report))))
+        self.assertEqual([issue['reference'] for issue in issues], ['REF-UNREPORTED', 'REF-LATER'])
+    
+    def test_command_writes_json_lines(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as report:
+            report.write("reference,amount,status\nREF-AMOUNT,1.00,success\n")
+        out = io.StringIO()
+        try:
+            call_command('reconcile_settlements', report.name, stdout=out, stderr=io.StringIO())
+        finally:
+            os.unlink(report.name)
+        
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([line['issue'] for line in lines], ['amount_mismatch'])
+
+
+class IdempotencyKeyTestCase(APITestCase):
+    """Idempotency-Key replay on payment-mutating endpoints"""
+    
+    def setUp(self):
+        self.sme_user = User.objects.create_user(
+            username='idem-sme@test.com', email='idem-sme@test.com', password='testpass123', user_type='sme'
+        )
+        self.lender_user = User.objects.create_user(
+            username='idem-lender@test.com', email='idem-lender@test.com', password='testpass123', user_type='lender'
+        )
+        self.loan = LoanApplication.objects.create(
+            sme_business=create_test_business_profile(self.sme_user), lender=create_test_lender_profile(self.lender_user),
+            loan_amount=Decimal('100000.00'), interest_rate=Decimal('15.00'), tenure_months=12,
+            purpose='Working capital', status='approved'
+        )
+        EscrowAccount.objects.create(loan_application=self.loan)
+        self.url = reverse('loan-application-initialize-funding', kwargs={'pk': self.loan.id})
+        self.client.force_authenticate(user=self.lender_user)
+    
+    @patch.object(EscrowService, 'initialize_escrow_funding')
+    def test_retry_replays_stored_response(self, mock_initialize):
+        mock_initialize.return_value = {
+            'success': True, 'authorization_url': 'https://checkout.paystack.com/abc', 'reference': 'FUND-1'
+        }
+        first = self.client.post(self.url, {'amount': '100000.00'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        retry = self.client.post(self.url, {'amount': '100000.00'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        
+        self.assertEqual(mock_initialize.call_count, 1)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        
+        self.client.post(self.url, {'amount': '100000.00'}, format='json')
+        self.assertEqual(mock_initialize.call_count, 2)
+    
+    @patch.object(EscrowService, 'initialize_escrow_funding')
+    def test_reused_key_with_different_body_is_rejected(self, mock_initialize):
+        mock_initialize.return_value = {'success': False, 'message': 'Declined'}
+        self.client.post(self.url, {'amount': '100000.00'}, format='json', HTTP_IDEMPOTENCY_KEY='key-2')
+        response = self.client.post(self.url, {'amount': '90000.00'}, format='json', HTTP_IDEMPOTENCY_KEY='key-2')
+        
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(mock_initialize.call_count, 1)
+    
+    @patch.object(EscrowService, 'initialize_escrow_funding', side_effect=RuntimeError('gateway down'))
+    def test_failed_request_releases_key(self, mock_initialize):
+        self.client.raise_request_exception = False
+        self.client.post(self.url, {'amount': '100000.00'}, format='json', HTTP_IDEMPOTENCY_KEY='key-3')
+        self.assertFalse(IdempotencyKey.objects.filter(key='key-3').exists())
+    
+    def test_expired_key_runs_again(self):
+        installment = RepaymentSchedule.objects.create(
+            loan_application=self.loan, installment_number=1, due_date=date(2026, 1, 31),
+            principal_amount=Decimal('1000.00'), interest_amount=Decimal('100.00'), total_amount=Decimal('1100.00')
+        )
+        url = reverse('repayment-schedule-make-repayment', kwargs={'pk': installment.id})
+        data = {'amount': '1100.00', 'payment_method': 'card'}
+        self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='key-4')
+        self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='key-4')
+        self.assertEqual(Transaction.objects.filter(transaction_type='repayment').count(), 1)
+        
+        IdempotencyKey.objects.filter(key='key-4').update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='key-4')
+        self.assertEqual(Transaction.objects.filter(transaction_type='repayment').count(), 2)
+        self.assertEqual(purge_expired_keys(now=timezone.now() + timedelta(days=2)), 1)
+    
+    @patch.object(EscrowService, 'initialize_escrow_funding')
+    def test_in_progress_key_is_leased_then_taken_over(self, mock_initialize):
+        mock_initialize.return_value = {'success': True, 'authorization_url': 'https://checkout.paystack.com/abc', 'reference': 'FUND-5'}
+        # A worker died mid-request and left its claim behind
+        fingerprint = request_fingerprint(APIRequestFactory().post(self.url, {'amount': '100000.00'}, format='json'))
+        orphan, _ = _claim(self.lender_user, 'key-5', fingerprint)
+        self.assertLess(orphan.expires_at, timezone.now() + timedelta(hours=1))
+        response = self.client.post(self.url, {'amount': '100000.00'}, format='json', HTTP_IDEMPOTENCY_KEY='key-5')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        
+        IdempotencyKey.objects.filter(pk=orphan.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        response = self.client.post(self.url, {'amount': '100000.00'}, format='json', HTTP_IDEMPOTENCY_KEY='key-5')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(mock_initialize.call_count, 1)
+        record = IdempotencyKey.objects.get(key='key-5')
+        self.assertEqual(record.status, 'completed')
+        self.assertGreater(record.expires_at, timezone.now() + timedelta(hours=1))
+    
+    @patch.object(EscrowService, 'initialize_escrow_funding')
+    def test_key_released_during_claim_is_claimed_again(self, mock_initialize):
+        mock_initialize.return_value = {'success': True, 'authorization_url': 'https://checkout.paystack.com/abc', 'reference': 'FUND-6'}
+        create = IdempotencyKey.objects.create
+        attempts = []
+        
+        def racing_create(**kwargs):
+            # The first insert collides with a request that then fails and deletes its row
+            attempts.append(kwargs['key'])
+            if len(attempts) == 1:
+                raise IntegrityError('duplicate key')
+            return create(**kwargs)
+        
+        with patch.object(IdempotencyKey.objects, 'create', side_effect=racing_create):
+            response = self.client.post(self.url, {'amount': '100000.00'}, format='json', HTTP_IDEMPOTENCY_KEY='key-6')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(attempts, ['key-6', 'key-6'])
+        self.assertEqual(IdempotencyKey.objects.get(key='key-6').status, 'completed')
+
+
+class OfferAcceptanceConcurrencyTestCase(TransactionTestCase):
+    """Version-guarded offer transitions under concurrent accepts"""
+    
+    def setUp(self):
+        self.sme_user = User.objects.create_user(
+            username='race-sme@test.com', email='race-sme@test.com', password='testpass123', user_type='sme'
+        )
+        self.loan = LoanApplication.objects.create(
+            sme_business=create_test_business_profile(self.sme_user), loan_amount=Decimal('75000.00'),
+            interest_rate=Decimal('14.00'), tenure_months=6, purpose='Stock', status='under_review'
+        )
+        self.offers = []
+        for i in range(8):
+            lender_user = User.objects.create_user(
+                username=f'race-lender{i}@test.com', email=f'race-lender{i}@test.com', password='testpass123', user_type='lender'
+            )
+            create_test_lender_profile(lender_user)
+            self.offers.append(LoanNegotiation.objects.create(
+                loan_application=self.loan, user=lender_user, proposed_rate=Decimal('10.00') + i
+            ))
+    
+    def _url(self, offer, path):
+        return f'/api/escrow/loan-applications/{self.loan.id}/negotiations/{offer.id}/{path}/'
+    
+    def test_stale_accept_is_rolled_back(self):
+        first, second = [LoanNegotiation.objects.select_related('loan_application').get(pk=o.pk) for o in self.offers[:2]]
+        negotiations.accept_offer(first, first.user.lender_profile)
+        
+        with self.assertRaises(StaleVersionError):
+            negotiations.accept_offer(second, second.user.lender_profile)
+        
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.negotiated_rate, first.proposed_rate)
+        self.assertEqual(self.loan.version, 1)
+        self.assertEqual(LoanNegotiation.objects.get(pk=second.pk).status, 'rejected')
+        # Only the winning accept left an outbox notification behind
+        self.assertEqual(OutboxMessage.objects.filter(topic='offer.accepted').count(), 1)
+    
+    def test_client_version_mismatch_returns_conflict(self):
+        client = APIClient()
+        client.force_authenticate(user=self.sme_user)
+        for version in ('abc', [1]):
+            response = client.post(self._url(self.offers[0], 'sme-accept'), {'version': version}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('version', response.data)
+        
+        response = client.post(self._url(self.offers[0], 'sme-accept'), {'version': 3}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        
+        response = client.post(self._url(self.offers[0], 'sme-accept'), {'version': 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = client.post(self._url(self.offers[1], 'sme-reject'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+    
+    def test_offer_on_a_closed_or_taken_loan_is_not_accepted(self):
+        client = APIClient()
+        client.force_authenticate(user=self.sme_user)
+        LoanApplication.objects.filter(pk=self.loan.pk).update(status='rejected')
+        response = client.post(self._url(self.offers[0], 'sme-accept'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        
+        # Approved for another lender by a path that does not bump the version
+        LoanApplication.objects.filter(pk=self.loan.pk).update(status='under_review', lender=self.offers[1].user.lender_profile)
+        response = client.post(self._url(self.offers[0], 'sme-accept'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        
+        self.loan.refresh_from_db()
+        self.assertEqual((self.loan.status, self.loan.version), ('under_review', 0))
+        self.assertEqual(LoanNegotiation.objects.get(pk=self.offers[0].pk).status, 'pending')
+    
+    def test_lender_without_profile_cannot_accept_a_counter_offer(self):
+        counter = LoanNegotiation.objects.create(loan_application=self.loan, user=self.sme_user, proposed_rate=Decimal('11.00'))
+        lender_user = User.objects.create_user(
+            username='race-noprofile@test.com', email='race-noprofile@test.com', password='testpass123', user_type='lender'
+        )
+        client = APIClient()
+        client.force_authenticate(user=lender_user)
+        response = client.post(self._url(counter, 'lender-accept'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(LoanNegotiation.objects.get(pk=counter.pk).status, 'pending')
+    
+    def test_concurrent_accepts_have_one_winner(self):
+        # Every thread reads its offer and the loan before any of them writes
+        loaded = [LoanNegotiation.objects.select_related('loan_application', 'user__lender_profile').get(pk=o.pk) for o in self.offers]
+        barrier = threading.Barrier(len(loaded))
+        outcomes = []
+        
+        def accept(offer):
+            try:
+                barrier.wait()
+                negotiations.accept_offer(offer, offer.user.lender_profile)
+                outcomes.append('accepted')
+            except StaleVersionError:
+                outcomes.append('stale')
+            except OperationalError:
+                # SQLite reports a write collision as a lock error rather than waiting
+                outcomes.append('locked')
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=accept, args=(offer,)) for offer in loaded]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        statuses = list(LoanNegotiation.objects.filter(loan_application=self.loan).values_list('status', flat=True))
+        self.loan.refresh_from_db()
+        self.assertEqual(len(outcomes), len(loaded))
+        self.assertLessEqual(outcomes.count('accepted'), 1)
+        self.assertEqual(statuses.count('accepted'), outcomes.count('accepted'))
+        if outcomes.count('accepted'):
+            accepted = LoanNegotiation.objects.get(loan_application=self.loan, status='accepted')
+            self.assertEqual(self.loan.negotiated_rate, accepted.proposed_rate)
+            self.assertEqual(self.loan.lender.user_id, accepted.user_id)
+            self.assertEqual(statuses.count('rejected'), len(loaded) - 1)
+
+
+class NegotiationQueryTestCase(APITestCase):
+    """Parent loan loaded once per request; offer lists paginated by cursor"""
+    
+    def setUp(self):
+        self.sme_user = User.objects.create_user(
+            username='nego-sme@test.com', email='nego-sme@test.com', password='testpass123', user_type='sme'
+        )
+        self.loan = LoanApplication.objects.create(
+            sme_business=create_test_business_profile(self.sme_user), loan_amount=Decimal('40000.00'),
+            interest_rate=Decimal('14.00'), tenure_months=6, purpose='Stock', status='submitted'
+        )
+        self.lender_user = User.objects.create_user(
+            username='nego-lender@test.com', email='nego-lender@test.com', password='testpass123', user_type='lender'
+        )
+        create_test_lender_profile(self.lender_user)
+        self.url = f'/api/escrow/loan-applications/{self.loan.id}/negotiations/'
+    
+    def test_offer_list_is_two_queries_and_cursor_paginated(self):
+        for i in range(25):
+            LoanNegotiation.objects.create(loan_application=self.loan, user=self.lender_user, proposed_rate=Decimal(10 + i % 5))
+        self.client.force_authenticate(user=self.sme_user)
+        
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(response.data['results'][0]['user']['email'], 'nego-lender@test.com')
+        self.assertIn('cursor=', response.data['next'])
+        
+        with self.assertNumQueries(2):
+            second = self.client.get(response.data['next'])
+        self.assertEqual(len(second.data['results']), 5)
+        self.assertFalse({o['id'] for o in response.data['results']} & {o['id'] for o in second.data['results']})
+    
+    def test_create_and_accept_fetch_loan_once(self):
+        self.client.force_authenticate(user=self.lender_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'proposed_rate': '12.50', 'message': 'Offer'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        loan_selects = [q for q in queries.captured_queries
+                        if q['sql'].startswith('SELECT') and 'FROM "escrow_loan_applications"' in q['sql']]
+        self.assertEqual(len(loan_selects), 1)
+        
+        self.client.force_authenticate(user=self.sme_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f"{self.url}{response.data['id']}/sme-accept/", {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        loan_selects = [q for q in queries.captured_queries
+                        if q['sql'].startswith('SELECT') and 'FROM "escrow_loan_applications"' in q['sql']]
+        self.assertEqual(len(loan_selects), 1)
+
+
+class LiveEventsTestCase(APITestCase):
+    """Push events for negotiation and escrow updates"""
+    
+    def setUp(self):
+        self.sme_user = User.objects.create_user(
+            username='live-sme@test.com', email='live-sme@test.com', password='testpass123', user_type='sme'
+        )
+        self.lender_user = User.objects.create_user(
+            username='live-lender@test.com', email='live-lender@test.com', password='testpass123', user_type='lender'
+        )
+        create_test_lender_profile(self.lender_user)
+        self.loan = LoanApplication.objects.create(
+            sme_business=create_test_business_profile(self.sme_user), loan_amount=Decimal('30000.00'),
+            interest_rate=Decimal('14.00'), tenure_months=6, purpose='Stock', status='submitted'
+        )
+        self.url = f'/api/escrow/loan-applications/{self.loan.id}/negotiations/'
+    
+    def test_negotiation_events_reach_both_parties(self):
+        delivered = []
+        with patch.object(events.broker, 'dispatch', side_effect=lambda user_id, event: delivered.append((user_id, event['type']))):
+            self.client.force_authenticate(user=self.lender_user)
+            with self.captureOnCommitCallbacks(execute=True):
+                offer_id = self.client.post(self.url, {'proposed_rate': '12.00'}, format='json').data['id']
+            
+            self.client.force_authenticate(user=self.sme_user)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'{self.url}{offer_id}/sme-accept/', {}, format='json')
+        
+        self.assertEqual(sorted(delivered), sorted([
+            (self.sme_user.id, 'offer.created'), (self.lender_user.id, 'offer.created'),
+            (self.sme_user.id, 'offer.accepted'), (self.lender_user.id, 'offer.accepted'),
+        ]))
+    
+    def test_events_are_not_pushed_before_commit(self):
+        with patch.object(events.broker, 'dispatch') as dispatch:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                events.publish_to_parties(self.loan, 'escrow.funded', {'amount': Decimal('30000.00')})
+            dispatch.assert_not_called()
+            callbacks[0]()
+        dispatch.assert_called_once()
+        self.assertEqual(dispatch.call_args[0][1]['data'], {'amount': '30000.00'})
+    
+    @override_settings(LIVE_EVENTS_DB_FANOUT=True)
+    def test_db_fanout_relays_rows_through_the_poller(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            events.publish([self.sme_user.id, self.lender_user.id], 'offer.countered', self.loan.id)
+        self.assertEqual(LiveEvent.objects.count(), 2)
+        
+        with patch.object(events.broker, 'dispatch') as dispatch:
+            last_id = events.broker.poll_once(0)
+            self.assertEqual(events.broker.poll_once(last_id), last_id)
+        self.assertEqual(dispatch.call_count, 2)
+        self.assertEqual(last_id, LiveEvent.objects.order_by('-id').first().id)
+    
+    def test_poller_relays_rows_that_commit_out_of_id_order(self):
+        self.addCleanup(setattr, events.broker, '_gaps', {})
+        payload = {'type': 'offer.created', 'loanApplicationId': self.loan.id, 'data': {}}
+        base = events.latest_event_id()
+        LiveEvent.objects.create(id=base + 1, user_id=self.sme_user.id, event_type='offer.created', payload=payload)
+        # base + 2 was allocated by another worker whose insert has not committed yet
+        LiveEvent.objects.create(id=base + 3, user_id=self.sme_user.id, event_type='offer.created', payload=payload)
+        
+        with patch.object(events.broker, 'dispatch') as dispatch:
+            last_id = events.broker.poll_once(base)
+            self.assertEqual(last_id, base + 3)
+            LiveEvent.objects.create(id=base + 2, user_id=self.lender_user.id, event_type='offer.created', payload=payload)
+            self.assertEqual(events.broker.poll_once(last_id), last_id)
+            self.assertEqual(events.broker.poll_once(last_id), last_id)
+        self.assertEqual([call.args[1]['id'] for call in dispatch.call_args_list], [base + 1, base + 3, base + 2])
+        
+        # Ids still missing after the grace period are taken as rolled back
+        LiveEvent.objects.create(id=base + 5, user_id=self.sme_user.id, event_type='offer.created', payload=payload)
+        with override_settings(LIVE_EVENTS_COMMIT_GRACE=0), patch.object(events.broker, 'dispatch') as dispatch:
+            last_id = events.broker.poll_once(last_id)
+            LiveEvent.objects.create(id=base + 4, user_id=self.sme_user.id, event_type='offer.created', payload=payload)
+            events.broker.poll_once(last_id)
+        self.assertEqual(dispatch.call_count, 1)
+        self.assertEqual(events.broker._gaps, {})
+    
+    async def test_stream_requires_token(self):
+        response = await self.async_client.get('/api/escrow/events/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    async def test_stream_delivers_events_from_other_threads(self):
+        token = str(AccessToken.for_user(self.sme_user))
+        response = await self.async_client.get(f'/api/escrow/events/?token={token}')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        frames = response.streaming_content.__aiter__()
+        self.assertTrue((await frames.__anext__()).startswith(b'retry:'))
+        
+        next_frame = asyncio.ensure_future(frames.__anext__())
+        await asyncio.sleep(0)
+        publisher = threading.Thread(target=events.broker.dispatch, args=(
+            self.sme_user.id, {'type': 'escrow.funded', 'loanApplicationId': self.loan.id, 'data': {}}
+        ))
+        publisher.start()
+        frame = (await asyncio.wait_for(next_frame, timeout=5)).decode()
+        publisher.join()
+        
+        self.assertTrue(frame.startswith('event: escrow.funded\n'))
+        self.assertEqual(json.loads(frame.split('data: ', 1)[1])['loanApplicationId'], self.loan.id)
+        await frames.aclose()
+
+
+class LoanEndpointQueryBudgetTestCase(QueryBudgetMixin, APITestCase):
+    """Loan endpoints stay within their declared query budgets however many loans there are"""
+    
+    def setUp(self):
+        self.sme_user = User.objects.create_user(
+            username='budget-sme@test.com', email='budget-sme@test.com', password='testpass123', user_type='sme'
+        )
+        self.business = create_test_business_profile(self.sme_user)
+        self.lender_user = User.objects.create_user(
+            username='budget-lender@test.com', email='budget-lender@test.com', password='testpass123', user_type='lender'
+        )
+        self.lender_profile = create_test_lender_profile(self.lender_user)
+        self.loans = [
+            LoanApplication.objects.create(
+                sme_business=self.business, lender=self.lender_profile, loan_amount=Decimal('60000.00'),
+                interest_rate=Decimal('12.00'), tenure_months=3, purpose='Stock', status='submitted'
+            )
+            for _ in range(5)
+        ]
+        for loan in self.loans:
+            for number in (1, 2, 3):
+                RepaymentSchedule.objects.create(
+                    loan_application=loan, installment_number=number, due_date=date(2026, number, 1),
+                    principal_amount=Decimal('20000.00'), interest_amount=Decimal('600.00'), total_amount=Decimal('20600.00')
+                )
+    
+    def test_loan_endpoints_within_budget(self):
+        loan = self.loans[0]
+        for user in (self.sme_user, self.lender_user):
+            self.client.force_authenticate(user=user)
+            response = self.assertWithinQueryBudget(self.client.get('/api/escrow/loan-applications/'))
+            self.assertEqual(response.data['count'], 5)
+            self.assertWithinQueryBudget(self.client.get(f'/api/escrow/loan-applications/{loan.id}/'))
+            response = self.assertWithinQueryBudget(
+                self.client.get(f'/api/escrow/loan-applications/{loan.id}/repayment_schedule/')
+            )
+            self.assertEqual(len(response.data), 3)
+        
+        response = self.assertWithinQueryBudget(
+            self.client.post(f'/api/escrow/loan-applications/{loan.id}/reject_application/')
+        )
+        self.assertEqual(response.data['status'], 'rejected')
+    
+    def test_ownership_checks_use_ids(self):
+        # Comparing user ids needs neither user row; an unassigned loan no longer errors
+        unassigned = LoanApplication.objects.create(
+            sme_business=self.business, loan_amount=Decimal('1000.00'), interest_rate=Decimal('10.00'),
+            tenure_months=1, purpose='Stock', status='submitted'
+        )
+        self.client.force_authenticate(user=self.sme_user)
+        with self.assertMaxQueries(2):
+            response = self.client.get(f'/api/escrow/loan-applications/{unassigned.id}/repayment_schedule/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        self.client.force_authenticate(user=self.lender_user)
+        response = self.client.post(f'/api/escrow/loan-applications/{unassigned.id}/reject_application/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
 if __name__ == '__main__':
     import django
     from django.conf import settings
@@ -4,7 +4,8 @@ from rest_framework_nested.routers import DefaultRouter, NestedDefaultRouter
 from .views import (
     LoanApplicationViewSet, EscrowAccountViewSet,
     TransactionViewSet, RepaymentScheduleViewSet, LenderEscrowViewSet,
-    LoanNegotiationViewSet # <-- IMPORT NEW VIEWSET
+    LoanNegotiationViewSet, # <-- IMPORT NEW VIEWSET
+    GatewayMetricsView, PaystackWebhookView, live_events
 )
 
 # Main router
@@ -35,4 +36,7 @@ urlpatterns = [
     path('', include(negotiations_router.urls)), # <-- ADD NESTED URLS
     # Add webhook endpoint
     path('webhook/verify-funding/', LoanApplicationViewSet.as_view({'post': 'verify_funding'}), name='verify-funding-webhook'),
+    path('webhook/paystack/', PaystackWebhookView.as_view(), name='paystack-webhook'),
+    path('gateway-metrics/', GatewayMetricsView.as_view(), name='gateway-metrics'),
+    path('events/', live_events, name='live-events'),
 ]
\ No newline at end of file
@@ -2,8 +2,10 @@ import uuid
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework.pagination import CursorPagination
 from django.utils import timezone
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.shortcuts import get_object_or_404
 from django.db import transaction as db_transaction
 from .models import (
@@ -18,29 +20,58 @@ from .serializers import (
     MakeRepaymentSerializer, VerifyFundingSerializer, LoanApplicationStatusSerializer,
     LoanNegotiationSerializer, SMECounterOfferSerializer # <-- NEW
 )
-from .services import EscrowService, PaymentGatewayService
-from sme.models import BusinessProfile
-from django.db.models import Sum
-from rest_framework.exceptions import PermissionDenied # <-- NEW
+from .services import EscrowService, PaymentGatewayService, paystack_metrics
+from .webhooks import verify_paystack_signature, record_paystack_event
+from .idempotency import idempotent
+from . import negotiations
+from .negotiations import StaleVersionError
+from .events import stream_events, publish
+from . import notifications
+from core.outbox import enqueue
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from django.db.models import Sum, Count, Q
+from rest_framework.exceptions import PermissionDenied, ValidationError # <-- NEW
+
+# Everything LoanApplicationSerializer touches (its nested lender serializer includes the user)
+LOAN_SERIALIZER_RELATED = ('sme_business', 'lender__user', 'escrow_account')
+
+# Everything TransactionSerializer touches (it nests the loan twice: directly and via the escrow account)
+TRANSACTION_SERIALIZER_RELATED = (
+    'loan_application__sme_business',
+    'loan_application__lender__user',
+    'loan_application__escrow_account',
+    'escrow_account__loan_application__sme_business',
+    'escrow_account__loan_application__lender__user',
+    'escrow_account__loan_application__escrow_account',
+)
 
 class LoanApplicationViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
+    # Per action, including the JWT user lookup (see core.middleware.QueryBudgetMiddleware)
+    query_budget = {'list': 3, 'retrieve': 2, 'repayment_schedule': 3, 'reject_application': 3}
     
     def get_queryset(self):
         user = self.request.user
         
         if user.user_type == 'sme':
-            return LoanApplication.objects.filter(sme_business__user=user)
+            queryset = LoanApplication.objects.filter(sme_business__user=user)
         elif user.user_type == 'lender':
             # Lenders can see applications they are assigned to OR public submitted ones
-            return LoanApplication.objects.filter(
-                models.Q(lender__user=user) | 
-                models.Q(status='submitted', lender__isnull=True)
+            queryset = LoanApplication.objects.filter(
+                Q(lender__user=user) | 
+                Q(status='submitted', lender__isnull=True)
             ).distinct()
         else:
             return LoanApplication.objects.none()
+        return queryset.select_related(*LOAN_SERIALIZER_RELATED)
     
     def get_serializer_class(self):
+        # Extra actions declare their own serializer_class on @action
+        if self.serializer_class is not None:
+            return self.serializer_class
         if self.action == 'create':
             return LoanApplicationCreateSerializer
         elif self.action == 'update_status':
@@ -52,7 +83,9 @@ class LoanApplicationViewSet(viewsets.ModelViewSet):
         user = self.request.user
         
         if user.user_type == 'sme':
-            sme_business = get_object_or_404(BusinessProfile, user=user)
+            sme_business = self.request.profiles.business
+            if sme_business is None:
+                raise Http404("Business profile not found.")
             
             if sme_business.verification_status != 'verified':
                 # Return the error response directly
@@ -131,12 +164,12 @@ class LoanApplicationViewSet(viewsets.ModelViewSet):
         except LenderProfile.DoesNotExist:
             return Response({"error": "Lender not found."}, status=status.HTTP_404_NOT_FOUND)
             
-        # 4. Assign lender and update status
-        loan_application.lender = lender
-        loan_application.status = 'submitted'
-        loan_application.save()
-        
-        # You could also create a notification for the lender here
+        # 4. Assign lender and update status; the lender is notified via the outbox
+        with db_transaction.atomic():
+            loan_application.lender = lender
+            loan_application.status = 'submitted'
+            loan_application.save()
+            enqueue(notifications.pitched(loan_application))
         
         return Response(
             {"message": f"Successfully pitched to {lender.company_name}."},
@@ -145,12 +178,13 @@ class LoanApplicationViewSet(viewsets.ModelViewSet):
 
     
     @action(detail=True, methods=['post'], serializer_class=FundEscrowSerializer)
+    @idempotent
     def initialize_funding(self, request, pk=None):
         """Initialize escrow funding with Paystack"""
         loan_application = self.get_object()
         
         # Check if user is the lender for this loan
-        if request.user != loan_application.lender.user:
+        if request.user.pk != loan_application.lender_user_id:
             return Response(
                 {"error": "You can only fund your own loan applications"},
                 status=status.HTTP_403_FORBIDDEN
@@ -230,12 +264,13 @@ class LoanApplicationViewSet(viewsets.ModelViewSet):
             )
     
     @action(detail=True, methods=['post'], serializer_class=InitiateDisbursementSerializer)
+    @idempotent
     def initiate_disbursement(self, request, pk=None):
         """Initiate disbursement to SME"""
         loan_application = self.get_object()
         
         # Check permissions
-        if request.user != loan_application.lender.user:
+        if request.user.pk != loan_application.lender_user_id:
             return Response(
                 {"error": "Only the lender can initiate disbursement"},
                 status=status.HTTP_403_FORBIDDEN
@@ -294,7 +329,7 @@ class LoanApplicationViewSet(viewsets.ModelViewSet):
         """Reject a loan application (Lender only)"""
         loan_application = self.get_object()
         
-        if request.user != loan_application.lender.user:
+        if request.user.pk != loan_application.lender_user_id:
             return Response(
                 {"error": "Only the assigned lender can reject this application"},
                 status=status.HTTP_403_FORBIDDEN
@@ -320,7 +355,7 @@ class LoanApplicationViewSet(viewsets.ModelViewSet):
         loan_application = self.get_object()
         
         # Check permissions
-        if request.user not in [loan_application.sme_business.user, loan_application.lender.user]:
+        if request.user.pk not in [loan_application.sme_business.user_id, loan_application.lender_user_id]:
             return Response(
                 {"error": "You don't have permission to view this repayment schedule"},
                 status=status.HTTP_403_FORBIDDEN
@@ -344,11 +379,12 @@ class EscrowAccountViewSet(viewsets.ReadOnlyModelViewSet):
         user = self.request.user
         
         if user.user_type == 'sme':
-            return EscrowAccount.objects.filter(loan_application__sme_business__user=user)
+            queryset = EscrowAccount.objects.filter(loan_application__sme_business__user=user)
         elif user.user_type == 'lender':
-            return EscrowAccount.objects.filter(loan_application__lender__user=user)
+            queryset = EscrowAccount.objects.filter(loan_application__lender__user=user)
         else:
             return EscrowAccount.objects.none()
+        return queryset.select_related(*(f'loan_application__{path}' for path in LOAN_SERIALIZER_RELATED))
 
 class TransactionViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
@@ -358,11 +394,12 @@ class TransactionViewSet(viewsets.ReadOnlyModelViewSet):
         user = self.request.user
         
         if user.user_type == 'sme':
-            return Transaction.objects.filter(loan_application__sme_business__user=user)
+            queryset = Transaction.objects.filter(loan_application__sme_business__user=user)
         elif user.user_type == 'lender':
-            return Transaction.objects.filter(loan_application__lender__user=user)
+            queryset = Transaction.objects.filter(loan_application__lender__user=user)
         else: 
             return Transaction.objects.none()
+        return queryset.select_related(*TRANSACTION_SERIALIZER_RELATED)
 
 class RepaymentScheduleViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
@@ -379,6 +416,7 @@ class RepaymentScheduleViewSet(viewsets.ReadOnlyModelViewSet):
             return RepaymentSchedule.objects.none()
     
     @action(detail=True, methods=['post'], serializer_class=MakeRepaymentSerializer)
+    @idempotent
     def make_repayment(self, request, pk=None):
         """Make a repayment for a scheduled installment (FIXED TRANSACTION ID)"""
         repayment_schedule = self.get_object()
@@ -437,41 +475,48 @@ class LenderEscrowViewSet(viewsets.ViewSet):
     
     @action(detail=False, methods=['get'])
     def dashboard(self, request):
-        """Get lender escrow dashboard statistics"""
-        lender_profile = get_object_or_404(request.user.lender_profile)
-        
-        # Get loan applications statistics
-        total_loans = LoanApplication.objects.filter(lender=lender_profile).count()
-        active_loans = LoanApplication.objects.filter(lender=lender_profile, status='active').count()
-        pending_loans = LoanApplication.objects.filter(lender=lender_profile, status__in=['submitted', 'under_review']).count()
+        """Get lender escrow dashboard statistics (two queries regardless of portfolio size)"""
+        if request.user.user_type != 'lender':
+            return Response(
+                {"error": "Only lenders have an escrow dashboard"},
+                status=status.HTTP_403_FORBIDDEN
+            )
         
-        # FIXED: Use Django's Sum function properly
-        total_amount_lent = LoanApplication.objects.filter(
-            lender=lender_profile, 
-            status__in=['active', 'completed']
-        ).aggregate(total=Sum('loan_amount'))['total'] or 0
+        # All loan counts and sums in one conditional aggregate over escrow_loan_applications
+        stats = LoanApplication.objects.filter(lender__user=request.user).aggregate(
+            total_loans=Count('id'),
+            active_loans=Count('id', filter=Q(status='active')),
+            pending_loans=Count('id', filter=Q(status__in=['submitted', 'under_review'])),
+            total_amount_lent=Sum('loan_amount', filter=Q(status__in=['active', 'completed'])),
+        )
         
-        # Get recent transactions
+        # Get recent transactions with every relation the serializer reads
         recent_transactions = Transaction.objects.filter(
-            loan_application__lender=lender_profile
-        ).order_by('-initiated_at')[:10]
+            loan_application__lender__user=request.user
+        ).select_related(*TRANSACTION_SERIALIZER_RELATED).order_by('-initiated_at')[:10]
         
         return Response({
-            'total_loans': total_loans,
-            'active_loans': active_loans,
-            'pending_loans': pending_loans,
-            'total_amount_lent': float(total_amount_lent),  # Convert Decimal to float for JSON
+            'total_loans': stats['total_loans'],
+            'active_loans': stats['active_loans'],
+            'pending_loans': stats['pending_loans'],
+            'total_amount_lent': float(stats['total_amount_lent'] or 0),  # Convert Decimal to float for JSON
             'recent_transactions': TransactionSerializer(recent_transactions, many=True).data
         })
 
 
 # --- NEW VIEWSET ---
+class NegotiationCursorPagination(CursorPagination):
+    """Stable paging through long offer histories, oldest first"""
+    ordering = ('created_at', 'id')
+
+
 class LoanNegotiationViewSet(viewsets.ModelViewSet):
     """
     Manages negotiations for a specific Loan Application.
     /api/escrow/loan-applications/<loan_pk>/negotiations/
     """
     permission_classes = [IsAuthenticated]
+    pagination_class = NegotiationCursorPagination
     
     def get_serializer_class(self):
         if self.action == 'counter_offer':
@@ -479,14 +524,26 @@ class LoanNegotiationViewSet(viewsets.ModelViewSet):
         return LoanNegotiationSerializer
 
     def get_loan_application(self):
-        """Get parent LoanApplication from URL"""
-        loan_pk = self.kwargs['loan_application_pk']
-        return get_object_or_404(LoanApplication, pk=loan_pk)
+        """Get parent LoanApplication from URL, fetched once per request"""
+        if not hasattr(self, '_loan_application'):
+            self._loan_application = get_object_or_404(
+                LoanApplication.objects.select_related('sme_business__user', 'lender__user'),
+                pk=self.kwargs['loan_application_pk']
+            )
+        return self._loan_application
 
     def get_queryset(self):
         """Return all negotiations for the given loan"""
         loan_application = self.get_loan_application()
-        return loan_application.negotiations.all().order_by('created_at')
+        return LoanNegotiation.objects.filter(
+            loan_application=loan_application
+        ).select_related('user').order_by('created_at')
+
+    def get_object(self):
+        offer = super().get_object()
+        # Reuse the already-loaded parent instead of lazily fetching it again
+        offer.loan_application = self.get_loan_application()
+        return offer
 
     def get_serializer_context(self):
         """Pass request and loan_app to serializer"""
@@ -495,6 +552,30 @@ class LoanNegotiationViewSet(viewsets.ModelViewSet):
             'loan_application': self.get_loan_application()
         }
 
+    def _expected_version(self, request):
+        """Offer version the client last saw, if it sent one (400 unless it is an integer)"""
+        version = request.data.get('version')
+        if version in (None, ''):
+            return None
+        try:
+            return int(version)
+        except (TypeError, ValueError):
+            raise ValidationError({'version': ["A valid integer is required."]})
+
+    def _conflict(self, error):
+        return Response(
+            {"error": f"{error} Please refresh and try again."},
+            status=status.HTTP_409_CONFLICT
+        )
+
+    def _publish(self, offer, event_type, lender_user_id):
+        """Tell the SME and the lender on the other side of an offer"""
+        loan_application = self.get_loan_application()
+        publish({loan_application.sme_business.user_id, lender_user_id}, event_type, loan_application.pk, {
+            'offerId': offer.pk, 'proposedRate': offer.proposed_rate,
+            'offerStatus': offer.status, 'fromUserId': offer.user_id
+        })
+
     def perform_create(self, serializer):
         """Lender creates a new offer"""
         loan_application = self.get_loan_application()
@@ -502,13 +583,15 @@ class LoanNegotiationViewSet(viewsets.ModelViewSet):
         if self.request.user.user_type != 'lender':
             raise PermissionDenied("Only lenders can make offers.")
             
-        serializer.save(
-            user=self.request.user, 
-            loan_application=loan_application
-        )
+        with db_transaction.atomic():
+            offer = serializer.save(
+                user=self.request.user, 
+                loan_application=loan_application
+            )
+            enqueue(notifications.offer_made(offer, loan_application))
+        self._publish(offer, 'offer.created', offer.user_id)
 
     @action(detail=True, methods=['post'], url_path='sme-accept')
-    @db_transaction.atomic
     def accept_offer(self, request, pk=None, loan_application_pk=None):
         """SME accepts a LENDER's offer"""
         offer = self.get_object()
@@ -531,21 +614,12 @@ class LoanNegotiationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # 3. Update Loan Application
-        loan_application.lender = offer.user.lender_profile # Assign lender
-        loan_application.negotiated_rate = offer.proposed_rate
-        loan_application.status = 'approved' # Mark as approved
-        loan_application.approval_date = timezone.now()
-        loan_application.save()
-        
-        # 4. Update this offer
-        offer.status = 'accepted'
-        offer.save()
-        
-        # 5. Reject all other pending offers for this loan
-        loan_application.negotiations.filter(
-            status='pending'
-        ).update(status='rejected')
+        # 3. Approve the loan for this lender and reject the other pending offers
+        try:
+            negotiations.accept_offer(offer, offer.user.lender_profile, self._expected_version(request))
+        except StaleVersionError as e:
+            return self._conflict(e)
+        self._publish(offer, 'offer.accepted', offer.user_id)
         
         return Response(
             {"message": "Offer accepted. Loan approved."},
@@ -564,8 +638,13 @@ class LoanNegotiationViewSet(viewsets.ModelViewSet):
         if offer.user.user_type != 'lender':
             return Response({"error": "You can only reject offers from a lender."}, status=status.HTTP_400_BAD_REQUEST)
 
-        offer.status = 'rejected'
-        offer.save()
+        try:
+            with db_transaction.atomic():
+                negotiations.transition_offer(offer, 'pending', 'rejected', self._expected_version(request))
+                enqueue(notifications.offer_rejected(offer, loan_application))
+        except StaleVersionError as e:
+            return self._conflict(e)
+        self._publish(offer, 'offer.rejected', offer.user_id)
         
         return Response({"message": "Offer rejected."}, status=status.HTTP_200_OK)
 
@@ -589,8 +668,10 @@ class LoanNegotiationViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         
         # 1. Mark original offer as countered
-        original_offer.status = 'countered'
-        original_offer.save()
+        try:
+            negotiations.transition_offer(original_offer, 'pending', 'countered', self._expected_version(request))
+        except StaleVersionError as e:
+            return self._conflict(e)
         
         # 2. Create a new 'pending' offer from the SME
         new_offer = LoanNegotiation.objects.create(
@@ -600,6 +681,8 @@ class LoanNegotiationViewSet(viewsets.ModelViewSet):
             message=serializer.validated_data.get('message', ''),
             status='pending' # This is now a pending offer for the LENDER to accept
         )
+        enqueue(notifications.offer_countered(new_offer, original_offer, loan_application))
+        self._publish(new_offer, 'offer.countered', original_offer.user_id)
         
         return Response(
             LoanNegotiationSerializer(new_offer).data, 
@@ -607,7 +690,6 @@ class LoanNegotiationViewSet(viewsets.ModelViewSet):
         )
 
     @action(detail=True, methods=['post'], url_path='lender-accept')
-    @db_transaction.atomic
     def lender_accept_offer(self, request, pk=None, loan_application_pk=None):
         """LENDER accepts an SME's counter-offer"""
         offer = self.get_object()
@@ -617,6 +699,10 @@ class LoanNegotiationViewSet(viewsets.ModelViewSet):
         if request.user.user_type != 'lender':
             raise PermissionDenied("Only lenders can accept this offer.")
         
+        lender_profile = request.profiles.lender
+        if lender_profile is None:
+            return Response({"error": "Lender profile not found."}, status=status.HTTP_404_NOT_FOUND)
+        
         # 2. Check if offer is from the SME
         if offer.user != loan_application.sme_business.user:
             return Response(
@@ -630,24 +716,75 @@ class LoanNegotiationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # 3. Update Loan Application
-        loan_application.lender = request.user.lender_profile # Assign *this* lender
-        loan_application.negotiated_rate = offer.proposed_rate
-        loan_application.status = 'approved' # Mark as approved
-        loan_application.approval_date = timezone.now()
-        loan_application.save()
-        
-        # 4. Update this offer
-        offer.status = 'accepted'
-        offer.save()
-        
-        # 5. Reject all other pending offers for this loan
-        loan_application.negotiations.filter(
-            status='pending'
-        ).update(status='rejected')
+        # 3. Approve the loan for *this* lender and reject the other pending offers
+        try:
+            negotiations.accept_offer(offer, lender_profile, self._expected_version(request))
+        except StaleVersionError as e:
+            return self._conflict(e)
+        self._publish(offer, 'offer.accepted', request.user.id)
         
         return Response(
             {"message": "Counter-offer accepted. Loan approved."},
             status=status.HTTP_200_OK
         )
-# -----------------
\ No newline at end of file
+# -----------------
+
+
+class GatewayMetricsView(APIView):
+    """GET /gateway-metrics/ - Per-operation Paystack call latency and retry counts for this process (Admin only)"""
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        if not request.user.is_staff:
+            return Response({
+                "success": False,
+                "message": "Admin access required"
+            }, status=status.HTTP_403_FORBIDDEN)
+        
+        return Response({"success": True, "data": {"paystack": paystack_metrics.snapshot()}})
+
+
+class PaystackWebhookView(APIView):
+    """
+    POST /webhook/paystack/ - Signature-verified Paystack event ingestion.
+    Events are only stored here; `manage.py process_webhooks` settles them.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    
+    def post(self, request):
+        body = request.body
+        if not verify_paystack_signature(body, request.headers.get('x-paystack-signature')):
+            return Response({"success": False, "message": "Invalid signature"}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        try:
+            record_paystack_event(body)
+        except ValueError:
+            return Response({"success": False, "message": "Invalid payload"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({"success": True}, status=status.HTTP_200_OK)
+
+
+async def live_events(request):
+    """
+    GET /events/ - Server-sent event stream of offer, counter, acceptance and
+    escrow updates for the caller. EventSource cannot send headers, so the
+    access token may be passed as ?token=. Needs an ASGI server.
+    """
+    raw_token = request.GET.get('token')
+    if not raw_token:
+        header = request.headers.get('Authorization', '')
+        raw_token = header.split(' ', 1)[1] if header.startswith('Bearer ') else ''
+    try:
+        user_id = int(AccessToken(raw_token)[jwt_settings.USER_ID_CLAIM])
+    except (TokenError, KeyError, ValueError):
+        return JsonResponse({"success": False, "message": "Invalid or expired token"}, status=status.HTTP_401_UNAUTHORIZED)
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('lastEventId')
+    response = StreamingHttpResponse(
+        stream_events(user_id, int(last_event_id) if last_event_id and last_event_id.isdigit() else None),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
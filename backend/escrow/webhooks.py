@@ -0,0 +1,176 @@
+import hashlib
+import hmac
+import json
+import logging
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import WebhookEvent, Transaction, EscrowAccount
+from . import ledger
+from .events import publish_to_parties
+from . import notifications
+from core.outbox import enqueue
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+
+# --- Ingestion ---
+
+def verify_paystack_signature(body, signature):
+    """Paystack signs the raw request body with HMAC-SHA512 of the secret key."""
+    if not signature:
+        return False
+    expected = hmac.new(settings.PAYSTACK_SECRET_KEY.encode(), body, hashlib.sha512).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def record_paystack_event(body):
+    """
+    Store a verified webhook body in the inbox. Redeliveries of the same event are
+    dropped by the unique event_id. Returns True if the event was new.
+    """
+    payload = json.loads(body)
+    event_type = payload.get('event', '')
+    data = payload.get('data') or {}
+    object_id = data.get('id') or data.get('reference') or hashlib.sha256(body).hexdigest()
+
+    _, created = WebhookEvent.objects.get_or_create(
+        event_id=f"{event_type}:{object_id}",
+        defaults={'event_type': event_type, 'payload': payload}
+    )
+    return created
+
+
+# --- Processing ---
+
+class WebhookInboxProcessor:
+    """
+    Drains pending webhook events in batches. Each batch is settled in one DB
+    transaction with bulk updates and no gateway calls: the signed payload is
+    the source of truth for the payment outcome.
+    """
+
+    def __init__(self, batch_size=100):
+        self.batch_size = batch_size
+        self.handlers = {
+            'charge.success': self._settle_charges,
+        }
+
+    def drain(self):
+        """Process batches until the inbox is empty. Returns {status: count}."""
+        totals = {}
+        while True:
+            counts = self.process_batch()
+            if not counts:
+                return totals
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+
+    def process_batch(self):
+        with db_transaction.atomic():
+            events = list(
+                WebhookEvent.objects.select_for_update(skip_locked=True)
+                .filter(status='pending').order_by('id')[:self.batch_size]
+            )
+            if not events:
+                return {}
+
+            by_type = {}
+            for event in events:
+                by_type.setdefault(event.event_type, []).append(event)
+
+            outcomes = {}  # event id -> (status, error)
+            for event_type, typed_events in by_type.items():
+                handler = self.handlers.get(event_type)
+                if handler is None:
+                    outcomes.update({event.id: ('ignored', '') for event in typed_events})
+                    continue
+                try:
+                    with db_transaction.atomic():
+                        outcomes.update(handler(typed_events))
+                except Exception as e:
+                    logger.exception(f"Webhook handler for {event_type} failed")
+                    outcomes.update({event.id: ('retry', str(e)) for event in typed_events})
+
+            self._record_outcomes(events, outcomes)
+
+        counts = {}
+        for status, _ in outcomes.values():
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def _record_outcomes(self, events, outcomes):
+        now = timezone.now()
+        done = {}
+        for event in events:
+            status, error = outcomes[event.id]
+            if status == 'retry':
+                continue
+            done.setdefault((status, error), []).append(event.id)
+        for (status, error), ids in done.items():
+            WebhookEvent.objects.filter(id__in=ids).update(
+                status=status, last_error=error, processed_at=now, attempts=F('attempts') + 1
+            )
+
+        retry = [event for event in events if outcomes[event.id][0] == 'retry']
+        for event in retry:
+            event.attempts += 1
+            event.last_error = outcomes[event.id][1]
+            event.status = 'failed' if event.attempts >= MAX_ATTEMPTS else 'pending'
+        WebhookEvent.objects.bulk_update(retry, ['attempts', 'last_error', 'status'])
+
+    def _load_transactions(self, references):
+        """Funding transactions by reference, locked until the batch commits."""
+        transactions = Transaction.objects.select_for_update(of=('self',)).filter(
+            transaction_id__in=references
+        ).select_related(
+            'loan_application__escrow_account', 'loan_application__sme_business__user', 'loan_application__lender__user'
+        )
+        return {txn.transaction_id: txn for txn in transactions}
+
+    def _settle_charges(self, events):
+        """Mark funding transactions completed and credit their escrow accounts."""
+        by_reference = {event.payload['data'].get('reference'): event for event in events}
+        found = self._load_transactions([reference for reference in by_reference if reference])
+
+        outcomes = {}
+        now = timezone.now()
+        credited_accounts = []
+        fundings = []
+        messages = []
+        for reference, event in by_reference.items():
+            txn = found.get(reference)
+            if txn is None:
+                outcomes[event.id] = ('ignored', f"No transaction for reference {reference}")
+                continue
+            data = event.payload['data']
+            # The verify callback may have settled it since it was read; only the claiming path credits
+            if txn.status == 'completed' or not txn.complete_once(data, now):
+                outcomes[event.id] = ('processed', 'Already settled')
+                continue
+
+            escrow_account = txn.loan_application.escrow_account
+            amount = Decimal(data['amount']) / 100
+            fundings.append((escrow_account.pk, 'funding', amount, txn))
+            escrow_account.status = 'active'
+            escrow_account.updated_at = now
+            credited_accounts.append(escrow_account)
+            messages.append(notifications.escrow_funded(txn.loan_application, amount))
+            publish_to_parties(txn.loan_application, 'escrow.funded', {
+                'escrowStatus': escrow_account.status, 'amount': amount
+            })
+            outcomes[event.id] = ('processed', '')
+
+        # Duplicate references within a batch collapse onto one event; the others are redeliveries
+        for event in events:
+            outcomes.setdefault(event.id, ('processed', 'Duplicate reference in batch'))
+
+        EscrowAccount.objects.bulk_update(credited_accounts, ['status', 'updated_at'])
+        if fundings:
+            ledger.post(fundings)
+        enqueue(*messages)
+        return outcomes
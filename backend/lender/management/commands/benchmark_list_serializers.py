@@ -0,0 +1,100 @@
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from lender.models import LenderProfile, SMEInterest
+from lender.serializers import (
+    VerifiedSMESerializer, SMEInterestSerializer,
+    VerifiedSMEValuesSerializer, SMEInterestValuesSerializer
+)
+from sme.models import BusinessProfile
+from users.models import User
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Benchmark the values() list path against the ModelSerializers for marketplace and interest pages."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='20,100,1000', help="Comma-separated page sizes")
+        parser.add_argument('--repeat', type=int, default=3, help="Timed runs per measurement (median is reported)")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        repeat = options['repeat']
+
+        # Fixture rows live inside a transaction that is always rolled back
+        try:
+            with transaction.atomic():
+                lender = self._seed(max(sizes))
+                self._report(lender, sizes, repeat)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _seed(self, count):
+        tag = uuid.uuid4().hex[:8]
+        lender_user = User.objects.create(username=f'bench-lender-{tag}', email=f'bench-lender-{tag}@example.com', user_type='lender')
+        lender = LenderProfile.objects.create(
+            user=lender_user, lender_type='bank', company_name='Bench Capital', years_in_operation=3,
+            risk_appetite=5, contact_person='Bench', contact_email=lender_user.email,
+            contact_phone='0800', office_address='Lagos'
+        )
+        users = User.objects.bulk_create([
+            User(username=f'bench-sme-{tag}-{i}', email=f'bench-sme-{tag}-{i}@example.com', user_type='sme')
+            for i in range(count)
+        ])
+        profiles = BusinessProfile.objects.bulk_create([
+            BusinessProfile(
+                user=user, business_name=f'Bench SME {i}', business_category='retail',
+                monthly_revenue=1500000, number_of_employees=12, pulse_score=80, profit_score=70,
+                verification_status='verified'
+            )
+            for i, user in enumerate(users)
+        ])
+        SMEInterest.objects.bulk_create([SMEInterest(lender=lender, sme_business=profile) for profile in profiles])
+        return lender
+
+    def _measure(self, func, repeat):
+        timings = []
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        for _ in range(repeat):
+            queries.clear()
+            with connection.execute_wrapper(count_query):
+                start = time.perf_counter()
+                func()
+                timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), len(queries)
+
+    def _report(self, lender, sizes, repeat):
+        smes = BusinessProfile.objects.filter(verification_status='verified').order_by('id')
+        interests = SMEInterest.objects.filter(lender=lender).order_by('id')
+        cases = [
+            ('VerifiedSMESerializer', VerifiedSMESerializer, VerifiedSMEValuesSerializer, smes),
+            ('SMEInterestSerializer', SMEInterestSerializer, SMEInterestValuesSerializer, interests),
+        ]
+
+        self.stdout.write(f"{'serializer':<24}{'rows':>6}{'model ms':>11}{'queries':>9}{'values ms':>11}{'queries':>9}{'speedup':>9}")
+        for label, model_serializer, values_serializer, queryset in cases:
+            for size in sizes:
+                model_ms, model_queries = self._measure(
+                    lambda: model_serializer(list(queryset[:size]), many=True).data, repeat
+                )
+                values_ms, values_queries = self._measure(
+                    lambda: values_serializer.many(values_serializer.values(queryset)[:size]), repeat
+                )
+                self.stdout.write(
+                    f"{label:<24}{size:>6}{model_ms:>11.2f}{model_queries:>9}"
+                    f"{values_ms:>11.2f}{values_queries:>9}{model_ms / values_ms:>8.1f}x"
+                )
@@ -0,0 +1,11 @@
+from core.outbox import notification
+
+
+def welcome(lender_profile):
+    return notification(
+        'lender.registered', [lender_profile.contact_email or lender_profile.user.email],
+        "Welcome to PulseFI",
+        f"Hi {lender_profile.contact_person or lender_profile.company_name}, your lender profile for "
+        f"{lender_profile.company_name} is set up. Verified SMEs can now pitch loan applications to you.",
+        lender_profile_id=lender_profile.id,
+    )
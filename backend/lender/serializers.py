@@ -3,6 +3,7 @@ from .models import LenderProfile, SMEInterest, SearchFilter
 from sme.models import BusinessProfile
 from sme.serializers import BusinessProfileSerializer
 from users.serializers import UserSerializer
+from core.serializers import ValuesSerializer
 
 class LenderProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
@@ -74,6 +75,10 @@ class SMEInterestSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['viewed_at', 'status_updated_at']
 
+# Fast list paths: same JSON as the ModelSerializers above, built from .values() rows
+VerifiedSMEValuesSerializer = ValuesSerializer(VerifiedSMESerializer)
+SMEInterestValuesSerializer = ValuesSerializer(SMEInterestSerializer)
+
 class SMEInterestCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = SMEInterest
@@ -0,0 +1,134 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from core.caching import cached, cache_stats
+from django.db.models import Q, Sum, Avg, Count
+from django.utils import timezone
+from sme.models import BusinessProfile
+from sme.services import load_profile_status
+from .models import SMEInterest
+from escrow.models import LoanApplication, RepaymentSchedule
+
+FUNDED_LOAN_STATUSES = ['active', 'completed']
+
+MARKETPLACE_SNAPSHOT_KEY = 'lender:marketplace_snapshot'
+
+
+@cached(tags=lambda lender_profile: [f"lender:{lender_profile.pk}"])
+def get_portfolio_stats(lender_profile):
+    """Portfolio numbers for one lender: one aggregate over loans, one over repayment schedules."""
+    funded = Q(status__in=FUNDED_LOAN_STATUSES)
+    loan_stats = LoanApplication.objects.filter(lender=lender_profile).aggregate(
+        totalInvestments=Count('id', filter=funded),
+        totalAmount=Sum('loan_amount', filter=funded),
+        activeInvestments=Count('id', filter=Q(status='active')),
+        averageROI=Avg('negotiated_rate', filter=funded),
+    )
+
+    # A loan counts as defaulting once any of its installments is past due and unpaid
+    overdue = Q(status='overdue') | Q(status='pending', due_date__lt=timezone.now().date())
+    repayment_stats = RepaymentSchedule.objects.filter(loan_application__lender=lender_profile).aggregate(
+        scheduledLoans=Count('loan_application', distinct=True),
+        defaultingLoans=Count('loan_application', distinct=True, filter=overdue),
+    )
+    scheduled = repayment_stats['scheduledLoans']
+    default_rate = (repayment_stats['defaultingLoans'] / scheduled * 100) if scheduled else 0
+
+    return {
+        "totalInvestments": loan_stats['totalInvestments'] or 0,
+        "totalAmount": loan_stats['totalAmount'] or 0,
+        "activeInvestments": loan_stats['activeInvestments'] or 0,
+        "averageROI": loan_stats['averageROI'] or 0,
+        "defaultRate": round(default_rate, 2),
+    }
+
+
+def _build_marketplace_snapshot():
+    listed = Q(pulse_score__gte=75)
+    stats = BusinessProfile.objects.filter(verification_status='verified').aggregate(
+        totalVerifiedSMEs=Count('id', filter=listed),
+        averagePulseScore=Avg('pulse_score', filter=listed),
+        averageProfitScore=Avg('profit_score', filter=listed),
+        newSMEsThisWeek=Count('id', filter=Q(created_at__gte=timezone.now() - timedelta(days=7))),
+    )
+    return {
+        "totalVerifiedSMEs": stats['totalVerifiedSMEs'] or 0,
+        "newSMEsThisWeek": stats['newSMEsThisWeek'] or 0,
+        "averagePulseScore": stats['averagePulseScore'] or 0,
+        "averageProfitScore": stats['averageProfitScore'] or 0,
+    }
+
+
+def get_marketplace_snapshot(refresh=False):
+    """
+    Marketplace-wide stats are identical for every lender, so they are computed
+    once per refresh interval and shared through the cache.
+    """
+    if not refresh:
+        snapshot = cache.get(MARKETPLACE_SNAPSHOT_KEY)
+        cache_stats.record(MARKETPLACE_SNAPSHOT_KEY, hit=snapshot is not None)
+        if snapshot is not None:
+            return snapshot
+    snapshot = _build_marketplace_snapshot()
+    cache.set(MARKETPLACE_SNAPSHOT_KEY, snapshot, getattr(settings, 'MARKETPLACE_SNAPSHOT_TTL', 300))
+    return snapshot
+
+
+@cached(tags=lambda sme_id: [f"sme:{sme_id}"])
+def marketplace_sme_detail(sme_id):
+    """
+    What lenders see for one marketplace SME (raises BusinessProfile.DoesNotExist
+    unless it is verified and listed). Shared by every lender and cached until
+    the SME's profile, documents, offers or interests change.
+    """
+    sme_business = load_profile_status(id=sme_id, verification_status='verified', pulse_score__gte=75)
+    # Real marketplace metrics (offer stats come annotated on the profile)
+    lender_interest_count = SMEInterest.objects.filter(sme_business=sme_business).count()
+
+    return {
+        "basicInfo": {
+            "id": str(sme_business.id),
+            "businessName": sme_business.business_name,
+            "industry": sme_business.industry,
+            "businessType": sme_business.business_category,
+            "yearEstablished": sme_business.year_established,
+            "employeeCount": sme_business.number_of_employees,
+            "location": sme_business.business_address,
+            "businessDescription": sme_business.business_description,
+            "targetMarket": sme_business.target_market,
+            "competitiveAdvantage": sme_business.competitive_advantage
+        },
+        "scores": {
+            "pulseScore": sme_business.pulse_score,
+            "profitScore": sme_business.profit_score,
+            "riskLevel": "low" if sme_business.pulse_score > 80 else "medium", # Simple logic
+            "verificationStatus": sme_business.verification_status
+        },
+        "financialHighlights": { 
+            "monthlyRevenue": sme_business.monthly_revenue,
+            "profitMargin": None, # Cannot calculate without expenses
+            "growthRate": None, # Requires time-series data
+            "cashFlowStatus": None, # Requires full analysis
+            "debtToIncomeRatio": None # Requires debt data
+        },
+        "fundingRequest": { 
+            "amount": sme_business.funding_amount,
+            "purpose": sme_business.funding_purpose,
+            "expectedROI": None, # Not modeled
+            "paybackPeriod": None, # Not modeled
+            "collateral": None # Not modeled
+        },
+        "verification": {
+            "cacVerified": sme_business.has_cac,
+            "videoVerified": sme_business.has_video,
+            "bankConnected": sme_business.mono_connected,
+            "documentsComplete": True, # Simplified
+            "lastVerified": sme_business.updated_at.isoformat()
+        },
+        "marketMetrics": { 
+            "profileViews": 0, # Requires tracking model
+            "lenderInterest": lender_interest_count,
+            "activeOffers": sme_business.active_offers_count,
+            "averageOfferAmount": sme_business.average_offer_rate or 0
+        }
+    }
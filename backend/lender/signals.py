@@ -1,7 +1,10 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from .models import LenderProfile
+from core.caching import invalidate_on_change
+from core.outbox import enqueue
+from .models import LenderProfile, SMEInterest, SearchFilter
+from . import notifications
 
 User = get_user_model()
 
@@ -11,6 +14,11 @@ def log_lender_profile_creation(sender, instance, created, **kwargs):
     Signal to handle lender profile creation
     """
     if created:
-        # You can add any post-creation logic here
-        # For example, send welcome email to lender
-        pass
\ No newline at end of file
+        # Queue the welcome email; it commits together with the profile's transaction
+        enqueue(notifications.welcome(instance))
+
+
+# Cached lender and marketplace data (core.caching)
+invalidate_on_change(LenderProfile, lambda profile: [f"lender:{profile.pk}"])
+invalidate_on_change(SMEInterest, lambda interest: [f"lender:{interest.lender_id}", f"sme:{interest.sme_business_id}"])
+invalidate_on_change(SearchFilter, lambda search_filter: [f"lender:{search_filter.lender_id}"])
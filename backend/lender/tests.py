@@ -4,6 +4,7 @@ from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth import get_user_model
 from sme.models import BusinessProfile
+from core.testing import QueryBudgetMixin
 from .models import LenderProfile, SMEInterest
 
 User = get_user_model()
@@ -152,3 +153,237 @@ class LenderAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('total_verified_smes', response.data)
         self.assertIn('my_interests', response.data)
+
+
+class ValuesSerializerTests(TestCase):
+    """The values() list path must render exactly what the ModelSerializers render"""
+
+    def setUp(self):
+        lender_user = User.objects.create_user(
+            username='values-lender@example.com', email='values-lender@example.com',
+            password='testpass123', user_type='lender'
+        )
+        self.lender_profile = LenderProfile.objects.create(
+            user=lender_user, lender_type='microfinance', company_name='Values Capital',
+            years_in_operation=2, risk_appetite=4, contact_person='Ada', preferred_industries=['retail'],
+            contact_email='values-lender@example.com', contact_phone='0800', office_address='Lagos'
+        )
+        for i, category in enumerate(['retail', '']):
+            sme_user = User.objects.create_user(
+                username=f'values-sme{i}@example.com', email=f'values-sme{i}@example.com',
+                password='testpass123', user_type='sme'
+            )
+            profile = BusinessProfile.objects.create(
+                user=sme_user, business_name=f'Values SME {i}', business_category=category,
+                monthly_revenue=1250000 if i == 0 else None, verification_status='verified',
+                pulse_score=80, profit_score=70
+            )
+            SMEInterest.objects.create(lender=self.lender_profile, sme_business=profile, status='interested')
+
+    def test_verified_sme_shape_matches(self):
+        from .serializers import VerifiedSMESerializer, VerifiedSMEValuesSerializer
+        queryset = BusinessProfile.objects.order_by('id')
+        expected = VerifiedSMESerializer(queryset, many=True).data
+        with self.assertNumQueries(1):
+            actual = VerifiedSMEValuesSerializer.many(VerifiedSMEValuesSerializer.values(queryset))
+        self.assertEqual(actual, expected)
+
+    def test_sme_interest_shape_matches(self):
+        from .serializers import SMEInterestSerializer, SMEInterestValuesSerializer
+        queryset = SMEInterest.objects.order_by('id')
+        expected = SMEInterestSerializer(queryset, many=True).data
+        with self.assertNumQueries(1):
+            actual = SMEInterestValuesSerializer.many(SMEInterestValuesSerializer.values(queryset))
+        self.assertEqual(actual, expected)
+
+
+class LenderDashboardTests(APITestCase):
+    """Portfolio stats are one aggregate per table; marketplace stats come from a shared snapshot"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='dash-lender@example.com', email='dash-lender@example.com',
+            password='testpass123', user_type='lender'
+        )
+        self.lender_profile = LenderProfile.objects.create(
+            user=self.user, lender_type='bank', company_name='Dash Capital', years_in_operation=5,
+            risk_appetite=5, contact_person='Ada', contact_email='dash-lender@example.com',
+            contact_phone='0800', office_address='Lagos'
+        )
+        sme_user = User.objects.create_user(
+            username='dash-sme@example.com', email='dash-sme@example.com',
+            password='testpass123', user_type='sme'
+        )
+        self.sme_profile = BusinessProfile.objects.create(
+            user=sme_user, business_name='Dash SME', verification_status='verified',
+            pulse_score=90, profit_score=60
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def _loan(self, status, amount, rate):
+        from escrow.models import LoanApplication
+        return LoanApplication.objects.create(
+            sme_business=self.sme_profile, lender=self.lender_profile, loan_amount=amount,
+            interest_rate=rate, negotiated_rate=rate, tenure_months=6, purpose='Stock', status=status
+        )
+
+    def test_portfolio_and_default_rate(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from escrow.models import RepaymentSchedule
+        today = timezone.now().date()
+        late = self._loan('active', 100000, 10)
+        on_time = self._loan('active', 50000, 20)
+        self._loan('completed', 25000, 15)
+        self._loan('submitted', 99999, 30)
+        for loan, due_date in [(late, today - timedelta(days=3)), (on_time, today + timedelta(days=10))]:
+            RepaymentSchedule.objects.create(
+                loan_application=loan, installment_number=1, due_date=due_date,
+                principal_amount=1000, interest_amount=100, total_amount=1100
+            )
+
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('lender-dashboard'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        portfolio = response.data['data']['portfolio']
+        self.assertEqual(portfolio['totalInvestments'], 3)
+        self.assertEqual(portfolio['activeInvestments'], 2)
+        self.assertEqual(portfolio['totalAmount'], 175000)
+        self.assertEqual(portfolio['defaultRate'], 50.0)
+        self.assertEqual(response.data['data']['marketplaceStats']['totalVerifiedSMEs'], 1)
+
+        # Second request reuses the marketplace snapshot and the cached portfolio
+        with self.assertNumQueries(1):
+            self.client.get(reverse('lender-dashboard'))
+
+        # A new loan for this lender invalidates its portfolio once committed
+        with self.captureOnCommitCallbacks(execute=True):
+            self._loan('active', 10000, 10)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('lender-dashboard'))
+        self.assertEqual(response.data['data']['portfolio']['totalInvestments'], 4)
+
+
+class MarketplaceDetailTests(APITestCase):
+    """Marketplace detail reuses the SME profile-status loader"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='detail-lender@example.com', email='detail-lender@example.com',
+            password='testpass123', user_type='lender'
+        )
+        self.lender_profile = LenderProfile.objects.create(
+            user=self.user, lender_type='bank', company_name='Detail Capital', years_in_operation=5,
+            risk_appetite=5, contact_person='Ada', contact_email='detail-lender@example.com',
+            contact_phone='0800', office_address='Lagos'
+        )
+        sme_user = User.objects.create_user(
+            username='detail-sme@example.com', email='detail-sme@example.com',
+            password='testpass123', user_type='sme'
+        )
+        self.sme_profile = BusinessProfile.objects.create(
+            user=sme_user, business_name='Detail SME', verification_status='verified',
+            pulse_score=90, profit_score=60
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_marketplace_detail(self):
+        url = reverse('marketplace-detail', kwargs={'pk': self.sme_profile.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data['data']
+        self.assertEqual(data['basicInfo']['businessName'], 'Detail SME')
+        self.assertFalse(data['verification']['cacVerified'])
+        self.assertEqual(data['marketMetrics']['activeOffers'], 0)
+        self.assertEqual(data['marketMetrics']['lenderInterest'], 1)
+
+
+class MarketplaceQueryBudgetTests(QueryBudgetMixin, APITestCase):
+    """Marketplace and interest endpoints run a fixed number of queries however many SMEs are listed"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='budget-lender@example.com', email='budget-lender@example.com',
+            password='testpass123', user_type='lender'
+        )
+        self.lender_profile = LenderProfile.objects.create(
+            user=self.user, lender_type='bank', company_name='Budget Capital', years_in_operation=5,
+            risk_appetite=5, contact_person='Ada', contact_email='budget-lender@example.com',
+            contact_phone='0800', office_address='Lagos'
+        )
+        self.smes = []
+        for number in range(6):
+            sme_user = User.objects.create_user(
+                username=f'budget-sme{number}@example.com', email=f'budget-sme{number}@example.com',
+                password='testpass123', user_type='sme'
+            )
+            self.smes.append(BusinessProfile.objects.create(
+                user=sme_user, business_name=f'Budget SME {number}', verification_status='verified',
+                pulse_score=80 + number, profit_score=60
+            ))
+        self.client.force_authenticate(user=self.user)
+
+    def test_marketplace_list_tracks_views_in_bulk(self):
+        # Already viewed: must not be duplicated or re-inserted
+        SMEInterest.objects.create(lender=self.lender_profile, sme_business=self.smes[0], status='interested')
+
+        response = self.assertWithinQueryBudget(self.client.get(reverse('marketplace-list')))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        interests = SMEInterest.objects.filter(lender=self.lender_profile)
+        self.assertEqual(interests.count(), 6)
+        self.assertEqual(interests.get(sme_business=self.smes[0]).status, 'interested')
+
+        # Nothing new to track: profile, unseen SMEs, count and page
+        with self.assertMaxQueries(4):
+            self.client.get(reverse('marketplace-list'))
+
+    def test_interest_detail_within_budget(self):
+        from users.tokens import ProfileRefreshToken
+
+        interest = SMEInterest.objects.create(lender=self.lender_profile, sme_business=self.smes[1])
+        self.client.force_authenticate(user=None)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {ProfileRefreshToken.for_user(self.user).access_token}')
+        response = self.assertWithinQueryBudget(self.client.get(f'/api/lender/interests/{interest.id}/'))
+        self.assertEqual(response.data['sme_business']['user']['email'], 'budget-sme1@example.com')
+        response = self.assertWithinQueryBudget(
+            self.client.post(f'/api/lender/interests/{interest.id}/update_status/', {'status': 'contacted'}, format='json')
+        )
+        self.assertEqual(response.data['status'], 'contacted')
+
+
+class AdminAnalyticsTests(APITestCase):
+    """All-time totals count accounts by user type and loans that are active or completed"""
+
+    def test_totals_keep_their_meaning_without_a_rollup(self):
+        from decimal import Decimal
+        from django.utils import timezone
+        from escrow.models import LoanApplication
+
+        admin = User.objects.create_user(
+            username='admin@example.com', email='admin@example.com', password='testpass123', user_type='lender', is_staff=True
+        )
+        User.objects.create_user(username='bare@example.com', email='bare@example.com', password='testpass123', user_type='sme')
+        sme_user = User.objects.create_user(
+            username='analytics-sme@example.com', email='analytics-sme@example.com', password='testpass123', user_type='sme'
+        )
+        business = BusinessProfile.objects.create(user=sme_user, business_name='Analytics Ltd')
+        for loan_status, disbursed in (('active', True), ('completed', True), ('defaulted', True), ('approved', False)):
+            LoanApplication.objects.create(
+                sme_business=business, loan_amount=Decimal('10000.00'), interest_rate=12, tenure_months=6,
+                purpose='Stock', status=loan_status, disbursement_date=timezone.now() if disbursed else None
+            )
+
+        self.client.force_authenticate(user=admin)
+        data = self.client.get('/api/admin/analytics/overview').data['data']
+        # SMEs without a profile still count; a defaulted loan is no longer a successful match
+        self.assertEqual(data['userStats']['totalSMEs'], 2)
+        self.assertEqual(data['userStats']['totalLenders'], 1)
+        self.assertEqual(data['marketplaceStats']['successfulMatches'], 2)
+        self.assertEqual(data['marketplaceStats']['totalFundingAmount'], Decimal('20000.00'))
+        self.assertEqual(data['marketplaceStats']['averageOfferAmount'], Decimal('10000.00'))
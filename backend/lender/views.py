@@ -5,7 +5,11 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from django.db.models import Q, Sum, Avg, Count
 from django.shortcuts import get_object_or_404
-from datetime import datetime, timedelta
+from django.http import Http404
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from datetime import date, datetime, timedelta
+from django.utils import timezone
+from django.db import transaction as db_transaction
 from .models import LenderProfile, SMEInterest, SearchFilter
 # --- UPDATED IMPORTS ---
 from .serializers import (
@@ -13,11 +17,16 @@ from .serializers import (
     VerifiedSMESerializer, SMEDetailSerializer,
     SMEInterestSerializer, SMEInterestCreateSerializer,
     SearchFilterSerializer, SearchFilterCreateSerializer,
-    MarketplaceFilterSerializer
+    MarketplaceFilterSerializer,
+    VerifiedSMEValuesSerializer, SMEInterestValuesSerializer
 )
 from sme.models import BusinessProfile
+from escrow.overdue import latest_aging
 from escrow.models import LoanApplication, LoanNegotiation # Import real models
 from users.models import User # Import User for admin stats
+from .services import get_portfolio_stats, get_marketplace_snapshot, marketplace_sme_detail
+from core.analytics import stats_for_range
+from core.caching import cache_response, invalidate
 from rest_framework import serializers 
 
 class LenderProfileViewSet(viewsets.ModelViewSet):
@@ -31,13 +40,17 @@ class LenderProfileViewSet(viewsets.ModelViewSet):
             return LenderProfileCreateSerializer
         return LenderProfileSerializer
     
+    @db_transaction.atomic
     def perform_create(self, serializer):
+        # Atomic so the profile and its welcome email outbox row commit together
         serializer.save(user=self.request.user)
 
 class MarketplaceViewSet(viewsets.GenericViewSet):
     """GET /lender/marketplace - Get list of verified SMEs for lenders"""
     permission_classes = [IsAuthenticated]
     serializer_class = VerifiedSMESerializer
+    # Including the JWT user lookup; a first view also tracks the interest
+    query_budget = {'list': 6, 'retrieve': 6}
 
     def get_queryset(self):
         # Base queryset: verified SMEs with a decent pulse score
@@ -48,7 +61,7 @@ class MarketplaceViewSet(viewsets.GenericViewSet):
     
     def list(self, request):
         try:
-            lender_profile = LenderProfile.objects.get(user=request.user)
+            lender_profile = request.profiles.get_lender()
         except LenderProfile.DoesNotExist:
             return Response({
                 "success": False,
@@ -71,26 +84,29 @@ class MarketplaceViewSet(viewsets.GenericViewSet):
         if min_profit_score:
             queryset = queryset.filter(profit_score__gte=int(min_profit_score))
         
-        # Track views
-        for sme in queryset:
-            SMEInterest.objects.get_or_create(
-                lender=lender_profile,
-                sme_business=sme,
-                defaults={'status': 'viewed'}
+        # Track views: one query for the SMEs this lender has not seen yet, one insert for them
+        unseen_ids = list(
+            queryset.exclude(lender_interests__lender=lender_profile).order_by().values_list('id', flat=True)
+        )
+        if unseen_ids:
+            SMEInterest.objects.bulk_create(
+                [SMEInterest(lender=lender_profile, sme_business_id=sme_id, status='viewed') for sme_id in unseen_ids],
+                ignore_conflicts=True  # another request may have tracked the same view
             )
+            # bulk_create skips post_save, which invalidates the cached interest counts
+            invalidate(f"lender:{lender_profile.pk}", *(f"sme:{sme_id}" for sme_id in unseen_ids))
         
         # --- REMOVED MOCKED RESPONSE ---
-        # Paginate the queryset
-        page = self.paginate_queryset(queryset)
+        # Paginate the queryset (values() fast path, same shape as VerifiedSMESerializer)
+        rows = VerifiedSMEValuesSerializer.values(queryset)
+        page = self.paginate_queryset(rows)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            return self.get_paginated_response(VerifiedSMEValuesSerializer.many(page))
 
-        serializer = self.get_serializer(queryset, many=True)
         return Response({
             "success": True,
             "data": {
-                "smes": serializer.data,
+                "smes": VerifiedSMEValuesSerializer.many(rows),
                 "pagination": None # Add pagination class to REST_FRAMEWORK settings for this
             }
         })
@@ -98,7 +114,7 @@ class MarketplaceViewSet(viewsets.GenericViewSet):
     def retrieve(self, request, pk=None):
         """GET /lender/marketplace/:smeId - Get detailed SME profile"""
         try:
-            lender_profile = LenderProfile.objects.get(user=request.user)
+            lender_profile = request.profiles.get_lender()
         except LenderProfile.DoesNotExist:
             return Response({
                 "success": False,
@@ -106,88 +122,44 @@ class MarketplaceViewSet(viewsets.GenericViewSet):
             }, status=status.HTTP_404_NOT_FOUND)
         
         try:
-            sme_business = BusinessProfile.objects.get(
-                id=pk, 
-                verification_status='verified', 
-                pulse_score__gte=75
-            )
+            detail = marketplace_sme_detail(pk)
         except BusinessProfile.DoesNotExist:
             return Response({
                 "success": False,
                 "message": "SME not found or not verified"
             }, status=status.HTTP_404_NOT_FOUND)
         
-        # Track interest
-        SMEInterest.objects.get_or_create(
+        # Track interest; a first view adds one to the SME's interest count (and invalidates the cached detail)
+        _, created = SMEInterest.objects.get_or_create(
             lender=lender_profile,
-            sme_business=sme_business,
+            sme_business_id=detail["basicInfo"]["id"],
             defaults={'status': 'viewed'}
         )
-        
-        # --- MOCKED DATA REMOVED ---
-        # Get real marketplace metrics
-        offers = LoanNegotiation.objects.filter(loan_application__sme_business=sme_business)
-        active_offers_count = offers.filter(status='pending').count()
-        lender_interest_count = SMEInterest.objects.filter(sme_business=sme_business).count()
-        avg_offer = offers.aggregate(avg=Avg('proposed_rate'))['avg'] # Just an example
+        if created:
+            detail["marketMetrics"] = {**detail["marketMetrics"], "lenderInterest": detail["marketMetrics"]["lenderInterest"] + 1}
 
         return Response({
             "success": True,
-            "data": {
-                "basicInfo": {
-                    "id": str(sme_business.id),
-                    "businessName": sme_business.business_name,
-                    "industry": sme_business.industry,
-                    "businessType": sme_business.business_category,
-                    "yearEstablished": sme_business.year_established,
-                    "employeeCount": sme_business.number_of_employees,
-                    "location": sme_business.business_address,
-                    "businessDescription": sme_business.business_description,
-                    "targetMarket": sme_business.target_market,
-                    "competitiveAdvantage": sme_business.competitive_advantage
-                },
-                "scores": {
-                    "pulseScore": sme_business.pulse_score,
-                    "profitScore": sme_business.profit_score,
-                    "riskLevel": "low" if sme_business.pulse_score > 80 else "medium", # Simple logic
-                    "verificationStatus": sme_business.verification_status
-                },
-                "financialHighlights": { 
-                    "monthlyRevenue": sme_business.monthly_revenue,
-                    "profitMargin": None, # Cannot calculate without expenses
-                    "growthRate": None, # Requires time-series data
-                    "cashFlowStatus": None, # Requires full analysis
-                    "debtToIncomeRatio": None # Requires debt data
-                },
-                "fundingRequest": { 
-                    "amount": sme_business.funding_amount,
-                    "purpose": sme_business.funding_purpose,
-                    "expectedROI": None, # Not modeled
-                    "paybackPeriod": None, # Not modeled
-                    "collateral": None # Not modeled
-                },
-                "verification": {
-                    "cacVerified": CACDocument.objects.filter(user=sme_business.user).exists(),
-                    "videoVerified": BusinessVideo.objects.filter(user=sme_business.user).exists(),
-                    "bankConnected": sme_business.mono_connected,
-                    "documentsComplete": True, # Simplified
-                    "lastVerified": sme_business.updated_at.isoformat()
-                },
-                "marketMetrics": { 
-                    "profileViews": 0, # Requires tracking model
-                    "lenderInterest": lender_interest_count,
-                    "activeOffers": active_offers_count,
-                    "averageOfferAmount": avg_offer or 0
-                }
-            }
+            "data": detail
         })
 
+def token_lender_id(request):
+    """Caller's LenderProfile id from the token claims (404 if they have none)"""
+    if request.user.user_type != 'lender' or request.user.profile_id is None:
+        raise Http404("Lender profile not found.")
+    return request.user.profile_id
+
 class SMEInterestViewSet(viewsets.ModelViewSet):
+    # Only the lender id is needed, so skip loading the User and LenderProfile rows
+    authentication_classes = [JWTStatelessUserAuthentication]
     permission_classes = [IsAuthenticated]
+    query_budget = 3
     
     def get_queryset(self):
-        lender_profile = get_object_or_404(LenderProfile, user=self.request.user)
-        return SMEInterest.objects.filter(lender=lender_profile)
+        # SMEInterestSerializer nests both profiles with their users (list uses values() and ignores this)
+        return SMEInterest.objects.filter(
+            lender_id=token_lender_id(self.request)
+        ).select_related('lender__user', 'sme_business__user')
     
     def get_serializer_class(self):
         if self.action in ['create', 'update']:
@@ -195,8 +167,15 @@ class SMEInterestViewSet(viewsets.ModelViewSet):
         return SMEInterestSerializer
     
     def perform_create(self, serializer):
-        lender_profile = get_object_or_404(LenderProfile, user=self.request.user)
-        serializer.save(lender=lender_profile)
+        serializer.save(lender_id=token_lender_id(self.request))
+
+    def list(self, request, *args, **kwargs):
+        # values() fast path, same shape as SMEInterestSerializer
+        rows = SMEInterestValuesSerializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(SMEInterestValuesSerializer.many(page))
+        return Response(SMEInterestValuesSerializer.many(rows))
     
     @action(detail=True, methods=['post'])
     def update_status(self, request, pk=None):
@@ -215,20 +194,23 @@ class SMEInterestViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 class SearchFilterViewSet(viewsets.ModelViewSet):
+    authentication_classes = [JWTStatelessUserAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        lender_profile = get_object_or_404(LenderProfile, user=self.request.user)
-        return SearchFilter.objects.filter(lender=lender_profile)
+        return SearchFilter.objects.filter(lender_id=token_lender_id(self.request))
     
     def get_serializer_class(self):
         if self.action in ['create', 'update']:
             return SearchFilterCreateSerializer
         return SearchFilterSerializer
+
+    @cache_response(lambda request, *args, **kwargs: [f"lender:{token_lender_id(request)}"])
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
     
     def perform_create(self, serializer):
-        lender_profile = get_object_or_404(LenderProfile, user=self.request.user)
-        serializer.save(lender=lender_profile)
+        serializer.save(lender_id=token_lender_id(self.request))
 
 class LenderDashboardView(APIView):
     """GET /lender/dashboard - Get lender dashboard data"""
@@ -237,7 +219,7 @@ class LenderDashboardView(APIView):
 
     def get(self, request):
         try:
-            lender_profile = LenderProfile.objects.get(user=request.user)
+            lender_profile = request.profiles.get_lender()
         except LenderProfile.DoesNotExist:
             return Response({
                 "success": False,
@@ -245,32 +227,9 @@ class LenderDashboardView(APIView):
             }, status=status.HTTP_404_NOT_FOUND)
         
         # --- MOCKED DATA REMOVED ---
-        
-        # Real Portfolio Stats
-        funded_loans = LoanApplication.objects.filter(lender=lender_profile, status__in=['active', 'completed'])
-        active_loans = LoanApplication.objects.filter(lender=lender_profile, status='active')
-        
-        portfolio_stats = funded_loans.aggregate(
-            totalInvestments=Count('id'),
-            totalAmount=Sum('loan_amount'),
-            averageROI=Avg('negotiated_rate') # Use negotiated_rate
-        )
-        
-        # Real Marketplace Stats
-        marketplace_stats = BusinessProfile.objects.filter(
-            verification_status='verified', 
-            pulse_score__gte=75
-        ).aggregate(
-            totalVerifiedSMEs=Count('id'),
-            averagePulseScore=Avg('pulse_score'),
-            averageProfitScore=Avg('profit_score')
-        )
-        new_smes_this_week = BusinessProfile.objects.filter(
-            verification_status='verified',
-            created_at__gte=datetime.now() - timedelta(days=7)
-        ).count()
+        portfolio_stats = get_portfolio_stats(lender_profile)
+        marketplace_stats = get_marketplace_snapshot() # Shared, periodically refreshed
 
-        
         return Response({
             "success": True,
             "data": {
@@ -280,19 +239,8 @@ class LenderDashboardView(APIView):
                     "organizationName": lender_profile.company_name,
                     "email": request.user.email
                 },
-                "portfolio": {
-                    "totalInvestments": portfolio_stats['totalInvestments'] or 0,
-                    "totalAmount": portfolio_stats['totalAmount'] or 0,
-                    "activeInvestments": active_loans.count(),
-                    "averageROI": portfolio_stats['averageROI'] or 0,
-                    "defaultRate": 0 # Needs real default tracking logic
-                },
-                "marketplaceStats": {
-                    "totalVerifiedSMEs": marketplace_stats['totalVerifiedSMEs'] or 0,
-                    "newSMEsThisWeek": new_smes_this_week,
-                    "averagePulseScore": marketplace_stats['averagePulseScore'] or 0,
-                    "averageProfitScore": marketplace_stats['averageProfitScore'] or 0
-                },
+                "portfolio": portfolio_stats,
+                "marketplaceStats": marketplace_stats,
                 "recentActivity": [], # Removed mock
                 "recommendations": [] # Removed mock
             }
@@ -314,37 +262,56 @@ class AdminAnalyticsView(APIView):
                 "message": "Admin access required"
             }, status=status.HTTP_403_FORBIDDEN)
         
-        # --- MOCKED DATA REMOVED ---
-        
-        # Real User Stats
-        total_smes = User.objects.filter(user_type='sme').count()
-        total_lenders = User.objects.filter(user_type='lender').count()
-        verified_smes = BusinessProfile.objects.filter(verification_status='verified').count()
-        
-        # Real Verification Stats
+        # Growth window: ?from=YYYY-MM-DD&to=YYYY-MM-DD, defaults to the last 30 days
+        try:
+            end = date.fromisoformat(request.query_params['to']) if 'to' in request.query_params else timezone.now().date()
+            start = date.fromisoformat(request.query_params['from']) if 'from' in request.query_params else end - timedelta(days=29)
+        except ValueError:
+            return Response({
+                "success": False,
+                "message": "Dates must be in YYYY-MM-DD format"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if start > end:
+            return Response({
+                "success": False,
+                "message": "'from' must not be after 'to'"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Growth over the window comes from the daily rollup (see `manage.py rollup_platform_stats`)
+        growth = stats_for_range(start, end)
+
+        # All-time totals keep their original meaning (accounts by user type, loans now active
+        # or completed), which the rollup's event counts cannot express: two indexed aggregates
+        user_stats = User.objects.aggregate(
+            smes=Count('id', filter=Q(user_type='sme')),
+            lenders=Count('id', filter=Q(user_type='lender')),
+        )
+        deal_stats = LoanApplication.objects.filter(status__in=['active', 'completed']).aggregate(
+            matches=Count('id'),
+            funding=Sum('loan_amount'),
+        )
+
+        # Score averages and the verification funnel still need the live table: one aggregate
         verification_stats = BusinessProfile.objects.aggregate(
             averagePulseScore=Avg('pulse_score'),
             averageProfitScore=Avg('profit_score'),
+            verified=Count('id', filter=Q(verification_status='verified')),
+            processed=Count('id', filter=Q(verification_status__in=['verified', 'rejected'])),
         )
-        total_verified = BusinessProfile.objects.filter(verification_status='verified').count()
-        total_processed = BusinessProfile.objects.filter(verification_status__in=['verified', 'rejected']).count()
-        success_rate = (total_verified / total_processed * 100) if total_processed > 0 else 0
-        
-        # Real Marketplace Stats
-        marketplace_stats = LoanApplication.objects.aggregate(
-            successfulMatches=Count('id', filter=Q(status__in=['active', 'completed'])),
-            totalFundingAmount=Sum('loan_amount', filter=Q(status__in=['active', 'completed']))
-        )
+        total_processed = verification_stats['processed']
+        success_rate = (verification_stats['verified'] / total_processed * 100) if total_processed > 0 else 0
         total_offers = LoanNegotiation.objects.count()
-        
+
+        deals = deal_stats['matches']
+        funding = deal_stats['funding'] or 0
         return Response({
             "success": True,
             "data": {
                 "userStats": { 
-                    "totalSMEs": total_smes,
-                    "totalLenders": total_lenders,
-                    "verifiedSMEs": verified_smes,
-                    "activeLenders": total_lenders # Simplified
+                    "totalSMEs": user_stats['smes'],
+                    "totalLenders": user_stats['lenders'],
+                    "verifiedSMEs": verification_stats['verified'],
+                    "activeLenders": user_stats['lenders'] # Simplified
                 },
                 "verificationStats": {
                     "averagePulseScore": verification_stats['averagePulseScore'] or 0,
@@ -354,15 +321,22 @@ class AdminAnalyticsView(APIView):
                 },
                 "marketplaceStats": { 
                     "totalOffers": total_offers,
-                    "successfulMatches": marketplace_stats['successfulMatches'] or 0,
-                    "totalFundingAmount": marketplace_stats['totalFundingAmount'] or 0,
-                    "averageOfferAmount": 0 # Requires more logic
+                    "successfulMatches": deals,
+                    "totalFundingAmount": funding,
+                    "averageOfferAmount": (funding / deals) if deals else 0
                 },
-                "monthlyGrowth": { # Cannot be calculated without time-series
-                    "newSMEs": 0,
-                    "newLenders": 0,
-                    "completedDeals": 0,
-                    "platformRevenue": 0
-                }
+                # Events inside the window: profiles created, verifications, loans disbursed, fees collected
+                "monthlyGrowth": {
+                    "from": start.isoformat(),
+                    "to": end.isoformat(),
+                    "newSMEs": growth['new_smes'],
+                    "newLenders": growth['new_lenders'],
+                    "verifications": growth['verifications'],
+                    "completedDeals": growth['deals_completed'],
+                    "fundingVolume": growth['funding_volume'],
+                    "platformRevenue": growth['platform_fees']
+                },
+                # Days-past-due buckets from the last `manage.py sweep_overdue_repayments` run
+                "repaymentAging": latest_aging()
             }
-        })
\ No newline at end of file
+        })
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SmeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sme'
+
+    def ready(self):
+        import sme.signals
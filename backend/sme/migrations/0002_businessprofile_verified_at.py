@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:54
+
+from django.db import migrations, models
+
+
+def backfill_verified_at(apps, schema_editor):
+    # Best available timestamp for profiles verified before the column existed
+    BusinessProfile = apps.get_model('sme', 'BusinessProfile')
+    BusinessProfile.objects.filter(verification_status='verified', verified_at__isnull=True).update(
+        verified_at=models.F('updated_at')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sme', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='businessprofile',
+            name='verified_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_verified_at, migrations.RunPython.noop),
+    ]
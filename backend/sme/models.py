@@ -60,6 +60,7 @@ class BusinessProfile(models.Model):
     pulse_score = models.IntegerField(default=0)
     profit_score = models.IntegerField(default=0)
     verification_status = models.CharField(max_length=20, choices=VERIFICATION_STATUS, default='pending')
+    verified_at = models.DateTimeField(null=True, blank=True, db_index=True) # Set when verification_status becomes 'verified'
     mono_connected = models.BooleanField(default=False)
     
     # Legacy fields from original model
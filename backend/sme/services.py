@@ -0,0 +1,38 @@
+from django.db.models import Exists, OuterRef, Subquery, Count, Avg, IntegerField
+from django.db.models.functions import Coalesce
+from .models import BusinessProfile, CACDocument, BusinessVideo
+
+
+def _offer_stat(offers, aggregate, output_field=None):
+    """Correlated per-profile aggregate over that SME's loan offers."""
+    return Subquery(
+        offers.order_by().values('loan_application__sme_business').annotate(value=aggregate).values('value'),
+        output_field=output_field
+    )
+
+
+def profiles_with_status():
+    """
+    BusinessProfile queryset annotated with everything the SME status views show:
+    has_cac, has_video, active_offers_count, lender_interest_count, average_offer_rate.
+    """
+    from escrow.models import LoanNegotiation
+
+    offers = LoanNegotiation.objects.filter(loan_application__sme_business=OuterRef('pk'))
+    return BusinessProfile.objects.annotate(
+        has_cac=Exists(CACDocument.objects.filter(user=OuterRef('user'))),
+        has_video=Exists(BusinessVideo.objects.filter(user=OuterRef('user'))),
+        active_offers_count=Coalesce(
+            _offer_stat(offers.filter(status='pending'), Count('pk'), IntegerField()), 0
+        ),
+        # A simple proxy for "interest": distinct users who made offers
+        lender_interest_count=Coalesce(
+            _offer_stat(offers, Count('user', distinct=True), IntegerField()), 0
+        ),
+        average_offer_rate=_offer_stat(offers, Avg('proposed_rate')),
+    )
+
+
+def load_profile_status(**lookup):
+    """Fetch one profile with its status annotations in a single query (raises BusinessProfile.DoesNotExist)."""
+    return profiles_with_status().get(**lookup)
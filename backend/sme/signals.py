@@ -0,0 +1,14 @@
+from core.caching import invalidate_on_change
+from .models import BusinessProfile, CACDocument, BusinessVideo, Score
+
+
+def _owner_tags(document):
+    """Documents and scores hang off the user; tag the business profile they feed into."""
+    profile_id = BusinessProfile.objects.filter(user_id=document.user_id).values_list('id', flat=True).first()
+    return [f"sme:{profile_id}"] if profile_id else []
+
+
+# Cached SME data (core.caching), e.g. the marketplace detail lenders see
+invalidate_on_change(BusinessProfile, lambda profile: [f"sme:{profile.pk}"])
+for model in (CACDocument, BusinessVideo, Score):
+    invalidate_on_change(model, _owner_tags)
@@ -86,3 +86,55 @@ class SMEAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         # Should create a score object if it doesn't exist
         self.assertEqual(Score.objects.count(), 1)
+
+
+class ProfileStatusQueryTests(APITestCase):
+    """Profile, document flags and offer counts load in a single query"""
+
+    def setUp(self):
+        from decimal import Decimal
+        from escrow.models import LoanApplication, LoanNegotiation
+        self.user = User.objects.create_user(
+            username='status-sme@example.com', email='status-sme@example.com',
+            password='testpass123', user_type='sme'
+        )
+        self.profile = BusinessProfile.objects.create(
+            user=self.user, business_name='Status SME', verification_status='verified',
+            pulse_score=88, profit_score=70, business_model='retail'
+        )
+        CACDocument.objects.create(user=self.user, cac_file='cac_files/status.pdf')
+        loan = LoanApplication.objects.create(
+            sme_business=self.profile, loan_amount=Decimal('50000'), interest_rate=Decimal('12'),
+            tenure_months=6, purpose='Stock', status='under_review'
+        )
+        for i, offer_status in enumerate(['pending', 'pending', 'rejected']):
+            lender = User.objects.create_user(
+                username=f'status-lender{i}@example.com', email=f'status-lender{i}@example.com',
+                password='testpass123', user_type='lender'
+            )
+            LoanNegotiation.objects.create(
+                loan_application=loan, user=lender, proposed_rate=Decimal('10') + i, status=offer_status
+            )
+        self.client.force_authenticate(user=self.user)
+
+    def test_dashboard_single_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('sme-dashboard'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data['data']
+        self.assertTrue(data['verificationSteps']['cac']['completed'])
+        self.assertFalse(data['verificationSteps']['video']['completed'])
+        self.assertEqual(data['marketplaceStats']['activeOffers'], 2)
+        self.assertEqual(data['marketplaceStats']['lenderInterest'], 3)
+
+    def test_profile_single_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('sme-profile'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['data']['verification']['cacVerified'])
+        self.assertFalse(response.data['data']['verification']['videoVerified'])
+
+    def test_missing_profile(self):
+        self.profile.delete()
+        response = self.client.get(reverse('sme-dashboard'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -7,6 +7,7 @@ from django.shortcuts import get_object_or_404
 import requests
 from django.conf import settings
 from datetime import datetime
+from django.utils import timezone
 # --- UPDATED IMPORTS ---
 from .models import BusinessProfile, CACDocument, BusinessVideo
 from .serializers import (
@@ -21,6 +22,7 @@ from .serializers import (
     # SMEOfferResponseSerializer # Removed
 )
 from rest_framework import serializers
+from .services import load_profile_status
 
 class BusinessProfileView(APIView):
     """
@@ -70,69 +72,9 @@ class BusinessProfileView(APIView):
     def get(self, request):
         """GET /sme/profile - Get complete SME profile"""
         try:
-            profile = BusinessProfile.objects.get(user=request.user)
-            has_cac = CACDocument.objects.filter(user=request.user).exists()
-            has_video = BusinessVideo.objects.filter(user=request.user).exists()
-            
-            # --- REMOVED MOCKED FINANCIAL DATA ---
-            # Real data is fetched from the profile model
-            
-            return Response({
-                "success": True,
-                "data": {
-                    "businessInfo": {
-                        "businessName": profile.business_name,
-                        "businessType": profile.business_category,
-                        "industry": profile.industry,
-                        "yearEstablished": profile.year_established,
-                        "employeeCount": profile.number_of_employees,
-                        "monthlyRevenue": profile.monthly_revenue,
-                        "businessAddress": profile.business_address,
-                        "state": profile.state,
-                        "lga": profile.lga,
-                        "businessDescription": profile.business_description
-                    },
-                    "verification": {
-                        "pulseScore": profile.pulse_score,
-                        "profitScore": profile.profit_score,
-                        "verificationStatus": profile.verification_status,
-                        "cacVerified": has_cac,
-                        "videoVerified": has_video,
-                        "bankConnected": profile.mono_connected
-                    },
-                    # --- REMOVED MOCKED FINANCIAL DATA ---
-                    # This data is already in 'businessInfo'
-                    "financialData": {
-                        "monthlyRevenue": profile.monthly_revenue,
-                        "monthlyExpenses": None, # Cannot be known without real analysis
-                        "profitMargin": None,
-                        "cashFlow": None,
-                        "growthRate": None
-                    },
-                    "documents": {
-                        "cacCertificate": {
-                            "fileName": "cac_certificate.pdf" if has_cac else None, # Simplified
-                            "verified": has_cac
-                        },
-                        "businessVideo": {
-                            "fileName": "business_video.mp4" if has_video else None, # Simplified
-                            "verified": has_video
-                        }
-                    }
-                }
-            })
-        except BusinessProfile.DoesNotExist:
-            return Response({
-                "success": False,
-                "message": "Profile not found"
-            }, status=status.HTTP_404_NOT_FOUND)
-        
-    def get(self, request):
-        """GET /sme/profile - Get complete SME profile"""
-        try:
-            profile = BusinessProfile.objects.get(user=request.user)
-            has_cac = CACDocument.objects.filter(user=request.user).exists()
-            has_video = BusinessVideo.objects.filter(user=request.user).exists()
+            profile = load_profile_status(user=request.user)
+            has_cac = profile.has_cac
+            has_video = profile.has_video
             
             # --- REMOVED MOCKED FINANCIAL DATA ---
             # Real data is fetched from the profile model
@@ -189,6 +131,7 @@ class BusinessProfileView(APIView):
 
 class CACUploadView(APIView):
     """POST /sme/upload/cac - Upload CAC certificate"""
+    throttle_scope = 'upload'
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
     serializer_class = CACUploadSerializer
@@ -246,7 +189,7 @@ class VerifyCACView(APIView):
         
         # Save the RC number to the profile
         try:
-            profile = BusinessProfile.objects.get(user=request.user)
+            profile = request.profiles.get_business()
             profile.rc_number = rc_number
             profile.save()
         except BusinessProfile.DoesNotExist:
@@ -288,7 +231,7 @@ class BusinessTypeView(APIView):
         serializer.is_valid(raise_exception=True)
         
         try:
-            profile = BusinessProfile.objects.get(user=request.user)
+            profile = request.profiles.get_business()
             
             # Update profile with validated data
             profile.has_physical_location = serializer.validated_data.get('hasPhysicalLocation', profile.has_physical_location)
@@ -320,6 +263,7 @@ class BusinessTypeView(APIView):
 
 class VideoUploadView(APIView):
     """POST /sme/upload/video - Upload business video"""
+    throttle_scope = 'upload'
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
     serializer_class = VideoUploadSerializer
@@ -365,6 +309,7 @@ class VideoUploadView(APIView):
 
 class MonoConnectView(APIView):
     """POST /sme/mono/connect - Connect bank account via Mono"""
+    throttle_scope = 'ai'
     permission_classes = [IsAuthenticated]
     serializer_class = MonoConnectSerializer
 
@@ -386,7 +331,7 @@ class MonoConnectView(APIView):
             # as specified in the README.
             
             # Update user profile with bank connection and details
-            profile = BusinessProfile.objects.get(user=request.user)
+            profile = request.profiles.get_business()
             profile.mono_connected = True
             profile.bank_account_name = account_name
             profile.bank_account_number = data['accountNumber']
@@ -411,6 +356,8 @@ class MonoConnectView(APIView):
             if fail_reason:
                 profile.verification_status = 'rejected' # Use 'rejected' not 'failed'
             else:
+                if profile.verification_status != 'verified':
+                    profile.verified_at = timezone.now() # Feeds the daily verifications rollup
                 profile.verification_status = 'verified'
             profile.save()
             
@@ -449,24 +396,14 @@ class SMEDashboardView(APIView):
 
     def get(self, request):
         try:
-            profile = BusinessProfile.objects.get(user=request.user)
-            has_cac = CACDocument.objects.filter(user=request.user).exists()
-            has_video = BusinessVideo.objects.filter(user=request.user).exists()
+            # Profile, document flags and offer counts in one query
+            profile = load_profile_status(user=request.user)
+            has_cac = profile.has_cac
+            has_video = profile.has_video
             
             # --- MOCKED DATA REMOVED ---
-            
-            # Get real marketplace stats
-            # Note: This requires the 'escrow' app models
-            try:
-                from escrow.models import LoanNegotiation
-                offers = LoanNegotiation.objects.filter(loan_application__sme_business=profile)
-                active_offers_count = offers.filter(status='pending').count()
-                # A simple proxy for "interest"
-                lender_interest_count = offers.values('user').distinct().count()
-            except ImportError:
-                active_offers_count = 0
-                lender_interest_count = 0
-
+            active_offers_count = profile.active_offers_count
+            lender_interest_count = profile.lender_interest_count
             
             return Response({
                 "success": True,
@@ -0,0 +1,42 @@
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from users.onboarding import BulkOnboardingImporter, iter_rows
+
+
+class Command(BaseCommand):
+    help = "Bulk-register SMEs or lenders from a CSV or JSON-lines file; rejected rows are written as JSON lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_type', choices=['sme', 'lender'])
+        parser.add_argument('file', help="Path to the file, or - for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension")
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, help="Password hashing processes (default: one per CPU)")
+        parser.add_argument('--errors', help="Write rejected rows here instead of stdout")
+
+    def handle(self, *args, **options):
+        path = options['file']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        importer = BulkOnboardingImporter(
+            options['user_type'], chunk_size=options['chunk_size'], workers=options['workers']
+        )
+
+        try:
+            source = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f"Cannot open file: {e}")
+        output = open(options['errors'], 'w') if options['errors'] else self.stdout
+
+        try:
+            for error in importer.run(iter_rows(source, file_format)):
+                output.write(json.dumps(error) + '\n')
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if options['errors']:
+                output.close()
+
+        self.stderr.write(self.style.SUCCESS(
+            f"Import complete (created: {importer.counts['created']}, failed: {importer.counts['failed']})"
+        ))
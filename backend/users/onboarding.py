@@ -0,0 +1,163 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import django
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from core.outbox import enqueue
+from lender import notifications as lender_notifications
+from .models import User
+from .serializers import SmeRegisterSerializer, LenderRegisterSerializer
+
+# Rows use the same fields as the register endpoints
+REGISTER_SERIALIZERS = {
+    User.UserType.SME: SmeRegisterSerializer,
+    User.UserType.LENDER: LenderRegisterSerializer,
+}
+
+
+def iter_rows(stream, file_format='csv'):
+    """
+    Yield (line, row) for each record of a CSV or JSON-lines file, reading one
+    line at a time. Malformed JSON lines yield (line, None). In CSV files
+    investmentFocus is a semicolon-separated list.
+    """
+    if file_format == 'jsonl':
+        for line, text in enumerate(stream, start=1):
+            text = text.strip()
+            if not text:
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError:
+                row = None
+            yield line, row if isinstance(row, dict) else None
+        return
+
+    reader = csv.DictReader(stream)
+    reader.fieldnames = [name.strip() for name in reader.fieldnames or []]
+    for row in reader:
+        if isinstance(row.get('investmentFocus'), str):
+            row['investmentFocus'] = [item.strip() for item in row['investmentFocus'].split(';') if item.strip()]
+        yield reader.line_num, row
+
+
+def _setup_worker():
+    # Spawned (non-forked) workers start without Django configured
+    if not apps.ready:
+        django.setup()
+
+
+class BulkOnboardingImporter:
+    """
+    Creates users of one type, with the same initial profile registration
+    gives them, from a stream of rows.
+
+    Rows are taken ``chunk_size`` at a time. Each chunk is validated with the
+    register serializer, checked against existing emails in one query, has its
+    passwords hashed across ``workers`` processes and is inserted with
+    bulk_create in its own transaction. Rejected rows are yielded as errors and
+    never abort the import.
+    """
+
+    def __init__(self, user_type, chunk_size=500, workers=None):
+        if user_type not in REGISTER_SERIALIZERS:
+            raise ValueError(f"Unknown user type: {user_type}")
+        self.user_type = user_type
+        self.serializer_class = REGISTER_SERIALIZERS[user_type]
+        self.chunk_size = chunk_size
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.counts = {'created': 0, 'failed': 0}
+        self._seen = set()
+
+    def run(self, rows):
+        """Import (line, row) pairs; yields {'line', 'email', 'errors'} for each rejected row."""
+        executor = ProcessPoolExecutor(self.workers, initializer=_setup_worker) if self.workers > 1 else None
+        try:
+            rows = iter(rows)
+            while chunk := list(islice(rows, self.chunk_size)):
+                yield from self._import_chunk(chunk, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _import_chunk(self, chunk, executor):
+        errors, valid = [], []
+        for line, row in chunk:
+            if row is None:
+                errors.append(self._error(line, None, {'row': ["Malformed JSON line."]}))
+                continue
+            serializer = self.serializer_class(data=row, context={'bulk': True})
+            if not serializer.is_valid():
+                errors.append(self._error(line, row.get('email'), serializer.errors))
+                continue
+            data = dict(serializer.validated_data)
+            data['email'] = User.objects.normalize_email(data['email'])
+            if data['email'].lower() in self._seen:
+                errors.append(self._error(line, data['email'], {'email': ["Duplicate email in this import."]}))
+                continue
+            self._seen.add(data['email'].lower())
+            valid.append((line, data))
+
+        emails = [data['email'].lower() for _, data in valid]
+        taken = set()
+        if emails:
+            existing = User.objects.annotate(email_lower=Lower('email'), username_lower=Lower('username')).filter(
+                Q(email_lower__in=emails) | Q(username_lower__in=emails)
+            )
+            for pair in existing.values_list('email_lower', 'username_lower'):
+                taken.update(pair)
+        pending = []
+        for line, data in valid:
+            if data['email'].lower() in taken:
+                errors.append(self._error(line, data['email'], {'email': ["A user with this email already exists."]}))
+            else:
+                pending.append((line, data))
+
+        passwords = [data['password'] for _, data in pending]
+        if executor is None:
+            hashes = [make_password(password) for password in passwords]
+        else:
+            hashes = list(executor.map(make_password, passwords, chunksize=max(1, len(passwords) // (self.workers * 4))))
+        pending = [(line, data, password) for (line, data), password in zip(pending, hashes)]
+
+        try:
+            with db_transaction.atomic():
+                self._insert(pending)
+        except IntegrityError:
+            # An email was registered after the check above; insert one by one to find the row
+            for item in pending:
+                try:
+                    with db_transaction.atomic():
+                        self._insert([item])
+                except IntegrityError:
+                    errors.append(self._error(item[0], item[1]['email'], {'email': ["A user with this email already exists."]}))
+
+        self.counts['failed'] += len(errors)
+        return sorted(errors, key=lambda error: error['line'])
+
+    def _insert(self, pending):
+        if not pending:
+            return
+        users = User.objects.bulk_create([
+            User(
+                username=data['email'], email=data['email'], password=password, user_type=self.user_type,
+                first_name=data['first_name'], last_name=data['last_name'],
+            )
+            for _, data, password in pending
+        ])
+        profiles = [self.serializer_class.build_profile(user, **data) for user, (_, data, _) in zip(users, pending)]
+        profiles = type(profiles[0]).objects.bulk_create(profiles)
+        if self.user_type == User.UserType.LENDER:
+            # bulk_create skips post_save, which queues the welcome email on single registrations
+            enqueue(*(lender_notifications.welcome(profile) for profile in profiles))
+        self.counts['created'] += len(users)
+
+    @staticmethod
+    def _error(line, email, errors):
+        return {'line': line, 'email': email, 'errors': errors}
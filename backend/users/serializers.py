@@ -1,9 +1,24 @@
+from django.db.models import Q
 from rest_framework import serializers
 from .models import User
 from sme.models import BusinessProfile
 from lender.models import LenderProfile # Import LenderProfile
 
-class SmeRegisterSerializer(serializers.ModelSerializer):
+class NewUserEmailMixin:
+    """
+    Normalises the email and rejects one already registered as an email or username
+    (registrations use the email as the username). Bulk onboarding checks a whole chunk
+    in one query instead and passes ``bulk=True`` in the context to skip this lookup.
+    """
+
+    def validate_email(self, value):
+        email = User.objects.normalize_email(value)
+        if not self.context.get('bulk') and User.objects.filter(Q(email__iexact=email) | Q(username__iexact=email)).exists():
+            raise serializers.ValidationError("A user with this email already exists.")
+        return email
+
+
+class SmeRegisterSerializer(NewUserEmailMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     
     # --- FIELDS ADDED TO MATCH README ---
@@ -23,6 +38,7 @@ class SmeRegisterSerializer(serializers.ModelSerializer):
         last_name = validated_data.pop('last_name')
         
         user = User.objects.create_user(
+            username=validated_data['email'],
             email=validated_data['email'],
             password=validated_data['password'],
             user_type=User.UserType.SME,
@@ -30,15 +46,20 @@ class SmeRegisterSerializer(serializers.ModelSerializer):
             last_name=last_name
         )
         # Create the initial business profile with all provided data
-        BusinessProfile.objects.create(
+        self.build_profile(user, business_name=business_name, phone_number=phone_number).save()
+        return user
+
+    @staticmethod
+    def build_profile(user, business_name, phone_number, **extra):
+        """Unsaved initial BusinessProfile for a newly registered SME (shared with bulk onboarding)."""
+        return BusinessProfile(
             user=user, 
             business_name=business_name,
             business_phone=phone_number,
-            business_email=validated_data['email'] # Pre-fill email
+            business_email=user.email # Pre-fill email
         )
-        return user
 
-class LenderRegisterSerializer(serializers.ModelSerializer):
+class LenderRegisterSerializer(NewUserEmailMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     
     # --- FIELDS ADDED TO MATCH README ---
@@ -63,6 +84,7 @@ class LenderRegisterSerializer(serializers.ModelSerializer):
         investment_focus = validated_data.pop('investment_focus')
 
         user = User.objects.create_user(
+            username=validated_data['email'],
             email=validated_data['email'],
             password=validated_data['password'],
             user_type=User.UserType.LENDER,
@@ -71,14 +93,23 @@ class LenderRegisterSerializer(serializers.ModelSerializer):
         )
         
         # Create the initial lender profile
+        self.build_profile(
+            user, first_name=first_name, last_name=last_name, phone_number=phone_number,
+            organization_name=organization_name, investment_focus=investment_focus
+        ).save()
+        return user
+
+    @staticmethod
+    def build_profile(user, first_name, last_name, phone_number, organization_name, investment_focus, **extra):
+        """Unsaved initial LenderProfile for a newly registered lender (shared with bulk onboarding)."""
         # Note: The README specifies fields like organizationName, but the LenderProfile model
         # has required fields like 'lender_type', 'years_in_operation', etc.
         # This will create a basic profile; the lender must update it via POST /api/lender/profile/
-        LenderProfile.objects.create(
+        return LenderProfile(
             user=user,
             company_name=organization_name,
             contact_phone=phone_number,
-            contact_email=validated_data['email'],
+            contact_email=user.email,
             preferred_industries=investment_focus,
             
             # Add dummy data for required fields not in README registration
@@ -89,7 +120,6 @@ class LenderRegisterSerializer(serializers.ModelSerializer):
             contact_person=f"{first_name} {last_name}",
             office_address="Pending update"
         )
-        return user
 
 class UserLoginSerializer(serializers.Serializer):
     email = serializers.EmailField()
@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
@@ -86,3 +86,165 @@ class UserRegistrationTests(APITestCase):
         }
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ProfileClaimsTests(APITestCase):
+    """Role and profile id travel in the JWT so stateless views skip profile lookups"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        from lender.models import LenderProfile
+        cache.clear()  # search-filter lists are cached per user
+        self.user = User.objects.create_user(
+            username='claims@example.com', email='claims@example.com', password='testpass123', user_type='lender'
+        )
+        self.profile = LenderProfile.objects.create(
+            user=self.user, lender_type='bank', company_name='Claims Capital', company_registration_number='RC9',
+            years_in_operation=3, total_assets=1000000, preferred_industries=['retail'], min_loan_amount=1000,
+            max_loan_amount=100000, risk_appetite=5, contact_person='Ada', contact_email='ada@claims.ng',
+            contact_phone='+2348000000000', office_address='Lagos'
+        )
+
+    def test_login_issues_profile_claims(self):
+        from unittest.mock import patch
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        with patch('users.views.authenticate', return_value=self.user):
+            response = self.client.post(reverse('login'), {'email': 'claims@example.com', 'password': 'testpass123'}, format='json')
+        token = AccessToken(response.data['data']['token'])
+        self.assertEqual((token['user_type'], token['profile_id'], token['is_staff']), ('lender', self.profile.id, False))
+
+    def test_refresh_picks_up_a_profile_created_after_login(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+        from .tokens import ProfileRefreshToken
+
+        sme = User.objects.create_user(username='late@example.com', email='late@example.com', password='x', user_type='sme')
+        refresh = ProfileRefreshToken.for_user(sme)
+        self.assertIsNone(refresh.access_token['profile_id'])
+
+        from sme.models import BusinessProfile
+        profile = BusinessProfile.objects.create(user=sme, business_name='Late Ltd')
+        response = self.client.post(reverse('refresh-token'), {'refreshToken': str(refresh)}, format='json')
+        self.assertEqual(AccessToken(response.data['data']['token'])['profile_id'], profile.id)
+
+    def test_stateless_views_skip_user_and_profile_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .tokens import ProfileRefreshToken
+
+        token = ProfileRefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/lender/search-filters/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('users_user', tables)
+        self.assertNotIn('lender_profiles', tables)
+
+        response = self.client.post('/api/lender/search-filters/', {'name': 'Retail', 'filters': {}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.profile.search_filters.count(), 1)
+
+    def test_search_filter_list_is_cached_until_a_filter_changes(self):
+        from .tokens import ProfileRefreshToken
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {ProfileRefreshToken.for_user(self.user).access_token}')
+        self.client.get('/api/lender/search-filters/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/lender/search-filters/').status_code, status.HTTP_200_OK)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/lender/search-filters/', {'name': 'Retail', 'filters': {}}, format='json')
+        response = self.client.get('/api/lender/search-filters/')
+        self.assertEqual(response.data['count'], 1)
+
+    def test_tokens_without_claims_fall_back_to_lookups(self):
+        from rest_framework_simplejwt.tokens import RefreshToken
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        with self.assertNumQueries(3):  # user_type, profile id, filters
+            response = self.client.get('/api/lender/search-filters/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BulkOnboardingTests(APITestCase):
+    CSV = (
+        "email,password,firstName,lastName,phoneNumber,businessName\n"
+        "ada@shop.ng,pass1234,Ada,Obi,+2348000000001,Ada Stores\n"
+        "taken@shop.ng,pass1234,Tayo,Ade,+2348000000002,Taken Ltd\n"
+        "no-name@shop.ng,pass1234,,Ade,+2348000000003,\n"
+        "ADA@shop.ng,pass1234,Ada,Again,+2348000000004,Ada Twice\n"
+        "bola@shop.ng,pass1234,Bola,Eze,+2348000000005,Bola Foods\n"
+    )
+
+    def setUp(self):
+        User.objects.create_user(username='taken@shop.ng', email='taken@shop.ng', password='x', user_type='sme')
+
+    def test_command_imports_valid_rows_and_reports_the_rest(self):
+        import io, json, os, tempfile
+        from django.core.management import call_command
+        from sme.models import BusinessProfile
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write(self.CSV)
+        self.addCleanup(os.remove, handle.name)
+        out = io.StringIO()
+        # Two chunks, passwords hashed in two worker processes
+        call_command('import_onboarding', 'sme', handle.name, '--chunk-size', '3', '--workers', '2', stdout=out, stderr=io.StringIO())
+
+        errors = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([(error['line'], list(error['errors'])) for error in errors], [
+            (3, ['email']), (4, ['firstName', 'businessName']), (5, ['email'])
+        ])
+        ada = User.objects.get(email='ada@shop.ng')
+        self.assertTrue(ada.check_password('pass1234'))
+        self.assertEqual((ada.username, ada.user_type), ('ada@shop.ng', 'sme'))
+        self.assertEqual(
+            sorted(BusinessProfile.objects.values_list('business_name', 'business_email')),
+            [('Ada Stores', 'ada@shop.ng'), ('Bola Foods', 'bola@shop.ng')]
+        )
+
+    def test_endpoint_is_staff_only_and_queues_lender_welcomes(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from core.models import OutboxMessage
+        from lender.models import LenderProfile
+
+        rows = (
+            '{"email": "fund@bank.ng", "password": "pass1234", "firstName": "Ngozi", "lastName": "Okafor", '
+            '"phoneNumber": "+2348000000009", "organizationName": "Fund Bank", "investmentFocus": ["retail"]}\n'
+            'not json\n'
+        )
+        upload = lambda: SimpleUploadedFile('lenders.jsonl', rows.encode())
+        url = reverse('bulk-onboarding')
+
+        self.client.force_authenticate(User.objects.get(email='taken@shop.ng'))
+        response = self.client.post(url, {'file': upload(), 'userType': 'lender'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = User.objects.create_user(username='ops@pulsefi.ng', email='ops@pulsefi.ng', password='x', is_staff=True)
+        self.client.force_authenticate(admin)
+        with self.settings(BULK_ONBOARDING_HASH_WORKERS=1):
+            response = self.client.post(url, {'file': upload(), 'userType': 'lender'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data['data']
+        self.assertEqual((data['created'], data['failed'], data['errors'][0]['line']), (1, 1, 2))
+
+        profile = LenderProfile.objects.get(user__email='fund@bank.ng')
+        self.assertEqual((profile.company_name, profile.preferred_industries), ('Fund Bank', ['retail']))
+        self.assertTrue(OutboxMessage.objects.filter(topic='lender.registered', payload__to=['fund@bank.ng']).exists())
+
+    def test_single_registration_matches_bulk_user_shape(self):
+        """Single registration uses the normalised email as the username and rejects case-variant duplicates"""
+        url = reverse('sme-register')
+        data = {
+            'email': 'Owner@Shop.NG', 'password': 'pass1234', 'firstName': 'Ada', 'lastName': 'Obi',
+            'phoneNumber': '+2348000000010', 'businessName': 'Ada Stores'
+        }
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user = User.objects.get(email='Owner@shop.ng')
+        self.assertEqual(user.username, user.email)
+
+        response = self.client.post(url, dict(data, email='OWNER@SHOP.NG'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,62 @@
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+def _profile_model(user_type):
+    if user_type == 'sme':
+        from sme.models import BusinessProfile
+        return BusinessProfile
+    if user_type == 'lender':
+        from lender.models import LenderProfile
+        return LenderProfile
+    return None
+
+
+def lookup_profile_id(user_id, user_type):
+    """Id of the user's business or lender profile, or None if it has not been created yet."""
+    model = _profile_model(user_type)
+    if model is None:
+        return None
+    return model.objects.filter(user_id=user_id).values_list('id', flat=True).first()
+
+
+def add_profile_claims(token, user, profile_id=None):
+    """Stamp role and profile id onto a token so stateless requests need no DB lookups."""
+    token['user_type'] = user.user_type
+    token['is_staff'] = user.is_staff
+    token['profile_id'] = profile_id if profile_id is not None else lookup_profile_id(user.id, user.user_type)
+    return token
+
+
+class ProfileRefreshToken(RefreshToken):
+    """Refresh token whose access tokens carry user_type, is_staff and profile_id claims."""
+
+    @classmethod
+    def for_user(cls, user, profile_id=None):
+        return add_profile_claims(super().for_user(user), user, profile_id)
+
+
+class ProfileTokenUser(TokenUser):
+    """
+    Request user built from token claims alone (SIMPLE_JWT['TOKEN_USER_CLASS']).
+
+    Used by views on JWTStatelessUserAuthentication. Tokens issued before the
+    claims existed, or before the profile was created, fall back to one query.
+    Deactivation takes effect when the access token expires, not immediately.
+    """
+
+    @cached_property
+    def user_type(self):
+        user_type = self.token.get('user_type')
+        if user_type is None:
+            from .models import User
+            user_type = User.objects.filter(pk=self.id).values_list('user_type', flat=True).first()
+        return user_type
+
+    @cached_property
+    def profile_id(self):
+        profile_id = self.token.get('profile_id')
+        if profile_id is None:
+            profile_id = lookup_profile_id(self.id, self.user_type)
+        return profile_id
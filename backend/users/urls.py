@@ -1,9 +1,10 @@
 from django.urls import path
-from .views import SmeRegisterView, LenderRegisterView, LoginView, RefreshTokenView
+from .views import SmeRegisterView, LenderRegisterView, LoginView, RefreshTokenView, BulkOnboardingView
 
 urlpatterns = [
     path('register/sme', SmeRegisterView.as_view(), name='sme-register'),
     path('register/lender', LenderRegisterView.as_view(), name='lender-register'),
+    path('register/bulk', BulkOnboardingView.as_view(), name='bulk-onboarding'),
     path('login', LoginView.as_view(), name='login'),
     path('refresh', RefreshTokenView.as_view(), name='refresh-token'),
 ]
\ No newline at end of file
@@ -1,14 +1,22 @@
+import io
+from django.conf import settings
 from rest_framework import generics, status
+from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from django.contrib.auth import authenticate
 # --- UPDATED IMPORTS ---
 from .serializers import SmeRegisterSerializer, LenderRegisterSerializer, UserLoginSerializer, UserSerializer, RefreshTokenSerializer
 from .models import User
+from .tokens import ProfileRefreshToken, add_profile_claims
+from .onboarding import REGISTER_SERIALIZERS, BulkOnboardingImporter, iter_rows
 
 class SmeRegisterView(generics.CreateAPIView):
     """POST /auth/sme/register"""
+    throttle_scope = 'auth'
     queryset = User.objects.all()
     serializer_class = SmeRegisterSerializer
 
@@ -16,7 +24,7 @@ class SmeRegisterView(generics.CreateAPIView):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
-            refresh = RefreshToken.for_user(user)
+            refresh = ProfileRefreshToken.for_user(user)
             return Response({
                 "success": True,
                 "message": "SME registered successfully",
@@ -36,6 +44,7 @@ class SmeRegisterView(generics.CreateAPIView):
 
 class LenderRegisterView(generics.CreateAPIView):
     """POST /auth/lender/register"""
+    throttle_scope = 'auth'
     queryset = User.objects.all()
     serializer_class = LenderRegisterSerializer
 
@@ -43,7 +52,7 @@ class LenderRegisterView(generics.CreateAPIView):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
-            refresh = RefreshToken.for_user(user)
+            refresh = ProfileRefreshToken.for_user(user)
             return Response({
                 "success": True,
                 "message": "Lender registered successfully",
@@ -63,6 +72,7 @@ class LenderRegisterView(generics.CreateAPIView):
 
 class LoginView(APIView):
     """POST /auth/login"""
+    throttle_scope = 'auth'
     # --- ADDED THIS LINE ---
     serializer_class = UserLoginSerializer
 
@@ -82,14 +92,14 @@ class LoginView(APIView):
         user = authenticate(request, email=email, password=password)
 
         if user is not None and (not user_type or user.user_type == user_type):
-            refresh = RefreshToken.for_user(user)
-            
             # Get profile data
             profile_data = {}
+            profile_id = None
             if user.user_type == 'sme':
                 try:
                     from sme.models import BusinessProfile
                     profile = BusinessProfile.objects.get(user=user)
+                    profile_id = profile.id
                     profile_data = {
                         "businessName": profile.business_name,
                         "verificationStatus": profile.verification_status,
@@ -104,6 +114,9 @@ class LoginView(APIView):
                         "profitScore": None
                     }
             
+            # Role and profile id ride in the token, so later requests need not look them up
+            refresh = ProfileRefreshToken.for_user(user, profile_id=profile_id)
+            
             return Response({
                 "success": True,
                 "message": "Login successful",
@@ -124,6 +137,7 @@ class LoginView(APIView):
 
 class RefreshTokenView(APIView):
     """POST /auth/refresh"""
+    throttle_scope = 'auth'
     # --- ADDED THIS LINE ---
     serializer_class = RefreshTokenSerializer
 
@@ -137,10 +151,13 @@ class RefreshTokenView(APIView):
         
         try:
             refresh = RefreshToken(refresh_token)
+            user = User.objects.get(pk=refresh[jwt_settings.USER_ID_CLAIM], is_active=True)
+            # Re-read the claims: the profile may have been created since login
+            access = add_profile_claims(refresh.access_token, user)
             return Response({
                 "success": True,
                 "data": {
-                    "token": str(refresh.access_token),
+                    "token": str(access),
                     "refreshToken": str(refresh)
                 }
             })
@@ -148,4 +165,42 @@ class RefreshTokenView(APIView):
             return Response({
                 "success": False,
                 "message": "Invalid refresh token"
-            }, status=status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+
+class BulkOnboardingView(APIView):
+    """POST /auth/register/bulk - Register many SMEs or lenders from a CSV or JSON-lines upload (Admin only)"""
+    throttle_scope = 'upload'
+    query_budget = None  # grows with the upload; each chunk is a fixed number of queries
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request):
+        if not request.user.is_staff:
+            return Response({
+                "success": False,
+                "message": "Admin access required"
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        upload = request.FILES.get('file')
+        user_type = request.data.get('userType')
+        if upload is None or user_type not in REGISTER_SERIALIZERS:
+            return Response({
+                "success": False,
+                "message": "Expected a 'file' upload and a userType of 'sme' or 'lender'"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = request.data.get('format') or ('jsonl' if upload.name.endswith(('.jsonl', '.ndjson')) else 'csv')
+        importer = BulkOnboardingImporter(user_type, workers=settings.BULK_ONBOARDING_HASH_WORKERS)
+        # The upload is decoded and parsed line by line rather than read into memory
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        errors = list(importer.run(iter_rows(stream, file_format)))
+
+        return Response({
+            "success": True,
+            "data": {
+                "created": importer.counts['created'],
+                "failed": importer.counts['failed'],
+                "errors": errors
+            }
+        }, status=status.HTTP_200_OK)